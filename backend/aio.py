@@ -0,0 +1,110 @@
+"""Event loop compartido para el pipeline asíncrono.
+
+Flask sigue siendo síncrono, pero un análisis pasa casi toda su vida
+esperando a la red (Amadeus, Whisper, Claude). En lugar de ocupar un hilo
+por análisis, las corrutinas del pipeline corren en un único event loop de
+asyncio en un hilo propio: los endpoints le envían una corrutina con
+submit() (o run() si necesitan esperar el resultado) y cientos de análisis
+en espera comparten ese hilo.
+
+Lo que no tiene versión asíncrona se ejecuta en pools de hilos acotados
+para no bloquear el loop, separados por duración: run_media() para el
+trabajo largo (yt-dlp, pydub, redirecciones de enlaces cortos, de segundos
+a decenas de segundos) y run_blocking() para el corto (SQLite, hashes,
+token de Amadeus). Así una lectura de caché no espera detrás de descargas.
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger('instatrip.aio')
+
+
+class EventLoopThread:
+    """Un event loop de asyncio en un hilo daemon, arrancado la primera vez que se usa"""
+
+    def __init__(self, name='aio-loop', blocking_workers=8, media_workers=8):
+        self.name = name
+        self.blocking_workers = blocking_workers
+        self.media_workers = media_workers
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._media_executor = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.blocking_workers,
+                                                    thread_name_prefix=f'{self.name}-blocking')
+                self._media_executor = ThreadPoolExecutor(max_workers=self.media_workers,
+                                                          thread_name_prefix=f'{self.name}-media')
+                self._loop = asyncio.new_event_loop()
+                self._loop.set_default_executor(self._executor)
+                ready = threading.Event()
+                self._thread = threading.Thread(target=self._run_forever, args=(ready,), name=self.name, daemon=True)
+                self._thread.start()
+                ready.wait()
+                log.info("🔁 Event loop asíncrono arrancado (%s hilos para tareas bloqueantes, %s para medios)",
+                         self.blocking_workers, self.media_workers)
+            return self._loop
+
+    def _run_forever(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(ready.set)
+        self._loop.run_forever()
+
+    def in_loop(self):
+        """True si se llama desde el propio hilo del loop"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        """Programa la corrutina en el loop desde cualquier hilo → concurrent.futures.Future"""
+        self.submitted += 1
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Ejecuta la corrutina en el loop y espera su resultado (no llamar desde el loop)"""
+        if self.in_loop():
+            raise RuntimeError("run() bloquearía el event loop; usa await")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """Ejecuta una función bloqueante y breve en el pool de hilos (el executor por defecto del loop)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: fn(*args, **kwargs))
+
+    async def run_media(self, fn, *args, **kwargs):
+        """Como run_blocking() pero en el pool del trabajo largo (descargas, audio)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._media_executor, lambda: fn(*args, **kwargs))
+
+    def stats(self):
+        loop = self._loop
+        if loop is None:
+            return {'running': False, 'tasks': 0, 'submitted': self.submitted}
+        # all_tasks() solo es fiable desde el propio loop: se cuenta allí
+        try:
+            tasks = asyncio.run_coroutine_threadsafe(self._count_tasks(), loop).result(1)
+        except Exception:
+            tasks = None
+        return {
+            'running': loop.is_running(),
+            'tasks': tasks,
+            'submitted': self.submitted,
+            'blocking_workers': self.blocking_workers,
+            'media_workers': self.media_workers
+        }
+
+    @staticmethod
+    async def _count_tasks():
+        return len(asyncio.all_tasks()) - 1  # Sin contar esta
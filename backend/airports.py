@@ -0,0 +1,155 @@
+"""Índice en memoria de aeropuertos y códigos IATA de ciudad.
+
+Datos incluidos en data/:
+- airports.csv: aeropuertos con código IATA (iata, nombre, ciudad, país),
+  extraído del paquete airportsdata (MIT, ver data/LICENSE.airportsdata).
+- city_codes.csv: códigos de ciudad con varios aeropuertos (LON, PAR, ROM...).
+- city_aliases.csv: nombres en español u otras variantes que no coinciden
+  con la ciudad del dataset (Londres → LON, Mallorca → PMI...).
+
+Los nombres de ciudad se indexan sin tildes ni mayúsculas, así que
+"Malaga", "málaga" y "MÁLAGA" resuelven igual.
+"""
+import csv
+import os
+import re
+import unicodedata
+from collections import namedtuple
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+Airport = namedtuple('Airport', ['iata', 'name', 'city', 'country'])
+CityCode = namedtuple('CityCode', ['code', 'city', 'country', 'airports'])
+
+# Con ciudades homónimas (Valencia ES/VE, Córdoba ES/AR) y sin país explícito
+# se prefiere España: el origen por defecto y la mayoría de usuarios están aquí
+PREFERRED_COUNTRY = 'ES'
+
+# Aeropuertos que no deben elegirse como "principal" de una ciudad
+SECONDARY_AIRPORT = re.compile(r'\b(air base|afb|raf|heliport|military|naval|seaplane)\b', re.IGNORECASE)
+
+
+def normalize_name(name):
+    """'  São  Paulo ' → 'sao paulo' (sin tildes, minúsculas, espacios simples)"""
+    text = unicodedata.normalize('NFKD', name or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r'[\s\-_.,/]+', ' ', text.lower())
+    return text.strip()
+
+
+def _airport_rank(airport):
+    # Menor es mejor: país preferido, internacionales, y bases militares y helipuertos al final
+    if SECONDARY_AIRPORT.search(airport.name):
+        kind = 2
+    elif 'international' in airport.name.lower():
+        kind = 0
+    else:
+        kind = 1
+    return (airport.country != PREFERRED_COUNTRY, kind, airport.iata)
+
+
+class AirportIndex:
+    """Búsquedas por código IATA (aeropuerto o ciudad) y por nombre de ciudad"""
+
+    def __init__(self):
+        self.airports = {}        # IATA aeropuerto → Airport
+        self.city_codes = {}      # IATA ciudad → CityCode
+        self.airport_city = {}    # IATA aeropuerto → IATA ciudad (solo ciudades multi-aeropuerto)
+        self.by_city_name = {}    # nombre normalizado → [códigos, el preferido primero]
+
+    @classmethod
+    def load(cls, data_dir=DATA_DIR):
+        index = cls()
+
+        with open(os.path.join(data_dir, 'airports.csv'), encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                airport = Airport(row['iata'], row['name'], row['city'], row['country'])
+                index.airports[airport.iata] = airport
+
+        with open(os.path.join(data_dir, 'city_codes.csv'), encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                code = row['city_code']
+                city = index.city_codes.get(code)
+                if city is None:
+                    city = CityCode(code, row['city'], row['country'], [])
+                    index.city_codes[code] = city
+                city.airports.append(row['iata'])
+                if row['iata'] != code:
+                    index.airport_city[row['iata']] = code
+
+        # Nombre de ciudad → códigos: primero el código de ciudad si existe,
+        # después los aeropuertos ordenados por relevancia
+        names = {}
+        for airport in index.airports.values():
+            if airport.city:
+                names.setdefault(normalize_name(airport.city), []).append(airport)
+        for name, airports in names.items():
+            airports.sort(key=_airport_rank)
+            index.by_city_name[name] = [a.iata for a in airports]
+        for city in index.city_codes.values():
+            codes = index.by_city_name.setdefault(normalize_name(city.city), [])
+            if city.code in codes:
+                codes.remove(city.code)
+            codes.insert(0, city.code)
+
+        with open(os.path.join(data_dir, 'city_aliases.csv'), encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                index.by_city_name[normalize_name(row['alias'])] = [row['code']]
+
+        return index
+
+    def is_valid(self, code):
+        code = (code or '').upper()
+        return code in self.airports or code in self.city_codes
+
+    def get(self, code):
+        """Airport de un código de aeropuerto, o None"""
+        return self.airports.get((code or '').upper())
+
+    def city_name(self, code):
+        """Nombre de la ciudad de un código de aeropuerto o de ciudad"""
+        code = (code or '').upper()
+        if code in self.city_codes:
+            return self.city_codes[code].city
+        airport = self.airports.get(code)
+        return airport.city if airport and airport.city else None
+
+    def country(self, code):
+        code = (code or '').upper()
+        if code in self.city_codes:
+            return self.city_codes[code].country
+        airport = self.airports.get(code)
+        return airport.country if airport else None
+
+    def city_code_for(self, code):
+        """Código de ciudad de un aeropuerto (FCO → ROM); el propio código si no tiene"""
+        code = (code or '').upper()
+        return self.airport_city.get(code, code)
+
+    def resolve_city(self, name, country=None):
+        """Código preferido para un nombre de ciudad (sin tildes); None si no se conoce.
+
+        country (ISO de 2 letras) desambigua ciudades homónimas en varios países.
+        """
+        codes = self.by_city_name.get(normalize_name(name))
+        if not codes:
+            return None
+        if country and len(country) == 2:
+            for code in codes:
+                if self.country(code) == country.upper():
+                    return code
+        return codes[0]
+
+    def validate(self, code, city=None, country=None):
+        """Devuelve un código IATA válido: el recibido si existe o el de la ciudad.
+
+        Sirve para comprobar los códigos que genera el LLM antes de llamar a
+        Amadeus: un código inventado se corrige a partir del nombre de la
+        ciudad y, si tampoco se conoce, devuelve None para no hacer la búsqueda.
+        """
+        code = (code or '').strip().upper()
+        if self.is_valid(code):
+            return code
+        if city:
+            return self.resolve_city(city, country)
+        return None
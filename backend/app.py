@@ -1,283 +1,781 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import anthropic
+import asyncio
+import contextlib
 import os
+import ipaddress
 import re
+import shutil
 import tempfile
+import threading
+import time
 import yt_dlp
-from openai import OpenAI
+from openai import AsyncOpenAI
 import json
+import logging
+import queue
 from pathlib import Path
 from dotenv import load_dotenv
 from urllib.parse import quote
 from datetime import datetime, timedelta
-import requests
+from pydub import AudioSegment
+from pydub.silence import detect_silence
+from pydub.utils import mediainfo
+from aio import EventLoopThread
+from airports import AirportIndex
+from batch import SharedLookups, StageLimits
+from breakers import CircuitOpenError, breakers_stats, failed_status, get_breaker
+from cache import CACHE_DIR, ResultCache, TranscriptCache, TwoTierCache, file_sha256, video_cache_key
+from deadlines import Deadline, DeadlineExceeded, budget_for, timeout_for
+from http_sessions import get_async_client, get_session, sessions_stats
+from geoip import GeoLocator
+from hotels import HotelSelector, chunked, nights_between
+from jobs import JobManager, QueueFullError
+from json_stream import IncrementalJSONParser
+from logs import configure_logging
+from metrics import REGISTRY
+from scheduler import RateLimiter, RateLimitTimeout
+from singleflight import AsyncSingleFlight
+from tokens import TokenManager
+from video_urls import VideoURLResolver
 
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+# Logging con nivel y formato configurables (LOG_LEVEL, LOG_FORMAT)
+configure_logging()
+log = logging.getLogger('instatrip.app')
+
 app = Flask(__name__)
 CORS(app)
 
+# Los análisis corren como corrutinas en un event loop compartido (Amadeus, Whisper,
+# Claude y geolocalización con clientes async; yt-dlp y pydub en un pool de hilos y
+# SQLite en otro, para que las lecturas de caché no esperen detrás de las descargas).
+# Los endpoints de Flask esperan al loop con aio_loop.run()
+aio_loop = EventLoopThread(blocking_workers=int(os.environ.get("ASYNC_BLOCKING_WORKERS", 8)),
+                           media_workers=int(os.environ.get("ASYNC_MEDIA_WORKERS", 8)))
+
 # Inicializar clientes de IA
-anthropic_client = anthropic.Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+anthropic_client = anthropic.AsyncAnthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+# Métricas (GET /api/metrics): latencia por etapa y por servicio externo
+STAGE_SECONDS = REGISTRY.histogram(
+    'instatrip_stage_duration_seconds', 'Duración de cada etapa del análisis', ['stage'])
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    'instatrip_upstream_request_duration_seconds', 'Duración de las llamadas a servicios externos', ['upstream', 'operation'])
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    'instatrip_upstream_responses_total', 'Respuestas de servicios externos por código de estado', ['upstream', 'operation', 'status'])
+ANALYSES = REGISTRY.counter(
+    'instatrip_analyses_total', 'Análisis terminados por resultado', ['result'])
+DOWNLOAD_BYTES = REGISTRY.counter(
+    'instatrip_download_bytes_total', 'Bytes de audio descargados con yt-dlp')
+AUDIO_SECONDS = REGISTRY.counter(
+    'instatrip_audio_seconds_total', 'Segundos de audio descargados para transcribir')
+LLM_TOKENS = REGISTRY.counter(
+    'instatrip_llm_tokens_total', 'Tokens del LLM por tipo', ['type'])
+LLM_FIRST_TOKEN_SECONDS = REGISTRY.histogram(
+    'instatrip_llm_time_to_first_token_seconds', 'Tiempo hasta el primer token del LLM')
+DEADLINE_EXCEEDED = REGISTRY.counter(
+    'instatrip_deadline_exceeded_total', 'Análisis que agotaron su plazo, por etapa', ['stage'])
 
 # Configuración de Amadeus
 AMADEUS_API_KEY = os.environ.get("AMADEUS_API_KEY")
 AMADEUS_API_SECRET = os.environ.get("AMADEUS_API_SECRET")
-amadeus_token = None
-amadeus_token_expires = None
+AMADEUS_BASE_URL = os.environ.get("AMADEUS_BASE_URL", "https://test.api.amadeus.com").rstrip('/')  # Producción: https://api.amadeus.com
+# Clientes HTTP compartidos (keep-alive + reintentos con jitter en 429/5xx). El token se
+# pide desde el hilo del TokenManager con una sesión de requests; el resto, desde el loop
+amadeus_token_http = get_session('amadeus')
+amadeus_http = get_async_client('amadeus')
+# Límite de peticiones por segundo de Amadeus (10 TPS en test), compartido por todas las búsquedas.
+# Con cola, las búsquedas interactivas pasan antes que el barrido de fechas
+AMADEUS_RATE_LIMIT = float(os.environ.get("AMADEUS_RATE_LIMIT", 10))
+AMADEUS_RATE_BURST = int(os.environ.get("AMADEUS_RATE_BURST", 2))
+AMADEUS_RATE_WAIT = float(os.environ.get("AMADEUS_RATE_WAIT", 10))  # Espera máxima por un turno (s)
+amadeus_limiter = RateLimiter(AMADEUS_RATE_LIMIT, AMADEUS_RATE_BURST)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SWEEP = 1
+ip_api_http = get_async_client('ip-api')
+ipify_http = get_async_client('ipify')
+
+# Circuit breakers: con un upstream caído las llamadas fallan al instante y se usa la alternativa
+amadeus_breaker = get_breaker('amadeus')
+ip_api_breaker = get_breaker('ip-api')
+ipify_breaker = get_breaker('ipify')
+anthropic_breaker = get_breaker('anthropic')
+openai_breaker = get_breaker('openai')
+media_http = get_session('media')
+
+# Enlaces cortos (vm.tiktok.com, instagram.com/share/...) → URL canónica del video.
+# La correspondencia no cambia, así que se guarda mucho tiempo
+url_resolver = VideoURLResolver(
+    TwoTierCache(os.path.join(CACHE_DIR, 'urls.db'), table='short_links',
+                 maxsize=int(os.environ.get("VIDEO_URL_CACHE_SIZE", 1024))),
+    media_http,
+    ttl=int(os.environ.get("VIDEO_URL_CACHE_TTL", 30 * 24 * 3600)),
+    timeout=float(os.environ.get("VIDEO_URL_RESOLVE_TIMEOUT", 5))
+)
+
+# Transcripción por trozos: los audios largos se cortan en silencios y se transcriben en paralelo
+WHISPER_CHUNKED = os.environ.get("WHISPER_CHUNKED", "1") == "1"
+WHISPER_CHUNK_SECONDS = int(os.environ.get("WHISPER_CHUNK_SECONDS", 120))
+WHISPER_MAX_PARALLEL = int(os.environ.get("WHISPER_MAX_PARALLEL", 4))
+
+# Plazo de extremo a extremo de cada análisis: todas las etapas toman su timeout de lo que
+# queda. Si se agota en Amadeus se devuelve el itinerario con links de buscadores sin precios
+ANALYSIS_DEADLINE = float(os.environ.get("ANALYSIS_DEADLINE", 45))
+JOBS_DEADLINE = float(os.environ.get("JOBS_DEADLINE", 300))  # /api/jobs: nadie espera con la conexión abierta
+REPRICE_DEADLINE = float(os.environ.get("REPRICE_DEADLINE", 20))
+YTDLP_SOCKET_TIMEOUT = float(os.environ.get("YTDLP_SOCKET_TIMEOUT", 20))
+WHISPER_TIMEOUT = float(os.environ.get("WHISPER_TIMEOUT", 120))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))
+
+# Índice de aeropuertos y ciudades (dataset incluido en data/)
+airport_index = AirportIndex.load()
+
+# Geolocalización local por rangos de IP (p. ej. DB-IP Lite en CSV); ip-api.com como respaldo
+GEOIP_DB_PATH = os.environ.get("GEOIP_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ip-city.csv.gz'))
+GEOIP_REMOTE_FALLBACK = os.environ.get("GEOIP_REMOTE_FALLBACK", "1") == "1"
+GEOIP_REMOTE_URL = os.environ.get("GEOIP_REMOTE_URL", "http://ip-api.com/json/{ip}")
+geolocator = GeoLocator(GEOIP_DB_PATH, cache_size=int(os.environ.get("GEOIP_CACHE_SIZE", 4096)))
+
+# Vía rápida por metadatos: usar subtítulos/descripción en vez de descargar y transcribir
+METADATA_FAST_PATH = os.environ.get("METADATA_FAST_PATH", "1") == "1"
+METADATA_MIN_WORDS = int(os.environ.get("METADATA_MIN_WORDS", 60))
+
+# Barrido de fechas flexibles: se consultan varias salidas dentro de la ventana y se
+# quedan las más baratas; se detiene cuando un lote ya no mejora el precio o se agota el tiempo
+DATE_SWEEP = os.environ.get("DATE_SWEEP", "1") == "1"
+DATE_SWEEP_START_DAYS = int(os.environ.get("DATE_SWEEP_START_DAYS", 30))
+DATE_SWEEP_END_DAYS = int(os.environ.get("DATE_SWEEP_END_DAYS", 90))
+DATE_SWEEP_CANDIDATES = int(os.environ.get("DATE_SWEEP_CANDIDATES", 10))
+DATE_SWEEP_BATCH = int(os.environ.get("DATE_SWEEP_BATCH", 4))
+DATE_SWEEP_TOP = int(os.environ.get("DATE_SWEEP_TOP", 2))
+DATE_SWEEP_MIN_GAIN = float(os.environ.get("DATE_SWEEP_MIN_GAIN", 0.03))  # Mejora mínima por lote para seguir
+DATE_SWEEP_BUDGET = float(os.environ.get("DATE_SWEEP_BUDGET", 8))  # Segundos máximos del barrido
+
+# Caché de resultados de /api/analyze (LRU en memoria + SQLite compartido entre workers)
+# El itinerario apenas cambia; los precios de booking_links caducan pronto
+result_cache = ResultCache(
+    os.path.join(CACHE_DIR, 'results.db'),
+    itinerary_ttl=int(os.environ.get("RESULT_CACHE_ITINERARY_TTL", 7 * 24 * 3600)),
+    prices_ttl=int(os.environ.get("RESULT_CACHE_PRICES_TTL", 30 * 60)),
+    maxsize=int(os.environ.get("RESULT_CACHE_SIZE", 512))
+)
+
+# Caché de transcripciones por hash del audio (reposts y URLs distintas del mismo video)
+transcript_cache = TranscriptCache(
+    os.path.join(CACHE_DIR, 'transcripts.db'),
+    maxsize=int(os.environ.get("TRANSCRIPT_CACHE_SIZE", 256)),
+    max_disk_entries=int(os.environ.get("TRANSCRIPT_CACHE_MAX_ENTRIES", 5000))
+)
+
+def fetch_amadeus_token():
+    """Pide un token nuevo al endpoint OAuth de Amadeus → (token, expires_in)"""
+    url = f"{AMADEUS_BASE_URL}/v1/security/oauth2/token"
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    data = {
+        "grant_type": "client_credentials",
+        "client_id": AMADEUS_API_KEY,
+        "client_secret": AMADEUS_API_SECRET
+    }
+
+    if amadeus_breaker.is_open():
+        raise CircuitOpenError("Circuito de Amadeus abierto")
+    if not amadeus_limiter.acquire(PRIORITY_INTERACTIVE, timeout=AMADEUS_RATE_WAIT):
+        raise RateLimitTimeout("Sin turno en el limitador de Amadeus para pedir el token")
+    if not amadeus_breaker.allow():
+        raise CircuitOpenError("Circuito de Amadeus abierto")
+    started = time.perf_counter()
+    response = None
+    try:
+        response = amadeus_token_http.post(url, headers=headers, data=data, timeout=10)
+        amadeus_breaker.record(not failed_status(response.status_code))
+    except Exception:
+        amadeus_breaker.record(False)
+        raise
+    finally:
+        record_upstream('amadeus', 'token', started, response)
+    response.raise_for_status()
+
+    token_data = response.json()
+    # El token expira en ~30 minutos
+    return token_data['access_token'], token_data.get('expires_in', 1800)
+
+# Caché de Amadeus: datos de referencia (hoteles por ciudad) durante horas,
+# ofertas de vuelos y hoteles solo unos minutos porque los precios cambian
+AMADEUS_HOTEL_LIST_TTL = int(os.environ.get("AMADEUS_HOTEL_LIST_TTL", 24 * 3600))
+AMADEUS_OFFERS_TTL = int(os.environ.get("AMADEUS_OFFERS_TTL", 10 * 60))
+amadeus_reference_cache = TwoTierCache(
+    os.path.join(CACHE_DIR, 'amadeus.db'), table='reference',
+    maxsize=int(os.environ.get("AMADEUS_REFERENCE_CACHE_SIZE", 256))
+)
+amadeus_offers_cache = TwoTierCache(
+    os.path.join(CACHE_DIR, 'amadeus.db'), table='offers',
+    maxsize=int(os.environ.get("AMADEUS_OFFERS_CACHE_SIZE", 1024)),
+    max_disk_entries=int(os.environ.get("AMADEUS_OFFERS_MAX_ENTRIES", 20000))
+)
+
+# Ofertas de hoteles: cuántos hoteles de la ciudad se consultan, en trozos de cuántos IDs
+HOTEL_MAX_IDS = int(os.environ.get("HOTEL_MAX_IDS", 200))
+HOTEL_CHUNK_SIZE = int(os.environ.get("HOTEL_CHUNK_SIZE", 20))
+HOTEL_MAX_PARALLEL = int(os.environ.get("HOTEL_MAX_PARALLEL", 4))
+HOTEL_TOP_K = int(os.environ.get("HOTEL_TOP_K", 3))
+HOTEL_OFFERS_BUDGET = float(os.environ.get("HOTEL_OFFERS_BUDGET", 12))  # Segundos; los trozos que tarden más se descartan
+
+# Un único refresco a la vez y renovación en segundo plano antes de caducar
+amadeus_tokens = TokenManager(fetch_amadeus_token, name='token de Amadeus')
+
+async def get_amadeus_token():
+    """Token de autenticación de Amadeus (OAuth) sin bloquear el loop: el vigente o, si hay que pedirlo, desde el pool de hilos"""
+    return amadeus_tokens.current() or await aio_loop.run_blocking(amadeus_tokens.get)
+
+def record_upstream(upstream, operation, started, response=None, status=None):
+    """Duración y código de estado de una llamada a un servicio externo"""
+    UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream=upstream, operation=operation)
+    if status is None:
+        status = response.status_code if response is not None else 'error'
+    UPSTREAM_RESPONSES.inc(upstream=upstream, operation=operation, status=status)
+
+async def amadeus_get(url, priority=PRIORITY_INTERACTIVE, operation='other', deadline=None, **kwargs):
+    """GET a Amadeus tras obtener turno en el limitador de peticiones por segundo.
+
+    Con deadline, la espera por turno y el timeout de cada intento (también
+    los reintentos) se recortan a lo que quede del plazo del análisis. Con el circuito de Amadeus abierto
+    lanza CircuitOpenError sin esperar turno ni llamar.
+    """
+    if amadeus_breaker.is_open():
+        raise CircuitOpenError("Circuito de Amadeus abierto")
+    if not await amadeus_limiter.acquire_async(priority, timeout=budget_for(deadline, AMADEUS_RATE_WAIT)):
+        raise RateLimitTimeout("Sin turno en el limitador de Amadeus")
+    if not amadeus_breaker.allow():
+        raise CircuitOpenError("Circuito de Amadeus abierto")
+
+    started = time.perf_counter()
+    response = None
+    try:
+        # Con deadline, el cliente recorta el timeout de cada intento (y sus reintentos) al plazo
+        response = await amadeus_http.get(url, deadline=deadline, **kwargs)
+        amadeus_breaker.record(not failed_status(response.status_code))
+        return response
+    except Exception:
+        # Un timeout recortado por el plazo de la petición no dice nada de Amadeus
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded("Plazo agotado esperando a Amadeus")
+        amadeus_breaker.record(False)
+        raise
+    finally:
+        record_upstream('amadeus', operation, started, response)
+
+def flight_search_params(origin, destination, departure_date, return_date, adults):
+    return {
+        "originLocationCode": origin,
+        "destinationLocationCode": destination,
+        "departureDate": departure_date,
+        "returnDate": return_date,
+        "adults": adults,
+        "max": 5  # Traer 5 para elegir los 2 mejores
+    }
 
-def get_amadeus_token():
-    """Obtiene el token de autenticación de Amadeus (OAuth)"""
-    global amadeus_token, amadeus_token_expires
+async def flight_options_from_response(response, cache_key):
+    """Las 2 ofertas más baratas de una respuesta de flight-offers (y las guarda en caché)"""
+    if response.status_code != 200:
+        log.warning("⚠️  Error API Amadeus vuelos: %s", response.status_code)
+        return []
 
-    # Si tenemos un token válido, reutilizarlo
-    if amadeus_token and amadeus_token_expires and datetime.now() < amadeus_token_expires:
-        return amadeus_token
+    data = response.json()
+    offers = data.get('data', [])
 
-    try:
-        url = "https://test.api.amadeus.com/v1/security/oauth2/token"
-        headers = {"Content-Type": "application/x-www-form-urlencoded"}
-        data = {
-            "grant_type": "client_credentials",
-            "client_id": AMADEUS_API_KEY,
-            "client_secret": AMADEUS_API_SECRET
-        }
+    if not offers:
+        log.warning("⚠️  No se encontraron vuelos")
+        await amadeus_offers_cache.set_async(cache_key, [], AMADEUS_OFFERS_TTL)
+        return []
 
-        response = requests.post(url, headers=headers, data=data)
-        response.raise_for_status()
+    # Procesar y ordenar por precio
+    flight_options = []
+    for offer in offers[:2]:  # Solo los 2 primeros (ya vienen ordenados por precio)
+        price = float(offer['price']['total'])
+        currency = offer['price']['currency']
+
+        # Obtener información del vuelo
+        itineraries = offer.get('itineraries', [])
+        if itineraries:
+            first_segment = itineraries[0]['segments'][0]
+            airline_code = first_segment['carrierCode']
+            duration = itineraries[0].get('duration', 'N/A')
+            stops = len(itineraries[0]['segments']) - 1
+
+            # Formatear duración (viene como PT2H30M)
+            duration_formatted = duration.replace('PT', '').replace('H', 'h ').replace('M', 'min')
+
+            flight_options.append({
+                'airline': airline_code,
+                'price': price,
+                'currency': currency,
+                'duration': duration_formatted,
+                'stops': stops,
+                'direct': stops == 0
+            })
 
-        token_data = response.json()
-        amadeus_token = token_data['access_token']
-        # El token expira en ~30 minutos, guardamos el tiempo
-        amadeus_token_expires = datetime.now() + timedelta(seconds=token_data.get('expires_in', 1800) - 60)
+    log.info("✅ Encontrados %s vuelos", len(flight_options))
+    await amadeus_offers_cache.set_async(cache_key, flight_options, AMADEUS_OFFERS_TTL)
+    return flight_options
 
-        return amadeus_token
+async def search_flights_amadeus(origin, destination, departure_date, return_date, adults=1,
+                                 priority=PRIORITY_INTERACTIVE, deadline=None):
+    """Busca vuelos con Amadeus API y devuelve las 2 opciones más baratas.
 
-    except Exception as e:
-        print(f"Error obteniendo token de Amadeus: {str(e)}")
-        return None
+    priority se pasa al limitador: el barrido de fechas usa prioridad baja.
+    Se cancela cancelando la tarea (también mientras espera turno).
+    """
+    cache_key = f"flights:{origin}:{destination}:{departure_date}:{return_date}:{adults}"
+    cached = await amadeus_offers_cache.get_async(cache_key)
+    if cached is not None:
+        log.info("⚡ Vuelos %s → %s (%s - %s) en caché", origin, destination, departure_date, return_date)
+        return cached
 
-def search_flights_amadeus(origin, destination, departure_date, return_date, adults=1):
-    """Busca vuelos con Amadeus API y devuelve las 2 opciones más baratas"""
     try:
-        token = get_amadeus_token()
+        token = await get_amadeus_token()
         if not token:
             return []
 
-        url = "https://test.api.amadeus.com/v2/shopping/flight-offers"
+        url = f"{AMADEUS_BASE_URL}/v2/shopping/flight-offers"
         headers = {"Authorization": f"Bearer {token}"}
-        params = {
-            "originLocationCode": origin,
-            "destinationLocationCode": destination,
-            "departureDate": departure_date,
-            "returnDate": return_date,
-            "adults": adults,
-            "max": 5  # Traer 5 para elegir los 2 mejores
-        }
+        params = flight_search_params(origin, destination, departure_date, return_date, adults)
 
-        print(f"🔍 Buscando vuelos {origin} → {destination} ({departure_date} - {return_date})...")
-        response = requests.get(url, headers=headers, params=params, timeout=10)
+        log.info("🔍 Buscando vuelos %s → %s (%s - %s)...", origin, destination, departure_date, return_date)
+        response = await amadeus_get(url, priority, operation='flights', deadline=deadline,
+                                     headers=headers, params=params, timeout=10)
+        return await flight_options_from_response(response, cache_key)
 
-        if response.status_code != 200:
-            print(f"⚠️  Error API Amadeus vuelos: {response.status_code}")
-            return []
+    except CircuitOpenError:
+        return []
+    except (RateLimitTimeout, DeadlineExceeded) as e:
+        log.warning("⚠️  Búsqueda de vuelos descartada: %s", e)
+        return []
+    except Exception as e:
+        log.error("Error buscando vuelos: %s", e)
+        return []
 
-        data = response.json()
-        offers = data.get('data', [])
+def hotel_offers_params(hotel_ids, checkin, checkout):
+    return {
+        "hotelIds": ','.join(hotel_ids),
+        "checkInDate": checkin,
+        "checkOutDate": checkout,
+        "adults": 2,
+        "roomQuantity": 1
+    }
 
-        if not offers:
-            print("⚠️  No se encontraron vuelos")
-            return []
+def hotel_offers_from_response(response_offers):
+    """Lista 'data' de una respuesta de hotel-offers (vacía si falló)"""
+    if response_offers.status_code != 200:
+        log.warning("⚠️  Error API Amadeus hotel offers: %s", response_offers.status_code)
+        return []
 
-        # Procesar y ordenar por precio
-        flight_options = []
-        for offer in offers[:2]:  # Solo los 2 primeros (ya vienen ordenados por precio)
-            price = float(offer['price']['total'])
-            currency = offer['price']['currency']
-
-            # Obtener información del vuelo
-            itineraries = offer.get('itineraries', [])
-            if itineraries:
-                first_segment = itineraries[0]['segments'][0]
-                airline_code = first_segment['carrierCode']
-                duration = itineraries[0].get('duration', 'N/A')
-                stops = len(itineraries[0]['segments']) - 1
-
-                # Formatear duración (viene como PT2H30M)
-                duration_formatted = duration.replace('PT', '').replace('H', 'h ').replace('M', 'min')
-
-                flight_options.append({
-                    'airline': airline_code,
-                    'price': price,
-                    'currency': currency,
-                    'duration': duration_formatted,
-                    'stops': stops,
-                    'direct': stops == 0
-                })
+    return response_offers.json().get('data', [])
 
-        print(f"✅ Encontrados {len(flight_options)} vuelos")
-        return flight_options
+async def fetch_hotel_offers_chunk(headers, hotel_ids, checkin, checkout, deadline=None):
+    """Ofertas de un trozo de hoteles (lista 'data' de hotel-offers; vacía si falla)"""
+    url_offers = f"{AMADEUS_BASE_URL}/v3/shopping/hotel-offers"
+    params_offers = hotel_offers_params(hotel_ids, checkin, checkout)
 
+    try:
+        response_offers = await amadeus_get(url_offers, operation='hotel_offers', deadline=deadline,
+                                            headers=headers, params=params_offers, timeout=10)
+    except (RateLimitTimeout, DeadlineExceeded, CircuitOpenError):
+        return []
     except Exception as e:
-        print(f"Error buscando vuelos: {str(e)}")
+        log.warning("⚠️  Error en un trozo de ofertas de hoteles: %s", e)
         return []
 
-def search_hotels_amadeus(city_code, checkin, checkout):
-    """Busca hoteles con Amadeus API y devuelve las 2 opciones más baratas"""
-    try:
-        token = get_amadeus_token()
-        if not token:
-            return []
+    return hotel_offers_from_response(response_offers)
 
-        # Primero buscar hoteles en la ciudad
-        url_search = "https://test.api.amadeus.com/v1/reference-data/locations/hotels/by-city"
-        headers = {"Authorization": f"Bearer {token}"}
-        params_search = {"cityCode": city_code}
-
-        print(f"🔍 Buscando hoteles en {city_code} ({checkin} - {checkout})...")
-        response_search = requests.get(url_search, headers=headers, params=params_search, timeout=10)
+async def hotel_ids_from_response(response_search, list_key):
+    """IDs de hoteles de una respuesta de hotels/by-city (None si falló; se guardan en caché)"""
+    if response_search.status_code != 200:
+        log.warning("⚠️  Error API Amadeus hoteles search: %s", response_search.status_code)
+        return None
 
-        if response_search.status_code != 200:
-            print(f"⚠️  Error API Amadeus hoteles search: {response_search.status_code}")
-            return []
+    hotels_data = response_search.json().get('data', [])
+    all_hotel_ids = [h['hotelId'] for h in hotels_data if h.get('hotelId')]
+    await amadeus_reference_cache.set_async(list_key, all_hotel_ids, AMADEUS_HOTEL_LIST_TTL)
+    return all_hotel_ids
+
+async def finish_hotel_search(selector, received, complete, offers_key):
+    """Los HOTEL_TOP_K más baratos del selector (en caché solo si llegaron todos los trozos)"""
+    log.info("📊 Total ofertas de hoteles recibidas: %s", received)
+    result = selector.top()
+
+    log.info("✅ Encontrados %s hoteles después del filtrado (rating >= 4)", len(result))
+    for idx, h in enumerate(result, 1):
+        log.debug("   %s. %s - %s%s/noche (%s estrellas)", idx, h['name'], h['currency'], h['price_per_night'], h['rating'])
+    # Un resultado parcial (trozos descartados) no se guarda en caché
+    if complete:
+        await amadeus_offers_cache.set_async(offers_key, result, AMADEUS_OFFERS_TTL)
+    return result
+
+async def search_hotels_amadeus(city_code, checkin, checkout, deadline=None):
+    """Busca hoteles con Amadeus API y devuelve los HOTEL_TOP_K más baratos por noche"""
+    offers_key = f"hotel_offers:{city_code}:{checkin}:{checkout}"
+    cached = await amadeus_offers_cache.get_async(offers_key)
+    if cached is not None:
+        log.info("⚡ Hoteles en %s (%s - %s) en caché", city_code, checkin, checkout)
+        return cached
 
-        hotels_data = response_search.json().get('data', [])
-        if not hotels_data:
-            print("⚠️  No se encontraron hoteles")
+    try:
+        token = await get_amadeus_token()
+        if not token:
             return []
 
-        # Obtener IDs de los primeros 10 hoteles
-        hotel_ids = [h['hotelId'] for h in hotels_data[:10]]
-
-        # Buscar ofertas para esos hoteles
-        url_offers = "https://test.api.amadeus.com/v3/shopping/hotel-offers"
-        params_offers = {
-            "hotelIds": ','.join(hotel_ids),
-            "checkInDate": checkin,
-            "checkOutDate": checkout,
-            "adults": 2,
-            "roomQuantity": 1
-        }
-
-        response_offers = requests.get(url_offers, headers=headers, params=params_offers, timeout=10)
+        headers = {"Authorization": f"Bearer {token}"}
 
-        if response_offers.status_code != 200:
-            print(f"⚠️  Error API Amadeus hotel offers: {response_offers.status_code}")
+        # Primero buscar hoteles en la ciudad (la lista apenas cambia: caché larga)
+        list_key = f"hotels_by_city:{city_code}"
+        all_hotel_ids = await amadeus_reference_cache.get_async(list_key)
+        if all_hotel_ids is None:
+            url_search = f"{AMADEUS_BASE_URL}/v1/reference-data/locations/hotels/by-city"
+            params_search = {"cityCode": city_code}
+
+            log.info("🔍 Buscando hoteles en %s (%s - %s)...", city_code, checkin, checkout)
+            response_search = await amadeus_get(url_search, operation='hotels_by_city', deadline=deadline,
+                                                headers=headers, params=params_search, timeout=10)
+            all_hotel_ids = await hotel_ids_from_response(response_search, list_key)
+            if all_hotel_ids is None:
+                return []
+
+        if not all_hotel_ids:
+            log.warning("⚠️  No se encontraron hoteles")
             return []
 
-        offers_data = response_offers.json().get('data', [])
-        print(f"📊 Total ofertas de hoteles recibidas: {len(offers_data)}")
-
-        # Procesar y ordenar por precio
-        hotel_options = []
-        for hotel in offers_data:
-            if not hotel.get('offers'):
-                continue
-
-            hotel_info = hotel.get('hotel', {})
-            hotel_name = hotel_info.get('name', 'Hotel')
-            rating = hotel_info.get('rating', 0)
-
-            # FILTRAR: Solo hoteles con rating >= 4 estrellas (equivalente a 8/10)
-            # Si no hay suficientes con rating alto, relajar el filtro
-            if rating and int(rating) < 4:
-                continue
-
-            # Obtener la oferta más barata
-            offer = sorted(hotel['offers'], key=lambda x: float(x['price']['total']))[0]
-            price_total = float(offer['price']['total'])
-            currency = offer['price']['currency']
-
-            # Información adicional del hotel
-            address = hotel_info.get('address', {})
-            city_name = address.get('cityName', '')
-
-            # Calcular precio por noche
-            checkin_date = datetime.strptime(checkin, '%Y-%m-%d')
-            checkout_date = datetime.strptime(checkout, '%Y-%m-%d')
-            nights = (checkout_date - checkin_date).days
-            price_per_night = price_total / nights if nights > 0 else price_total
-
-            hotel_options.append({
-                'name': hotel_name,
-                'price_per_night': round(price_per_night, 2),
-                'price_total': round(price_total, 2),
-                'currency': currency,
-                'rating': int(rating) if rating else 0,
-                'nights': nights,
-                'city': city_name,
-                'description': offer.get('room', {}).get('description', {}).get('text', 'Habitación estándar')
-            })
+        # Ofertas de hasta HOTEL_MAX_IDS hoteles, por trozos en paralelo (cada
+        # trozo pasa por el limitador); se procesan según llegan
+        hotel_ids = all_hotel_ids[:HOTEL_MAX_IDS]
+        selector = HotelSelector(HOTEL_TOP_K, nights_between(checkin, checkout))
+        chunks = list(chunked(hotel_ids, HOTEL_CHUNK_SIZE))
+        log.info("🔍 Pidiendo ofertas de %s hoteles en %s trozos...", len(hotel_ids), len(chunks))
 
-        # Ordenar por precio y tomar los 3 más baratos
-        hotel_options.sort(key=lambda x: x['price_per_night'])
-        result = hotel_options[:3]
+        slots = asyncio.Semaphore(HOTEL_MAX_PARALLEL)
 
-        print(f"✅ Encontrados {len(result)} hoteles después del filtrado (rating >= 4)")
-        for idx, h in enumerate(result, 1):
-            print(f"   {idx}. {h['name']} - {h['currency']}{h['price_per_night']}/noche ({h['rating']} estrellas)")
-        return result
+        async def fetch(chunk):
+            async with slots:
+                return await fetch_hotel_offers_chunk(headers, chunk, checkin, checkout, deadline)
 
+        tasks = [asyncio.ensure_future(fetch(chunk)) for chunk in chunks]
+        received = 0
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=budget_for(deadline, HOTEL_OFFERS_BUDGET)):
+                offers_data = await next_done
+                received += len(offers_data)
+                selector.add(offers_data)
+            complete = True
+        except asyncio.TimeoutError:
+            complete = False
+            log.info("⏱️  Tiempo agotado en ofertas de hoteles: se usan los trozos recibidos")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return await finish_hotel_search(selector, received, complete, offers_key)
+
+    except (DeadlineExceeded, CircuitOpenError) as e:
+        log.info("⏭️  Búsqueda de hoteles omitida: %s", e)
+        return []
     except Exception as e:
-        print(f"Error buscando hoteles: {str(e)}")
+        log.error("Error buscando hoteles: %s", e)
         return []
 
 def get_city_from_iata(iata_code):
-    """Convierte código IATA a nombre de ciudad"""
-    iata_to_city = {
-        'MAD': 'Madrid',
-        'BCN': 'Barcelona',
-        'VLC': 'Valencia',
-        'SVQ': 'Sevilla',
-        'AGP': 'Málaga',
-        'BIO': 'Bilbao',
-        'ALC': 'Alicante',
-        'PMI': 'Palma de Mallorca',
+    """Convierte código IATA (aeropuerto o ciudad) a nombre de ciudad"""
+    return airport_index.city_name(iata_code) or 'Madrid'
+
+def parse_duration_days(duration_str):
+    """Extrae el número de días de un texto como '5 días' o de un número (5 por defecto)"""
+    if isinstance(duration_str, int) and not isinstance(duration_str, bool):
+        return duration_str if duration_str > 0 else 5
+    match = re.search(r'\d+', duration_str or '')
+    return int(match.group()) if match else 5
+
+def booking_codes(itinerary):
+    """Códigos que necesita Amadeus: (airport_code, city_code, duration_days).
+
+    Los códigos del LLM se validan contra el índice de aeropuertos: uno
+    inventado se corrige por el nombre de la ciudad y, si no se conoce,
+    queda vacío para no gastar una búsqueda fallida en Amadeus.
+    """
+    city_name = itinerary.get('city') or itinerary.get('destination')
+    raw_airport = itinerary.get('airport_code')
+    airport_code = airport_index.validate(raw_airport, city_name) or ''
+
+    # Para hoteles Amadeus espera el código de ciudad (FCO → ROM)
+    raw_city = itinerary.get('city_code') or airport_code
+    city_code = airport_index.validate(raw_city, city_name) or ''
+    city_code = airport_index.city_code_for(city_code)
+
+    if raw_airport and (raw_airport or '').upper() != airport_code:
+        log.warning("⚠️  Código de aeropuerto del LLM corregido: %s → %s", raw_airport, airport_code or '(ninguno)')
+
+    duration_days = parse_duration_days(itinerary.get('duration', '5 días'))
+    return airport_code, city_code, duration_days
+
+def make_date_option(start_date, duration_days, label, reason):
+    """Opción de fecha (ida y vuelta) para un viaje de duration_days días"""
+    end_date = start_date + timedelta(days=duration_days)
+    return {
+        'departure': start_date.strftime('%Y-%m-%d'),
+        'return': end_date.strftime('%Y-%m-%d'),
+        'duration_days': duration_days,
+        'label': label,
+        'reason': reason
     }
-    return iata_to_city.get(iata_code, 'Madrid')
 
-def generate_booking_links(itinerary, origin_iata='MAD'):
-    """Genera links automáticos a buscadores Y busca ofertas reales con Amadeus"""
+def build_date_options(duration_days):
+    """Genera 2 opciones de fechas DIFERENTES para un viaje de duration_days días"""
+    return [
+        # Opción 1: Dentro de 2 meses
+        make_date_option(datetime.now() + timedelta(days=60), duration_days,
+                         'Opción 1', 'Precios más económicos (60 días anticipación)'),
+        # Opción 2: Dentro de 2.5 meses
+        make_date_option(datetime.now() + timedelta(days=75), duration_days,
+                         'Opción 2', 'Mayor flexibilidad (75 días anticipación)')
+    ]
+
+def candidate_departure_offsets(today):
+    """Días de anticipación que consulta el barrido, en orden de prioridad.
+
+    Se reparten DATE_SWEEP_CANDIDATES salidas por la ventana. Primero las dos
+    fechas clásicas (60 y 75 días), después las salidas en martes o miércoles
+    (suelen ser más baratas) y el resto por cercanía a los 60 días.
+    """
+    start, end = DATE_SWEEP_START_DAYS, max(DATE_SWEEP_START_DAYS, DATE_SWEEP_END_DAYS)
+    count = max(1, DATE_SWEEP_CANDIDATES)
+    step = (end - start) / (count - 1) if count > 1 else 0
+    offsets = {round(start + i * step) for i in range(count)}
+    offsets.update(days for days in (60, 75) if start <= days <= end)
+
+    def priority(days):
+        weekday = (today + timedelta(days=days)).weekday()
+        return (days not in (60, 75), weekday not in (1, 2), abs(days - 60), days)
+
+    return sorted(offsets, key=priority)[:count]
+
+def sweep_dates(today, days, duration_days):
+    """(salida, vuelta) en formato de Amadeus para una salida dentro de `days` días"""
+    departure = (today + timedelta(days=days)).strftime('%Y-%m-%d')
+    return_date = (today + timedelta(days=days + duration_days)).strftime('%Y-%m-%d')
+    return departure, return_date
+
+def sweep_converged(priced, best_before):
+    """True si hay DATE_SWEEP_TOP fechas con precio y el último lote no mejoró lo bastante"""
+    if best_before is None or len(priced) < DATE_SWEEP_TOP:
+        return False
+    return min(p[0] for p in priced) > best_before * (1 - DATE_SWEEP_MIN_GAIN)
+
+def rank_swept_dates(today, priced, searched, duration_days):
+    """[(date_option, flight_offers)] de las DATE_SWEEP_TOP fechas más baratas del barrido"""
+    priced.sort(key=lambda p: (p[0], p[1]))
+    log.info("📅 Barrido de fechas: %s fechas con precio de %s consultadas", len(priced), searched)
+
+    results = []
+    for idx, (price, days, offers) in enumerate(priced[:DATE_SWEEP_TOP]):
+        if idx == 0:
+            reason = f'La más barata de {searched} fechas consultadas ({days} días anticipación)'
+        else:
+            reason = f'Alternativa económica ({days} días anticipación)'
+        date_option = make_date_option(today + timedelta(days=days), duration_days, f'Opción {idx + 1}', reason)
+        results.append((date_option, offers))
+    return results
+
+async def sweep_departure_dates(origin_iata, airport_code, duration_days, deadline=None):
+    """Barrido de fechas de salida → [(date_option, flight_offers)] de las más baratas.
+
+    Las búsquedas se lanzan como tareas del loop por lotes de DATE_SWEEP_BATCH,
+    con prioridad baja en el limitador de Amadeus. El primer lote son solo
+    las DATE_SWEEP_TOP primeras candidatas (las fechas clásicas): fijan el
+    precio de referencia. Tras cada lote siguiente, si ya hay DATE_SWEEP_TOP
+    fechas con precio y el lote no ha mejorado el mejor precio en
+    DATE_SWEEP_MIN_GAIN, el barrido se da por bueno. Al terminar o al
+    agotar DATE_SWEEP_BUDGET (o el plazo del análisis) se cancelan las
+    búsquedas pendientes.
+    """
+    today = datetime.now()
+    offsets = candidate_departure_offsets(today)
+    sweep_deadline = deadline.within(DATE_SWEEP_BUDGET) if deadline else Deadline(DATE_SWEEP_BUDGET)
+    pending = set()
+    priced = []  # (precio, días de anticipación, ofertas)
+    searched = 0
+    batch = max(1, DATE_SWEEP_BATCH)
+    first = min(batch, max(1, DATE_SWEEP_TOP))
+    batches = [offsets[:first]] + [offsets[i:i + batch] for i in range(first, len(offsets), batch)]
+
+    log.info("📅 Barrido de fechas %s → %s: %s salidas candidatas (%s días)", origin_iata, airport_code, len(offsets), duration_days)
+    try:
+        for days_batch in batches:
+            best_before = min(p[0] for p in priced) if priced else None
+
+            tasks = {}
+            for days in days_batch:
+                departure, return_date = sweep_dates(today, days, duration_days)
+                task = asyncio.ensure_future(search_flights_amadeus(
+                    origin_iata, airport_code, departure, return_date, priority=PRIORITY_SWEEP, deadline=sweep_deadline))
+                tasks[task] = days
+
+            done, pending = await asyncio.wait(tasks, timeout=sweep_deadline.remaining())
+            for task in done:
+                searched += 1
+                offers = task.result()
+                if offers:
+                    priced.append((offers[0]['price'], tasks[task], offers))
+            if pending:
+                log.info("⏱️  Barrido de fechas: tiempo agotado, se descartan las búsquedas pendientes")
+                break
+
+            if sweep_converged(priced, best_before):
+                log.info("✅ Barrido de fechas: el último lote no mejora el precio, se detiene")
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+
+    return rank_swept_dates(today, priced, searched, duration_days)
+
+class PriceLookup:
+    """Búsquedas de Amadeus de un viaje lanzadas como tarea del loop nada más crearse.
+
+    Con el barrido de fechas activado se consultan varias salidas candidatas
+    y se quedan las más baratas; si no, los vuelos de las dos fechas fijas.
+    Los hoteles se buscan a la vez que los vuelos para la primera fecha fija
+    (cada oferta lleva su checkin y checkout, que con el barrido pueden no
+    coincidir con las fechas de los vuelos). Como solo depende de los códigos
+    y la duración, se puede lanzar antes de tener el itinerario completo y
+    recoger los resultados después con wait(). Se crea desde el event loop.
+    Con deadline, las llamadas a Amadeus no pasan del plazo del análisis.
+    """
+
+    def __init__(self, origin_iata, airport_code, city_code, duration_days, deadline=None):
+        self.key = (origin_iata, airport_code, city_code, duration_days)
+        self.deadline = deadline
+        self._task = asyncio.ensure_future(self._search(*self.key))
+
+    async def _search(self, origin_iata, airport_code, city_code, duration_days):
+        search_flights = bool(airport_code and AMADEUS_API_KEY)
+        fixed_dates = build_date_options(duration_days)
+        hotel_date = fixed_dates[0]
+
+        hotel_task = None
+        if city_code and AMADEUS_API_KEY:
+            log.info("💰 Buscando ofertas reales de hoteles en %s...", city_code)
+            hotel_task = asyncio.ensure_future(search_hotels_amadeus(
+                city_code, hotel_date['departure'], hotel_date['return'], self.deadline))
+
+        try:
+            flights = []
+            if search_flights and DATE_SWEEP:
+                flights = await sweep_departure_dates(origin_iata, airport_code, duration_days, self.deadline)
+            elif search_flights:
+                searches = []
+                for date_option in fixed_dates:
+                    log.info("💰 Buscando vuelos para %s (%s - %s)...", date_option['label'], date_option['departure'], date_option['return'])
+                    searches.append(search_flights_amadeus(
+                        origin_iata, airport_code, date_option['departure'], date_option['return'], deadline=self.deadline))
+                flights = list(zip(fixed_dates, await asyncio.gather(*searches)))
+            hotels = await hotel_task if hotel_task is not None else None
+        finally:
+            if hotel_task is not None:
+                hotel_task.cancel()
+
+        if hotels:
+            hotels = [dict(hotel, checkin=hotel_date['departure'], checkout=hotel_date['return']) for hotel in hotels]
+        date_options = [date_option for date_option, _ in flights] or fixed_dates
+        return date_options, flights, hotels
+
+    def matches(self, origin_iata, airport_code, city_code, duration_days):
+        return self.key == (origin_iata, airport_code, city_code, duration_days)
+
+    async def wait(self, timeout=None):
+        """(date_options, [(date_option, flight_offers)], hotel_offers o None si no se buscaron).
+
+        Con timeout lanza asyncio.TimeoutError al agotarlo sin cancelar las búsquedas.
+        """
+        return await asyncio.wait_for(asyncio.shield(self._task), timeout)
+
+    def cancel(self):
+        """Cancela las búsquedas que sigan en curso (nadie va a esperar sus resultados)"""
+        self._task.cancel()
+
+def price_lookup(origin_iata, codes, deadline, price_lookups=None):
+    """PriceLookup de los códigos: el compartido del lote (SharedLookups) si lo hay, o uno nuevo.
+
+    Las búsquedas compartidas no tienen el plazo de ningún video concreto:
+    cada video solo las espera hasta su propio plazo (prices_pending si no llegan).
+    """
+    if price_lookups is not None:
+        return price_lookups.get(origin_iata, *codes)
+    return PriceLookup(origin_iata, *codes, deadline=deadline)
+
+async def generate_booking_links(itinerary, origin_iata='MAD', prices=None, deadline=None, price_lookups=None):
+    """Genera links automáticos a buscadores Y busca ofertas reales con Amadeus.
+
+    prices es un PriceLookup lanzado de antemano (p. ej. durante la generación
+    del itinerario); si no coincide con los códigos finales se cancela y se
+    lanza otro, o se usa el de price_lookups si el análisis es parte de un lote
+    (las búsquedas compartidas del lote no se cancelan).
+    Si el plazo del análisis se agota antes de tener los precios, se devuelven
+    los links a buscadores (y las ofertas que hubieran llegado) con
+    prices_pending=True.
+    """
+    codes = booking_codes(itinerary)
+
+    # === BÚSQUEDAS EN AMADEUS (reutilizando las especulativas si coinciden) ===
+    if prices is not None and prices.matches(origin_iata, *codes):
+        log.info("⚡ Reutilizando búsquedas de Amadeus lanzadas durante la generación")
+    else:
+        if prices is not None and price_lookups is None:
+            # Especulativa con otros códigos: nadie va a leerla (las de un lote son compartidas)
+            log.info("🛑 Cancelando las búsquedas especulativas: los códigos finales son otros")
+            prices.cancel()
+        prices = price_lookup(origin_iata, codes, deadline, price_lookups)
+
+    try:
+        price_results = await prices.wait(budget_for(deadline))
+    except asyncio.TimeoutError:
+        price_results = None
+    return finish_booking_links(itinerary, origin_iata, codes, price_results, deadline)
+
+def finish_booking_links(itinerary, origin_iata, codes, price_results, deadline):
+    """build_booking_links marcando prices_pending si los precios no llegaron a tiempo (price_results None).
+
+    Solo cuenta si llegaron los resultados: un plazo que expira justo después
+    no convierte en pendientes unos precios ya completos.
+    """
+    pending = price_results is None
+    if pending:
+        DEADLINE_EXCEEDED.inc(stage='prices')
+        log.warning("⏱️  Plazo agotado en Amadeus (%.1fs): itinerario con links a buscadores, precios pendientes",
+                    deadline.elapsed() if deadline is not None else 0.0)
+        price_results = (build_date_options(codes[2]), [], None)
+
+    links = build_booking_links(itinerary, origin_iata, codes, price_results)
+    links['prices_pending'] = pending
+    return links
+
+def build_booking_links(itinerary, origin_iata, codes, price_results):
+    """Links a buscadores y ofertas reales a partir de los resultados de un PriceLookup.
+
+    codes es (airport_code, city_code, duration_days) de booking_codes().
+    """
 
     destination = itinerary.get('destination', '')
     city = itinerary.get('city', destination)
-    airport_code = itinerary.get('airport_code', '').upper()
-    city_code = itinerary.get('city_code', airport_code).upper()  # Para hoteles
+    airport_code, city_code, duration_days = codes
 
     # Si no hay ciudad, usar el destino
     if not city:
         city = destination
 
-    duration_str = itinerary.get('duration', '5 días')
-    duration_days = int(re.search(r'\d+', duration_str).group()) if re.search(r'\d+', duration_str) else 5
-
-    # Generar 2 opciones de fechas DIFERENTES
-    date_options = []
-
-    # Opción 1: Dentro de 2 meses
-    start_date_1 = datetime.now() + timedelta(days=60)
-    end_date_1 = start_date_1 + timedelta(days=duration_days)
-    date_options.append({
-        'departure': start_date_1.strftime('%Y-%m-%d'),
-        'return': end_date_1.strftime('%Y-%m-%d'),
-        'duration_days': duration_days,
-        'label': 'Opción 1',
-        'reason': 'Precios más económicos (60 días anticipación)'
-    })
-
-    # Opción 2: Dentro de 2.5 meses
-    start_date_2 = datetime.now() + timedelta(days=75)
-    end_date_2 = start_date_2 + timedelta(days=duration_days)
-    date_options.append({
-        'departure': start_date_2.strftime('%Y-%m-%d'),
-        'return': end_date_2.strftime('%Y-%m-%d'),
-        'duration_days': duration_days,
-        'label': 'Opción 2',
-        'reason': 'Mayor flexibilidad (75 días anticipación)'
-    })
+    date_options, flight_results, hotel_offers = price_results
+    first_date = date_options[0]
 
     links = {
         'flights': [],
@@ -290,37 +788,33 @@ def generate_booking_links(itinerary, origin_iata='MAD'):
         'date_options': date_options
     }
 
-    # === OBTENER OFERTAS REALES DE VUELOS PARA CADA OPCIÓN DE FECHA ===
-    if airport_code and AMADEUS_API_KEY:
-        for date_option in date_options:
-            print(f"💰 Buscando vuelos para {date_option['label']} ({date_option['departure']} - {date_option['return']})...")
-            flight_offers = search_flights_amadeus(origin_iata, airport_code, date_option['departure'], date_option['return'])
-
-            if flight_offers:
-                # Tomar solo la mejor oferta para esta fecha
-                best_flight = flight_offers[0]
-
-                # URL para reservar
-                booking_url = f"https://www.google.com/travel/flights?hl=es&gl=ES&q=flights+from+{origin_iata}+to+{airport_code}+on+{date_option['departure']}+return+{date_option['return']}"
-
-                links['flights'].append({
-                    'type': 'offer',  # Oferta real con precio
-                    'date_option': date_option['label'],
-                    'date_range': f"{date_option['departure']} - {date_option['return']}",
-                    'date_reason': date_option['reason'],
-                    'airline': best_flight['airline'],
-                    'price': best_flight['price'],
-                    'currency': best_flight['currency'],
-                    'duration': best_flight['duration'],
-                    'direct': best_flight['direct'],
-                    'stops': best_flight['stops'],
-                    'trip_type': 'Ida y vuelta',
-                    'baggage': '1 equipaje de mano incluido',
-                    'url': booking_url,
-                    'name': f"{best_flight['airline']} - €{best_flight['price']:.0f}",
-                    'description': f"{best_flight['duration']}, {'Directo' if best_flight['direct'] else f'{best_flight['stops']} escala(s)'}"
-                })
-                print(f"   ✈️  {date_option['label']}: {best_flight['airline']} - €{best_flight['price']:.0f} ({best_flight['duration']})")
+    # === OFERTAS REALES DE VUELOS PARA CADA OPCIÓN DE FECHA ===
+    for date_option, flight_offers in flight_results:
+        if flight_offers:
+            # Tomar solo la mejor oferta para esta fecha
+            best_flight = flight_offers[0]
+
+            # URL para reservar
+            booking_url = f"https://www.google.com/travel/flights?hl=es&gl=ES&q=flights+from+{origin_iata}+to+{airport_code}+on+{date_option['departure']}+return+{date_option['return']}"
+
+            links['flights'].append({
+                'type': 'offer',  # Oferta real con precio
+                'date_option': date_option['label'],
+                'date_range': f"{date_option['departure']} - {date_option['return']}",
+                'date_reason': date_option['reason'],
+                'airline': best_flight['airline'],
+                'price': best_flight['price'],
+                'currency': best_flight['currency'],
+                'duration': best_flight['duration'],
+                'direct': best_flight['direct'],
+                'stops': best_flight['stops'],
+                'trip_type': 'Ida y vuelta',
+                'baggage': '1 equipaje de mano incluido',
+                'url': booking_url,
+                'name': f"{best_flight['airline']} - €{best_flight['price']:.0f}",
+                'description': f"{best_flight['duration']}, {'Directo' if best_flight['direct'] else f'{best_flight['stops']} escala(s)'}"
+            })
+            log.debug("   ✈️  %s: %s - €%.0f (%s)", date_option['label'], best_flight['airline'], best_flight['price'], best_flight['duration'])
 
     # === BUSCADORES ALTERNATIVOS DE VUELOS ===
     destination_clean = destination.replace(',', '').strip()
@@ -349,20 +843,18 @@ def generate_booking_links(itinerary, origin_iata='MAD'):
         'icon': '🔍'
     })
 
-    # === OBTENER OFERTAS REALES DE HOTELES ===
-    # Usar la primera opción de fecha
-    first_date = date_options[0]
-    if city_code and AMADEUS_API_KEY:
-        print(f"💰 Buscando ofertas reales de hoteles en {city_code}...")
-        hotel_offers = search_hotels_amadeus(city_code, first_date['departure'], first_date['return'])
-
+    # === OFERTAS REALES DE HOTELES ===
+    # Cada oferta trae las fechas para las que se buscó (por defecto, la primera opción)
+    if hotel_offers is not None:
         if hotel_offers:
             for idx, hotel in enumerate(hotel_offers[:3], 1):  # Máximo 3 ofertas
                 stars = '⭐' * hotel['rating'] if hotel['rating'] > 0 else ''
 
                 # URL para reservar (Booking.com con ciudad y fechas)
                 city_for_booking = city.replace(',', '').strip()
-                booking_url = f"https://www.booking.com/searchresults.html?ss={quote(city_for_booking)}&checkin={first_date['departure']}&checkout={first_date['return']}&group_adults=2&no_rooms=1"
+                checkin = hotel.get('checkin', first_date['departure'])
+                checkout = hotel.get('checkout', first_date['return'])
+                booking_url = f"https://www.booking.com/searchresults.html?ss={quote(city_for_booking)}&checkin={checkin}&checkout={checkout}&group_adults=2&no_rooms=1"
 
                 links['hotels'].append({
                     'type': 'offer',  # Oferta real con precio
@@ -373,15 +865,17 @@ def generate_booking_links(itinerary, origin_iata='MAD'):
                     'currency': hotel['currency'],
                     'rating': hotel['rating'],
                     'nights': hotel['nights'],
+                    'checkin': checkin,
+                    'checkout': checkout,
                     'city': hotel.get('city', city),
                     'location': hotel.get('city', city),
                     'room_description': hotel.get('description', 'Habitación estándar'),
                     'url': booking_url,
                     'description': f"€{hotel['price_per_night']:.0f}/noche ({hotel['nights']} noches) {stars}"
                 })
-                print(f"   🏨 Opción {idx}: {hotel['name']} - €{hotel['price_per_night']:.0f}/noche ({hotel['rating']} estrellas)")
+                log.debug("   🏨 Opción %s: %s - €%.0f/noche (%s estrellas)", idx, hotel['name'], hotel['price_per_night'], hotel['rating'])
         else:
-            print(f"   ⚠️  No se encontraron hoteles con Amadeus. Se mostrarán buscadores.")
+            log.warning("   ⚠️  No se encontraron hoteles con Amadeus. Se mostrarán buscadores.")
 
     # === BUSCADORES ALTERNATIVOS DE HOTELES ===
     city_clean = city.replace(',', '').strip()
@@ -450,49 +944,115 @@ def generate_booking_links(itinerary, origin_iata='MAD'):
                 'description': f'Entradas y tours para {place_name}'
             })
 
-    # Debug: imprimir resumen de lo que se va a devolver
-    print(f"\n📋 RESUMEN BOOKING LINKS:")
-    print(f"   ✈️  Vuelos: {len(links['flights'])} items")
-    for f in links['flights']:
-        print(f"      - {f.get('type')}: {f.get('name')}")
-    print(f"   🏨 Hoteles: {len(links['hotels'])} items")
-    for h in links['hotels']:
-        print(f"      - {h.get('type')}: {h.get('name')}")
-    print(f"   🎫 Actividades: {len(links['activities'])} items")
+    # Debug: resumen de lo que se va a devolver (los bucles solo corren en nivel DEBUG)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("📋 RESUMEN BOOKING LINKS:")
+        log.debug("   ✈️  Vuelos: %s items", len(links['flights']))
+        for f in links['flights']:
+            log.debug("      - %s: %s", f.get('type'), f.get('name'))
+        log.debug("   🏨 Hoteles: %s items", len(links['hotels']))
+        for h in links['hotels']:
+            log.debug("      - %s: %s", h.get('type'), h.get('name'))
+        log.debug("   🎫 Actividades: %s items", len(links['activities']))
 
     return links
 
 def extract_video_info(url):
-    """Extrae información básica del URL del video"""
-    info = {
-        'platform': None,
-        'video_id': None,
-        'username': None
-    }
-    
-    # Detectar TikTok
-    if 'tiktok.com' in url:
-        info['platform'] = 'tiktok'
-        # Extraer username e ID de video si es posible
-        match = re.search(r'@([^/]+)/video/(\d+)', url)
-        if match:
-            info['username'] = match.group(1)
-            info['video_id'] = match.group(2)
-    
-    # Detectar Instagram
-    elif 'instagram.com' in url:
-        info['platform'] = 'instagram'
-        match = re.search(r'reel/([^/?]+)', url)
-        if match:
-            info['video_id'] = match.group(1)
-    
-    return info
-
-def download_video_audio(video_url):
+    """Extrae información básica del URL del video (los enlaces cortos se resuelven al video)"""
+    return url_resolver.resolve(url)
+
+async def resolve_video_info(video_url, video_info):
+    """video_info de parse_video_url con el enlace corto resuelto (HEAD en el pool de medios del loop)"""
+    if not video_info['short_code']:
+        return video_info
+    return await aio_loop.run_media(extract_video_info, video_url)
+
+# Subtítulos: preferir manuales frente a automáticos, y español/inglés frente al resto
+SUBTITLE_LANGUAGES = ('es', 'es-ES', 'es-419', 'en', 'en-US')
+SUBTITLE_FORMATS = ('vtt', 'srt')
+VTT_TIMESTAMP = re.compile(r'^\d{2}:\d{2}(:\d{2})?[.,]\d{3} --> ')
+HTML_TAG = re.compile(r'<[^>]+>')
+
+def parse_subtitles(raw):
+    """Convierte un fichero VTT/SRT en texto plano sin tiempos ni líneas repetidas"""
+    lines = []
+    for line in raw.splitlines():
+        line = line.strip()
+        if not line or line == 'WEBVTT' or line.isdigit() or VTT_TIMESTAMP.match(line):
+            continue
+        if line.startswith(('Kind:', 'Language:', 'NOTE', 'STYLE')):
+            continue
+        line = HTML_TAG.sub('', line).strip()
+        # Los subtítulos automáticos repiten la línea anterior en cada cue
+        if line and (not lines or lines[-1] != line):
+            lines.append(line)
+    return ' '.join(lines)
+
+def pick_subtitle_track(info):
+    """Elige la mejor pista de subtítulos del info dict de yt-dlp (o None)"""
+    for field in ('subtitles', 'automatic_captions'):
+        tracks = info.get(field) or {}
+        languages = [lang for lang in SUBTITLE_LANGUAGES if lang in tracks] + sorted(tracks)
+        for lang in languages:
+            for fmt in SUBTITLE_FORMATS:
+                for track in tracks[lang]:
+                    if track.get('ext') == fmt and track.get('url'):
+                        return track
+    return None
+
+def get_metadata_transcript(video_url, deadline=None):
+    """Intenta obtener el contenido del video sin descargarlo: subtítulos, título y descripción.
+
+    Devuelve el texto si es suficientemente rico (METADATA_MIN_WORDS palabras
+    sin contar hashtags ni menciones) o None para usar el pipeline de audio.
+    """
+    try:
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+            'noplaylist': True,
+            'socket_timeout': timeout_for(deadline, YTDLP_SOCKET_TIMEOUT),
+        }
+
+        log.info("🔎 Buscando subtítulos y descripción del video...")
+        with UPSTREAM_SECONDS.time(upstream='yt-dlp', operation='metadata'):
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(video_url, download=False)
+
+        captions = ''
+        track = pick_subtitle_track(info)
+        if track:
+            response = media_http.get(track['url'], timeout=10, deadline=deadline)
+            if response.status_code == 200:
+                captions = parse_subtitles(response.text)
+
+        parts = []
+        if info.get('title'):
+            parts.append(f"Título: {info['title']}")
+        if info.get('description') and info.get('description') != info.get('title'):
+            parts.append(f"Descripción: {info['description']}")
+        if captions:
+            parts.append(f"Subtítulos: {captions}")
+        text = '\n'.join(parts)
+
+        words = [w for w in text.split() if not w.startswith(('#', '@'))]
+        if len(words) < METADATA_MIN_WORDS:
+            log.info("ℹ️  Metadatos insuficientes (%s palabras), se usará el audio", len(words))
+            return None
+
+        log.info("✅ Metadatos suficientes: %s palabras%s", len(words), ' con subtítulos' if captions else '')
+        return text
+
+    except Exception as e:
+        log.warning("⚠️  No se pudieron leer los metadatos: %s", e)
+        return None
+
+def download_video_audio(video_url, deadline=None):
     """Descarga el video y extrae el audio usando yt-dlp"""
+    # Crear directorio temporal
+    temp_dir = tempfile.mkdtemp()
     try:
-        # Crear directorio temporal
-        temp_dir = tempfile.mkdtemp()
         audio_path = os.path.join(temp_dir, 'audio.m4a')
 
         # Configurar yt-dlp para extraer solo audio
@@ -502,55 +1062,223 @@ def download_video_audio(video_url):
             'quiet': True,
             'no_warnings': True,
             'extract_audio': True,
+            'socket_timeout': timeout_for(deadline, YTDLP_SOCKET_TIMEOUT),
         }
 
-        print(f"📥 Descargando audio del video...")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
+        if deadline is not None:
+            ydl_opts['progress_hooks'] = [deadline_hook(deadline)]
+
+        log.info("📥 Descargando audio del video...")
+        with UPSTREAM_SECONDS.time(upstream='yt-dlp', operation='download'):
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(video_url, download=True) or {}
+        if deadline is not None and deadline.expired():
+            # Nadie espera ya el audio (run_analysis dejó de esperar al agotarse el plazo)
+            raise DeadlineExceeded(f"Plazo de {deadline.seconds}s agotado descargando el video")
 
         # Buscar el archivo de audio descargado
         audio_files = list(Path(temp_dir).glob('audio.*'))
         if not audio_files:
             raise ValueError("No se pudo descargar el audio del video")
 
+        size = os.path.getsize(audio_files[0])
+        DOWNLOAD_BYTES.inc(size)
+        if info.get('duration'):
+            AUDIO_SECONDS.inc(info['duration'])
+        log.info("📥 Audio descargado: %s KB, %ss", size // 1024, info.get('duration', '?'),
+                 extra={'bytes': size, 'audio_seconds': info.get('duration')})
+
         return str(audio_files[0])
 
     except Exception as e:
-        print(f"Error al descargar video: {str(e)}")
+        log.error("Error al descargar video: %s", e)
+        shutil.rmtree(temp_dir, ignore_errors=True)
         raise
 
-def transcribe_audio(audio_path):
-    """Transcribe el audio usando Whisper de OpenAI"""
+def deadline_hook(deadline):
+    """progress_hook de yt-dlp que corta la descarga al agotarse el plazo.
+
+    socket_timeout solo limita cada lectura: una descarga lenta que sigue
+    recibiendo bytes no terminaría nunca por timeout.
+    """
+    def hook(status):
+        if deadline.expired():
+            raise DeadlineExceeded(f"Plazo de {deadline.seconds}s agotado descargando el video")
+    return hook
+
+def with_deadline(client, deadline):
+    """Cliente de OpenAI/Anthropic para una llamada con plazo: sin reintentos que lo sobrepasen"""
+    return client if deadline is None else client.with_options(max_retries=0)
+
+def record_ai_error(breaker, error, deadline):
+    """Cuenta un error de OpenAI/Anthropic en su circuito, salvo los 4xx y los cortes por el plazo de la petición"""
+    if isinstance(error, DeadlineExceeded) or (deadline is not None and deadline.expired()):
+        return
+    breaker.record(not failed_status(getattr(error, 'status_code', 500)))
+
+async def whisper_transcribe_file(audio_path, deadline=None):
+    """Una llamada a Whisper para un fichero de audio completo (CircuitOpenError si OpenAI está caído)"""
+    timeout = timeout_for(deadline, WHISPER_TIMEOUT)
+    if not openai_breaker.allow():
+        raise CircuitOpenError("Circuito de OpenAI abierto")
     try:
-        print(f"🎤 Transcribiendo audio con Whisper...")
+        with UPSTREAM_SECONDS.time(upstream='openai', operation='transcription'):
+            with open(audio_path, 'rb') as audio_file:
+                transcript = await with_deadline(openai_client, deadline).audio.transcriptions.create(
+                    model="whisper-1",
+                    file=audio_file,
+                    language="es",  # Español por defecto, Whisper detecta automáticamente si es otro idioma
+                    timeout=timeout
+                )
+    except Exception as e:
+        record_ai_error(openai_breaker, e, deadline)
+        raise
+    openai_breaker.record(True)
+    return transcript.text
+
+def split_audio_on_silence(audio, chunk_ms):
+    """Calcula los cortes del audio en silencios cercanos a chunk_ms.
+
+    Para cada trozo se busca el último silencio antes del tamaño objetivo
+    (sin bajar de la mitad) y se corta en su punto medio, así no se parten
+    palabras. Si no hay silencio adecuado se corta en el tamaño objetivo.
+    Devuelve una lista de (inicio_ms, fin_ms).
+    """
+    silences = detect_silence(audio, min_silence_len=400, silence_thresh=audio.dBFS - 16, seek_step=20)
+    midpoints = [(start + end) // 2 for start, end in silences]
+
+    bounds = []
+    start = 0
+    total = len(audio)
+    while total - start > chunk_ms:
+        target = start + chunk_ms
+        candidates = [m for m in midpoints if start + chunk_ms // 2 <= m <= target]
+        cut = candidates[-1] if candidates else target
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, total))
+    return bounds
+
+def export_audio_chunks(audio_path):
+    """Corta un audio largo en silencios y exporta los trozos → (directorio, [rutas mp3]).
+
+    Devuelve None si el audio es corto (menos de 1,5 trozos) para que se use
+    una sola llamada a Whisper.
+    """
+    chunk_ms = WHISPER_CHUNK_SECONDS * 1000
+    # La duración se mira con ffprobe: decodificar un clip corto que no se va a cortar es tiempo perdido
+    duration = audio_duration_seconds(audio_path)
+    if duration is not None and duration * 1000 < chunk_ms * 1.5:
+        return None
 
-        with open(audio_path, 'rb') as audio_file:
-            transcript = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="es"  # Español por defecto, Whisper detecta automáticamente si es otro idioma
-            )
+    audio = AudioSegment.from_file(audio_path)
+    if len(audio) < chunk_ms * 1.5:
+        return None
 
-        print(f"✅ Transcripción completada: {len(transcript.text)} caracteres")
-        return transcript.text
+    bounds = split_audio_on_silence(audio, chunk_ms)
+    chunk_dir = tempfile.mkdtemp()
+    chunk_paths = []
+    try:
+        # Mono a 16 kHz basta para Whisper y reduce lo que se sube
+        audio = audio.set_channels(1).set_frame_rate(16000)
+        for idx, (start, end) in enumerate(bounds):
+            chunk_path = os.path.join(chunk_dir, f'chunk_{idx:03d}.mp3')
+            audio[start:end].export(chunk_path, format='mp3', bitrate='64k')
+            chunk_paths.append(chunk_path)
+    except Exception:
+        remove_audio_chunks(chunk_dir, chunk_paths)
+        raise
+    return chunk_dir, chunk_paths
 
+def audio_duration_seconds(audio_path):
+    """Duración del audio según ffprobe, sin decodificarlo (None si no se puede leer)"""
+    try:
+        return float(mediainfo(audio_path)['duration'])
+    except Exception:
+        return None
+
+def remove_audio_chunks(chunk_dir, chunk_paths):
+    for chunk_path in chunk_paths:
+        try:
+            os.remove(chunk_path)
+        except OSError:
+            pass
+    try:
+        os.rmdir(chunk_dir)
+    except OSError:
+        pass
+
+async def transcribe_audio_chunked(audio_path, deadline=None):
+    """Transcribe un audio largo en trozos paralelos y une los textos en orden.
+
+    El corte con pydub va al pool de medios. Devuelve None si el audio es
+    corto (menos de 1,5 trozos) o no se pudo cortar, para que se use una sola
+    llamada a Whisper. Si falla un trozo se cancelan los demás y se propaga
+    el error: repetir el audio entero en una llamada lo pagaría dos veces.
+    """
+    try:
+        chunks = await aio_loop.run_media(export_audio_chunks, audio_path)
     except Exception as e:
-        print(f"Error al transcribir audio: {str(e)}")
-        raise
+        log.warning("⚠️  No se pudo cortar el audio, se usa una sola llamada: %s", e)
+        return None
+    if chunks is None:
+        return None
 
-def generate_itinerary_with_ai(video_transcript, video_info):
-    """Usa Claude Haiku (económico) para generar itinerario basado en la transcripción REAL del video"""
+    chunk_dir, chunk_paths = chunks
+    try:
+        log.info("🎤 Transcribiendo %s trozos de ~%ss en paralelo...", len(chunk_paths), WHISPER_CHUNK_SECONDS)
+        slots = asyncio.Semaphore(WHISPER_MAX_PARALLEL)
 
-    # Si no hay transcripción, usar mensaje de error
-    if not video_transcript or len(video_transcript.strip()) < 10:
-        video_transcript = "[No se pudo extraer audio del video - video sin sonido o error en descarga]"
+        async def transcribe(chunk_path):
+            async with slots:
+                return await whisper_transcribe_file(chunk_path, deadline)
 
-    prompt = f"""Eres un experto planificador de viajes. Un usuario ha compartido un video de {video_info['platform']} sobre un destino turístico.
+        tasks = [asyncio.ensure_future(transcribe(chunk_path)) for chunk_path in chunk_paths]
+        try:
+            texts = await asyncio.gather(*tasks)
+        except BaseException:
+            # Un trozo falló (o se canceló el análisis): no seguir subiendo los demás
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return ' '.join(t.strip() for t in texts if t and t.strip())
+
+    finally:
+        remove_audio_chunks(chunk_dir, chunk_paths)
+
+async def transcribe_audio(audio_path, deadline=None):
+    """Transcribe el audio usando Whisper de OpenAI (con caché por hash del audio)"""
+    try:
+        # Audio idéntico ya transcrito: evitar la llamada a Whisper
+        audio_hash = f"whisper-1:es:{await aio_loop.run_blocking(file_sha256, audio_path)}"
+        cached = await transcript_cache.get_async(audio_hash)
+        if cached is not None:
+            log.info("⚡ Transcripción en caché: %s caracteres", len(cached))
+            return cached
+        if openai_breaker.is_open():
+            raise CircuitOpenError("Circuito de OpenAI abierto")
+
+        text = None
+        if WHISPER_CHUNKED:
+            text = await transcribe_audio_chunked(audio_path, deadline)
+
+        if text is None:
+            log.info("🎤 Transcribiendo audio con Whisper...")
+            text = await whisper_transcribe_file(audio_path, deadline)
+
+        log.info("✅ Transcripción completada: %s caracteres", len(text))
+        await transcript_cache.set_async(audio_hash, text)
+        return text
 
-TRANSCRIPCIÓN DEL VIDEO (diálogos y narración REALES extraídos del video):
----
-{video_transcript}
----
+    except Exception as e:
+        log.error("Error al transcribir audio: %s", e)
+        raise
+
+# Prefijo mínimo que cachea Anthropic en los modelos Haiku; por debajo, cache_control se ignora
+PROMPT_CACHE_MIN_TOKENS = 2048
+
+ITINERARY_SYSTEM_PROMPT = """Eres un experto planificador de viajes. El usuario te enviará la transcripción de un video de TikTok o Instagram sobre un destino turístico (diálogos y narración REALES extraídos del video).
 
 Basándote ÚNICAMENTE en lo que se menciona en la transcripción del video (lugares, actividades, recomendaciones), genera un itinerario de viaje detallado y REALISTA.
 
@@ -580,7 +1308,7 @@ ESTRUCTURA DEL ITINERARIO:
 
 Genera un JSON con la siguiente estructura EXACTA (sin texto adicional, solo el JSON):
 
-{{
+{
   "destination": "Nombre del destino mencionado en el video",
   "city": "Ciudad principal del destino",
   "country": "País",
@@ -591,56 +1319,131 @@ Genera un JSON con la siguiente estructura EXACTA (sin texto adicional, solo el
   "budget": "€X - €Y por persona (orientativo)",
   "best_time": "Mejor época para visitar",
   "days": [
-    {{
+    {
       "title": "Día 1: Llegada a [Ciudad] (Viernes)" // Ejemplo: incluir día de la semana si es relevante
       "activities": [
-        {{
+        {
           "time": "18:00",
           "activity": "Llegada al aeropuerto y traslado al hotel (vuelo incluido)",
           "location": "Aeropuerto Internacional"
-        }},
-        {{
+        },
+        {
           "time": "21:00",
           "activity": "Cena en restaurante local y primer paseo nocturno",
           "location": "Centro histórico"
-        }}
+        }
       ]
-    }},
-    {{
+    },
+    {
       "title": "Día 2: [Descripción] (Sábado)" // Día completo
       "activities": [
-        {{
+        {
           "time": "09:30",
           "activity": "Desayuno y visita guiada matinal",
           "location": "Plaza principal"
-        }},
-        {{
+        },
+        {
           "time": "13:30",
           "activity": "Comida tradicional",
           "location": "Restaurante recomendado en el video"
-        }},
-        {{
+        },
+        {
           "time": "16:00",
           "activity": "Tarde libre en la playa/museo/actividad",
           "location": "Zona costera"
-        }},
-        {{
+        },
+        {
           "time": "20:30",
           "activity": "Cena con vistas y experiencia nocturna",
           "location": "Mirador mencionado"
-        }}
+        }
       ]
-    }}
+    }
   ],
   "places": [
-    {{
+    {
       "name": "Nombre del lugar mencionado en el video",
       "description": "Descripción breve",
       "tip": "Consejo útil basado en el contenido del video"
-    }}
+    }
   ],
   "note": "⏰ Los horarios son orientativos y pueden ajustarse según tus preferencias y disponibilidad de cada lugar."
-}}
+}
+
+REGLAS PARA CADA CAMPO:
+- "destination": nombre del destino tal y como se entiende en el video (ciudad, isla, región o país). Si el video recorre varias ciudades, usa la región o el país y elige como "city" la ciudad donde se aterriza
+- "city": ciudad principal en español cuando tenga nombre habitual en español (Londres, Nueva York, Florencia, Lisboa); si no, el nombre local
+- "country": nombre del país en español (Italia, Japón, Estados Unidos, Marruecos)
+- "airport_code": código IATA de 3 letras en mayúsculas del AEROPUERTO internacional principal con vuelos regulares (FCO para Roma, LHR para Londres, JFK para Nueva York, NRT para Tokio, RAK para Marrakech). Nunca inventes códigos: si el destino no tiene aeropuerto, usa el aeropuerto grande más cercano
+- "city_code": código IATA de la CIUDAD cuando existe y agrupa varios aeropuertos (ROM, LON, NYC, TYO, PAR, MIL); si la ciudad tiene un único aeropuerto, repite el airport_code
+- "description": una o dos frases, sin emojis, resumiendo lo que muestra el video
+- "duration": siempre con el formato "N días" (por ejemplo "4 días"), coherente con el número de elementos de "days"
+- "budget": rango orientativo por persona en euros con el formato "€X - €Y por persona (orientativo)", incluyendo vuelos desde España y alojamiento medio
+- "best_time": meses o estación recomendados y el motivo en pocas palabras (clima, festivales, menos turistas)
+- "days": una entrada por día natural, en orden; "title" empieza por "Día N: " y el día de la semana entre paréntesis es opcional
+- "activities": ordenadas por hora, con "time" en formato 24 horas "HH:MM" y "location" con el nombre concreto del lugar o la zona (nunca vacío)
+- "places": solo lugares que aparecen en la transcripción, sin repetir; "tip" es un consejo práctico (reserva previa, hora con menos gente, qué pedir)
+- "note": copia literalmente la nota del ejemplo de estructura
+- Todos los textos en español, sin Markdown y sin saltos de línea dentro de los valores
+- No añadas campos que no estén en la estructura ni dejes campos con null: si algo no se sabe, usa la mejor estimación razonable
+
+EJEMPLO COMPLETO (ilustrativo: los lugares reales deben salir siempre de la transcripción que recibas):
+
+Transcripción: "Tres días en Lisboa y esto es lo que tenéis que hacer. Subid en el tranvía 28 hasta la Alfama y perdeos por sus calles, al atardecer id al Mirador de Santa Luzia. En Belém probad los pasteles de nata originales y entrad al Monasterio de los Jerónimos. Y el último día, excursión a Sintra para ver el Palacio da Pena."
+
+Respuesta:
+{
+  "destination": "Lisboa",
+  "city": "Lisboa",
+  "country": "Portugal",
+  "airport_code": "LIS",
+  "city_code": "LIS",
+  "description": "Escapada de tres días por los barrios históricos de Lisboa, Belém y Sintra siguiendo las recomendaciones del video.",
+  "duration": "3 días",
+  "budget": "€350 - €550 por persona (orientativo)",
+  "best_time": "De abril a junio y septiembre-octubre: buen clima y menos calor que en verano",
+  "days": [
+    {
+      "title": "Día 1: Tranvía 28 y Alfama",
+      "activities": [
+        {"time": "09:30", "activity": "Desayuno en una pastelería del centro", "location": "Baixa"},
+        {"time": "10:30", "activity": "Recorrido completo en el tranvía 28", "location": "Praça Martim Moniz"},
+        {"time": "13:30", "activity": "Comida de sardinas y bacalao", "location": "Alfama"},
+        {"time": "16:00", "activity": "Paseo sin rumbo por las callejuelas de la Alfama", "location": "Alfama"},
+        {"time": "19:30", "activity": "Atardecer con vistas al Tajo", "location": "Mirador de Santa Luzia"},
+        {"time": "21:00", "activity": "Cena con fado", "location": "Alfama"}
+      ]
+    },
+    {
+      "title": "Día 2: Belém",
+      "activities": [
+        {"time": "09:00", "activity": "Pasteles de nata recién hechos", "location": "Pastéis de Belém"},
+        {"time": "10:00", "activity": "Visita al monasterio y su claustro", "location": "Monasterio de los Jerónimos"},
+        {"time": "13:30", "activity": "Comida junto al río", "location": "Paseo marítimo de Belém"},
+        {"time": "16:30", "activity": "Vuelta al centro y paseo por el Chiado", "location": "Chiado"},
+        {"time": "20:30", "activity": "Cena y ambiente nocturno", "location": "Bairro Alto"}
+      ]
+    },
+    {
+      "title": "Día 3: Excursión a Sintra",
+      "activities": [
+        {"time": "08:30", "activity": "Tren desde Rossio a Sintra", "location": "Estación de Rossio"},
+        {"time": "10:00", "activity": "Visita al palacio y sus jardines", "location": "Palacio da Pena"},
+        {"time": "13:30", "activity": "Comida y travesseiros de postre", "location": "Centro de Sintra"},
+        {"time": "17:00", "activity": "Regreso a Lisboa y traslado al aeropuerto", "location": "Aeropuerto Humberto Delgado"}
+      ]
+    }
+  ],
+  "places": [
+    {"name": "Tranvía 28", "description": "Tranvía histórico que cruza los barrios antiguos", "tip": "Súbete en la cabecera de Martim Moniz a primera hora para ir sentado"},
+    {"name": "Alfama", "description": "Barrio más antiguo de Lisboa, de calles estrechas y empinadas", "tip": "Lleva calzado cómodo: el empedrado resbala"},
+    {"name": "Mirador de Santa Luzia", "description": "Mirador con azulejos sobre los tejados y el río", "tip": "Llega media hora antes del atardecer para coger sitio"},
+    {"name": "Pastéis de Belém", "description": "Pastelería que elabora los pasteles de nata originales", "tip": "Cómelos dentro: la cola para llevar es más larga"},
+    {"name": "Monasterio de los Jerónimos", "description": "Monasterio manuelino Patrimonio de la Humanidad", "tip": "Compra la entrada online y evita los lunes, que cierra"},
+    {"name": "Palacio da Pena", "description": "Palacio romántico de colores en lo alto de la sierra de Sintra", "tip": "Reserva franja horaria y sube en el autobús 434"}
+  ],
+  "note": "⏰ Los horarios son orientativos y pueden ajustarse según tus preferencias y disponibilidad de cada lugar."
+}
 
 IMPORTANTE:
 - Identifica el destino mencionado en el video
@@ -652,86 +1455,276 @@ IMPORTANTE:
 - Los horarios deben ser REALISTAS y con SENTIDO (desayuno por la mañana, cena por la noche, etc.)
 - Respeta los DÍAS NATURALES (un viernes es un día, el sábado siguiente es otro día distinto)"""
 
+class LLMUsage:
+    """Tokens consumidos por las llamadas al LLM (incluidos los leídos de la caché de prompt)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.input_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.output_tokens = 0
+        self.ttft_total = 0.0
+
+    def record(self, usage, ttft, total):
+        cache_creation = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+        cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+        log.info("🧮 Tokens: %s entrada, %s leídos de caché, %s escritos en caché, %s salida "
+                 "(primer token %.2fs, total %.2fs)",
+                 usage.input_tokens, cache_read, cache_creation, usage.output_tokens, ttft, total,
+                 extra={'input_tokens': usage.input_tokens, 'cache_read_input_tokens': cache_read,
+                        'cache_creation_input_tokens': cache_creation, 'output_tokens': usage.output_tokens,
+                        'ttft': round(ttft, 3), 'duration': round(total, 3)})
+        LLM_TOKENS.inc(usage.input_tokens, type='input')
+        LLM_TOKENS.inc(cache_read, type='cache_read')
+        LLM_TOKENS.inc(cache_creation, type='cache_creation')
+        LLM_TOKENS.inc(usage.output_tokens, type='output')
+        LLM_FIRST_TOKEN_SECONDS.observe(ttft)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += usage.input_tokens
+            self.cache_creation_input_tokens += cache_creation
+            self.cache_read_input_tokens += cache_read
+            self.output_tokens += usage.output_tokens
+            self.ttft_total += ttft
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'input_tokens': self.input_tokens,
+                'cache_creation_input_tokens': self.cache_creation_input_tokens,
+                'cache_read_input_tokens': self.cache_read_input_tokens,
+                'output_tokens': self.output_tokens,
+                'avg_time_to_first_token': round(self.ttft_total / self.calls, 3) if self.calls else None
+            }
+
+llm_usage = LLMUsage()
+
+# Campos del itinerario que se emiten elemento a elemento durante el streaming
+STREAMED_LIST_FIELDS = ('days', 'places')
+
+def build_itinerary_prompt(video_transcript, video_info):
+    """Mensaje de usuario para Claude: solo la plataforma y la transcripción cambian entre peticiones"""
+    # Si no hay transcripción, usar mensaje de error
+    if not video_transcript or len(video_transcript.strip()) < 10:
+        video_transcript = "[No se pudo extraer audio del video - video sin sonido o error en descarga]"
+
+    # Las reglas y el esquema JSON van en ITINERARY_SYSTEM_PROMPT (cacheado)
+    return f"""Un usuario ha compartido un video de {video_info['platform']} sobre un destino turístico.
+
+TRANSCRIPCIÓN DEL VIDEO (diálogos y narración REALES extraídos del video):
+---
+{video_transcript}
+---
+
+Genera el itinerario siguiendo las reglas y la estructura JSON EXACTA indicadas (sin texto adicional, solo el JSON)."""
+
+def itinerary_request(prompt):
+    """Argumentos de la llamada en streaming a Claude Haiku con el prompt de sistema cacheado"""
+    # Usar Claude Haiku - mucho más económico (~20x más barato que Sonnet 4)
+    # Las instrucciones fijas van en un bloque system con prompt caching:
+    # las lecturas de caché cuestan ~10% y reducen el tiempo al primer token.
+    # Haiku solo cachea prefijos de al menos PROMPT_CACHE_MIN_TOKENS: por eso
+    # el esquema, las reglas por campo y el ejemplo completo van en el system
+    return {
+        'model': "claude-3-5-haiku-20241022",  # Haiku es ~$0.25 vs ~$5 por millón de tokens
+        'max_tokens': 4000,
+        'system': [
+            {"type": "text", "text": ITINERARY_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+        ],
+        'messages': [
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+def itinerary_stream_parser(on_partial):
+    """Parser incremental que llama a on_partial con cada campo y cada día completados"""
+    def on_field(key, value):
+        # Las listas se emiten elemento a elemento en on_item
+        if on_partial and key not in STREAMED_LIST_FIELDS:
+            on_partial({'field': key, 'value': value})
+
+    def on_item(key, index, value):
+        if on_partial:
+            on_partial({'field': key, 'index': index, 'value': value})
+
+    return IncrementalJSONParser(on_field=on_field, on_item=on_item, item_fields=STREAMED_LIST_FIELDS)
+
+def finish_itinerary_call(message, started, first_token_at):
+    """Registra tokens y latencias de la llamada y devuelve el itinerario de la respuesta"""
+    llm_usage.record(message.usage, (first_token_at or time.time()) - started, time.time() - started)
+    UPSTREAM_SECONDS.observe(time.time() - started, upstream='anthropic', operation='itinerary')
+    UPSTREAM_RESPONSES.inc(upstream='anthropic', operation='itinerary', status=200)
+
+    # Extraer el contenido de la respuesta
+    response_text = message.content[0].text
+
+    # Intentar parsear directamente
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        # Si falla, intentar extraer JSON de markdown o texto
+        json_match = re.search(r'\{[\s\S]*\}', response_text)
+        if json_match:
+            return json.loads(json_match.group(0))
+        raise ValueError("No se pudo extraer JSON válido de la respuesta")
+
+async def generate_itinerary_with_ai(video_transcript, video_info, on_partial=None, deadline=None):
+    """Usa Claude Haiku (económico) para generar itinerario basado en la transcripción REAL del video.
+
+    La respuesta se recibe en streaming: on_partial(event) se llama en el loop
+    en cuanto se completa cada campo de primer nivel ({'field', 'value'}) y
+    cada día del itinerario ({'field': 'days', 'index', 'value'}), antes de
+    que termine la generación completa. Con deadline, la llamada (incluido el
+    streaming) se corta al agotarse el plazo del análisis. Con el circuito de
+    Anthropic abierto lanza CircuitOpenError sin llamar.
+    """
+    prompt = build_itinerary_prompt(video_transcript, video_info)
+    if not anthropic_breaker.allow():
+        raise CircuitOpenError("Circuito de Anthropic abierto")
+
     try:
-        # Usar Claude Haiku - mucho más económico (~20x más barato que Sonnet 4)
-        message = anthropic_client.messages.create(
-            model="claude-3-5-haiku-20241022",  # Haiku es ~$0.25 vs ~$5 por millón de tokens
-            max_tokens=4000,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        # Extraer el contenido de la respuesta
-        response_text = message.content[0].text
-
-        # Intentar parsear directamente
+        parser = itinerary_stream_parser(on_partial)
+        started = time.time()
+        first_token_at = None
+        timeout = timeout_for(deadline, LLM_TIMEOUT)
+        client = with_deadline(anthropic_client, deadline)
         try:
-            itinerary = json.loads(response_text)
-        except json.JSONDecodeError:
-            # Si falla, intentar extraer JSON de markdown o texto
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            if json_match:
-                itinerary = json.loads(json_match.group(0))
-            else:
-                raise ValueError("No se pudo extraer JSON válido de la respuesta")
+            async with client.beta.prompt_caching.messages.stream(**itinerary_request(prompt), timeout=timeout) as stream:
+                async for text in stream.text_stream:
+                    if first_token_at is None:
+                        first_token_at = time.time()
+                    parser.feed(text)
+                    if deadline is not None and deadline.expired():
+                        raise DeadlineExceeded("Plazo agotado generando el itinerario")
+                message = await stream.get_final_message()
+        except Exception as e:
+            record_ai_error(anthropic_breaker, e, deadline)
+            raise
+        anthropic_breaker.record(True)
 
-        return itinerary
+        return finish_itinerary_call(message, started, first_token_at)
 
     except Exception as e:
-        print(f"Error al generar itinerario: {str(e)}")
+        log.error("Error al generar itinerario: %s", e)
+        UPSTREAM_RESPONSES.inc(upstream='anthropic', operation='itinerary', status=getattr(e, 'status_code', 'error'))
+        raise
+
+def location_from_ip_api(geo_data):
+    """(país, ciudad) de una respuesta de ip-api.com o None.
+
+    El país es el código ISO (countryCode), como en la base local, para que
+    resolve_city pueda desambiguar ciudades homónimas.
+    """
+    if geo_data.get('status') == 'success':
+        return geo_data.get('countryCode') or geo_data.get('country', 'ES'), geo_data.get('city', 'Madrid')
+    return None
+
+async def lookup_location_remote(user_ip):
+    """Geolocalización con ip-api.com → (país, ciudad) o None (CircuitOpenError si está caído)"""
+    if not ip_api_breaker.allow():
+        raise CircuitOpenError("Circuito de ip-api abierto")
+    started = time.perf_counter()
+    geo_response = None
+    try:
+        geo_response = await ip_api_http.get(GEOIP_REMOTE_URL.format(ip=user_ip), timeout=5, deadline=Deadline(5))
+        ip_api_breaker.record(not failed_status(geo_response.status_code))
+    except Exception:
+        ip_api_breaker.record(False)
         raise
+    finally:
+        record_upstream('ip-api', 'geolocation', started, geo_response)
+    return location_from_ip_api(geo_response.json())
+
+async def public_ip(fallback):
+    """IP pública del servidor con ipify (la petición llega desde localhost); fallback si no responde"""
+    if not ipify_breaker.allow():
+        return fallback
+    ok = False
+    try:
+        ip_response = await ipify_http.get('https://api.ipify.org?format=json', timeout=3, deadline=Deadline(3))
+        ok = not failed_status(ip_response.status_code)
+        return ip_response.json().get('ip', fallback)
+    except Exception:
+        return fallback
+    finally:
+        ipify_breaker.record(ok)
+
+def is_global_ip(ip):
+    """True si la IP es pública (una privada no tiene sentido consultarla a ip-api)"""
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+def locate_ip(user_ip):
+    """(país, ciudad) de una IP: base local primero, el servicio remoto solo como respaldo"""
+    location = geolocator.lookup(user_ip)
+    if location is None and GEOIP_REMOTE_FALLBACK and is_global_ip(user_ip):
+        try:
+            location = aio_loop.run(lookup_location_remote(user_ip))
+            if location is not None:
+                geolocator.remember(user_ip, location)
+        except CircuitOpenError:
+            pass  # ip-api caído: directamente la ubicación por defecto
+        except Exception as e:
+            log.error("Error en geolocalización: %s", e)
+    return location
+
+# Ubicación del propio servidor (peticiones desde localhost): se resuelve una sola vez
+_server_location = {}
+_server_location_lock = threading.Lock()
+
+def server_location(fallback_ip):
+    """(país, ciudad) de la IP pública del servidor, consultando ipify como mucho una vez.
+
+    El lock hace de single-flight: las peticiones simultáneas esperan a la
+    primera en lugar de repetir las llamadas remotas. Un fallo no se guarda,
+    así que se reintenta en la siguiente petición.
+    """
+    with _server_location_lock:
+        if 'location' in _server_location:
+            return _server_location['location']
+        server_ip = aio_loop.run(public_ip(None)) if GEOIP_REMOTE_FALLBACK else None
+        location = locate_ip(server_ip or fallback_ip)
+        if server_ip is not None and location is not None:
+            _server_location['location'] = location
+        return location
 
 @app.route('/api/detect-location', methods=['GET'])
 def detect_location():
     """Detecta la ubicación del usuario basándose en su IP"""
     try:
-        # Intentar obtener IP del usuario
+        # Intentar obtener IP del usuario (la primera de X-Forwarded-For es la del cliente)
         if request.headers.getlist("X-Forwarded-For"):
-            user_ip = request.headers.getlist("X-Forwarded-For")[0]
+            user_ip = request.headers.getlist("X-Forwarded-For")[0].split(',')[0].strip()
         else:
             user_ip = request.remote_addr
 
-        # Si es localhost, usar servicio de IP pública
-        if user_ip in ['127.0.0.1', 'localhost', '::1']:
-            # Obtener IP pública
-            try:
-                ip_response = requests.get('https://api.ipify.org?format=json', timeout=3)
-                user_ip = ip_response.json().get('ip', user_ip)
-            except:
-                pass
-
-        # Usar servicio de geolocalización gratuito
+        # Desde localhost (o una red privada en modo debug) el cliente es esta
+        # misma máquina: su ubicación es la de la IP pública del servidor.
+        # Otra IP privada en producción (p. ej. un proxy sin X-Forwarded-For)
+        # no se resuelve con ipify, que devolvería la ubicación del servidor.
         try:
-            geo_response = requests.get(f'http://ip-api.com/json/{user_ip}', timeout=5)
-            geo_data = geo_response.json()
-
-            if geo_data.get('status') == 'success':
-                city = geo_data.get('city', 'Madrid')
-                country = geo_data.get('country', 'España')
-
-                # Mapeo de ciudades a códigos de aeropuerto IATA
-                city_to_iata = {
-                    'Madrid': 'MAD',
-                    'Barcelona': 'BCN',
-                    'Valencia': 'VLC',
-                    'Sevilla': 'SVQ',
-                    'Málaga': 'AGP',
-                    'Bilbao': 'BIO',
-                    'Alicante': 'ALC',
-                    'Palma': 'PMI',
-                }
-
-                iata_code = city_to_iata.get(city, 'MAD')
-
-                return jsonify({
-                    'city': city,
-                    'country': country,
-                    'iata_code': iata_code,
-                    'detected': True
-                })
-        except Exception as e:
-            print(f"Error en geolocalización: {str(e)}")
+            address = ipaddress.ip_address(user_ip)
+            is_local = address.is_loopback or (address.is_private and app.debug)
+        except ValueError:
+            is_local = user_ip == 'localhost'
+
+        location = server_location(user_ip) if is_local else locate_ip(user_ip)
+
+        if location is not None:
+            country, city = location
+            city = city or 'Madrid'
+
+            return jsonify({
+                'city': city,
+                'country': country or 'España',
+                'iata_code': airport_index.resolve_city(city, country) or 'MAD',
+                'detected': True
+            })
 
         # Fallback a Madrid si falla
         return jsonify({
@@ -742,7 +1735,7 @@ def detect_location():
         })
 
     except Exception as e:
-        print(f"Error detectando ubicación: {str(e)}")
+        log.error("Error detectando ubicación: %s", e)
         return jsonify({
             'city': 'Madrid',
             'country': 'España',
@@ -750,98 +1743,608 @@ def detect_location():
             'detected': False
         })
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze_video():
-    """Endpoint para analizar un video REAL y generar itinerario basado en su contenido"""
-    audio_path = None
+class AnalysisError(Exception):
+    """Error del pipeline de análisis con mensaje para el usuario y código HTTP"""
 
-    try:
-        data = request.get_json()
-        video_url = data.get('video_url', '').strip()
-        origin_iata = data.get('origin_iata', 'MAD').strip().upper()  # Origen del vuelo
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
 
-        if not video_url:
-            return jsonify({'error': 'URL del video es requerida'}), 400
+def parse_analyze_request(data):
+    """Valida el cuerpo de una petición de análisis y devuelve (video_url, origin_iata, video_info).
 
-        # Validar que sea un URL válido de TikTok o Instagram
-        if not ('tiktok.com' in video_url or 'instagram.com' in video_url):
-            return jsonify({'error': 'Por favor, proporciona un link válido de TikTok o Instagram'}), 400
+    No usa la red: los enlaces cortos se resuelven ya dentro del análisis
+    (resolve_video_info), no en el worker HTTP que recibe la petición.
+    """
+    data = data or {}
+    video_url = data.get('video_url', '').strip()
+    origin_iata = data.get('origin_iata', 'MAD').strip().upper()  # Origen del vuelo
 
-        # Extraer información del video
-        video_info = extract_video_info(video_url)
+    if not video_url:
+        raise AnalysisError('URL del video es requerida', 400)
 
-        if not video_info['platform']:
-            return jsonify({'error': 'No se pudo identificar la plataforma del video'}), 400
+    # Validar que sea un URL válido de TikTok o Instagram (sin red: solo el host)
+    video_info = url_resolver.parse(video_url)
+    if not video_info['platform']:
+        raise AnalysisError('Por favor, proporciona un link válido de TikTok o Instagram', 400)
 
-        print(f"🎬 Procesando video de {video_info['platform']}...")
+    return video_url, origin_iata, video_info
 
-        # PASO 1: Descargar audio del video
+def cleanup_audio(audio_path):
+    """Elimina el audio temporal y su directorio si queda vacío"""
+    if audio_path and os.path.exists(audio_path):
         try:
-            audio_path = download_video_audio(video_url)
-        except Exception as e:
-            print(f"⚠️  No se pudo descargar el video: {str(e)}")
-            return jsonify({'error': 'No se pudo descargar el video. Verifica que el link sea público y válido.'}), 400
+            os.remove(audio_path)
+            temp_dir = os.path.dirname(audio_path)
+            if os.path.exists(temp_dir) and not os.listdir(temp_dir):
+                os.rmdir(temp_dir)
+        except:
+            pass
+
+async def get_booking_links(cache_key, itinerary, origin_iata, prices=None, deadline=None, price_lookups=None):
+    """booking_links desde la caché o generados con generate_booking_links (y guardados si están completos)"""
+    booking_links = await result_cache.get_booking_links_async(cache_key, origin_iata) if cache_key else None
+    if booking_links is not None:
+        log.info("⚡ Booking links en caché para %s desde %s", cache_key, origin_iata)
+        return booking_links
+
+    log.info("🔗 Generando links a buscadores de vuelos, hoteles y actividades...")
+    log.info("📍 Origen del vuelo: %s (%s)", get_city_from_iata(origin_iata), origin_iata)
+    booking_links = await generate_booking_links(itinerary, origin_iata, prices=prices, deadline=deadline,
+                                                 price_lookups=price_lookups)
+    if cache_key and not booking_links['prices_pending']:
+        await result_cache.set_booking_links_async(cache_key, origin_iata, booking_links)
+    return booking_links
+
+def deadline_error(stage, deadline):
+    """AnalysisError 504 para un análisis que agotó su plazo antes de tener el itinerario"""
+    DEADLINE_EXCEEDED.inc(stage=stage)
+    log.warning("⏱️  Plazo de %ss agotado en la etapa %s", deadline.seconds, stage)
+    return AnalysisError('El análisis ha tardado demasiado. Inténtalo de nuevo en unos minutos.', 504)
+
+def record_analysis(video_info, origin_iata, started, result):
+    """Métricas y log final de un análisis (result: 'ok' o 'error')"""
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(elapsed, stage='analysis')
+    ANALYSES.inc(result=result)
+    log.info("🏁 Análisis %s en %.2fs", 'completado' if result == 'ok' else 'fallido', elapsed,
+             extra={'video': video_cache_key(video_info), 'origin': origin_iata, 'result': result,
+                    'duration': round(elapsed, 3)})
+
+def stage_slot(stages, name):
+    """Turno en la etapa name de un StageLimits (los lotes), o nada si el análisis no tiene límites"""
+    return stages.slot(name) if stages is not None else contextlib.nullcontext()
+
+async def run_analysis(progress, video_url, origin_iata, video_info, deadline=None, stages=None,
+                       price_lookups=None):
+    """Pipeline completo: descarga → Whisper → Claude Haiku → Amadeus.
+
+    progress(stage, data) se llama al completar cada etapa: 'downloaded',
+    'transcribed', 'itinerary_ready' (con el itinerario) y 'prices_ready'
+    (con los booking_links). Mientras se genera el itinerario se emite
+    'itinerary_partial' con cada campo y cada día completados. Si los metadatos del video bastan no hay
+    descarga y 'downloaded' no se emite. Devuelve el itinerario con booking_links.
+
+    Corre como corrutina del event loop compartido: Whisper, Claude y Amadeus
+    usan clientes asíncronos; yt-dlp y la lectura de metadatos van al pool
+    de medios del loop y el borrado del audio al de tareas breves. Mientras
+    espera a la red, el análisis no ocupa ningún hilo.
+
+    Todas las etapas comparten el plazo deadline (por defecto ANALYSIS_DEADLINE
+    segundos desde que empieza la primera etapa). Si se agota antes del
+    itinerario el análisis falla con 504; si se agota en Amadeus,
+    booking_links lleva prices_pending=True.
+
+    Los lotes pasan stages (un batch.StageLimits: cada etapa espera su turno)
+    y price_lookups (un batch.SharedLookups: los videos con el mismo destino
+    comparten las búsquedas de Amadeus).
+    """
+    audio_path = None
+    prices = None
+    video_transcript = None
+    started = time.perf_counter()
+    result = 'error'
 
-        # PASO 2: Transcribir audio con Whisper (barato: $0.006 por minuto)
-        try:
-            video_transcript = transcribe_audio(audio_path)
-            print(f"📝 Transcripción obtenida: {video_transcript[:200]}...")
-        except Exception as e:
-            print(f"⚠️  No se pudo transcribir: {str(e)}")
-            video_transcript = ""
+    try:
+        async with stage_slot(stages, 'download'):
+            # En un lote el plazo no corre mientras el video espera su primer turno
+            deadline = deadline or Deadline(ANALYSIS_DEADLINE)
+
+            # Buscar en caché por identidad del video (plataforma + id)
+            cache_key = video_cache_key(video_info)
+            itinerary = await result_cache.get_itinerary_async(cache_key) if cache_key else None
 
-        # PASO 3: Generar itinerario con Claude Haiku basado en transcripción REAL
-        itinerary = generate_itinerary_with_ai(video_transcript, video_info)
+            if itinerary is not None:
+                log.info("⚡ Itinerario en caché para %s", cache_key)
+            else:
+                log.info("🎬 Procesando video de %s...", video_info['platform'])
+                # Sin Claude no hay itinerario: con su circuito abierto no se descarga ni se transcribe
+                if anthropic_breaker.is_open():
+                    raise CircuitOpenError("Circuito de Anthropic abierto")
+
+                # Vía rápida: si los subtítulos/descripción bastan, no se descarga el audio.
+                # yt-dlp corre en un hilo que no se puede interrumpir: se deja de esperarlo al
+                # agotarse el plazo (y la descarga se corta sola en su progress_hook)
+                if METADATA_FAST_PATH:
+                    try:
+                        with STAGE_SECONDS.time(stage='metadata'):
+                            video_transcript = await asyncio.wait_for(
+                                aio_loop.run_media(get_metadata_transcript, video_url, deadline),
+                                budget_for(deadline))
+                    except asyncio.TimeoutError:
+                        video_transcript = None
+
+                # PASO 1: Descargar audio del video
+                if not video_transcript:
+                    try:
+                        with STAGE_SECONDS.time(stage='download'):
+                            audio_path = await asyncio.wait_for(
+                                aio_loop.run_media(download_video_audio, video_url, deadline),
+                                budget_for(deadline))
+                    except Exception as e:
+                        if deadline.expired():
+                            raise deadline_error('download', deadline)
+                        log.warning("⚠️  No se pudo descargar el video: %s", e)
+                        raise AnalysisError('No se pudo descargar el video. Verifica que el link sea público y válido.', 400)
+
+        if itinerary is None:
+            if video_transcript:
+                progress('transcribed', {'characters': len(video_transcript), 'source': 'metadata'})
+            else:
+                progress('downloaded')
+
+                # PASO 2: Transcribir audio con Whisper (barato: $0.006 por minuto)
+                try:
+                    async with stage_slot(stages, 'transcribe'):
+                        with STAGE_SECONDS.time(stage='transcribe'):
+                            video_transcript = await transcribe_audio(audio_path, deadline)
+                    log.debug("📝 Transcripción obtenida: %s...", video_transcript[:200])
+                except Exception as e:
+                    log.warning("⚠️  No se pudo transcribir: %s", e)
+                    video_transcript = ""
+                progress('transcribed', {'characters': len(video_transcript), 'source': 'audio'})
+
+            # PASO 3: Generar itinerario con Claude Haiku basado en transcripción REAL
+            # En cuanto el modelo escribe airport_code, city_code y duration se
+            # lanzan las búsquedas de Amadeus (una tarea) mientras sigue generando los días,
+            # salvo que ya haya booking_links en caché (on_partial no puede esperar al SQLite)
+            partial_fields = {}
+            links_cached = bool(cache_key and await result_cache.get_booking_links_async(cache_key, origin_iata))
+
+            def on_partial(event):
+                nonlocal prices
+                progress('itinerary_partial', event)
+                if 'index' in event:
+                    return
+                partial_fields[event['field']] = event['value']
+                if (prices is None and not links_cached and event['field'] == 'duration'
+                        and partial_fields.get('airport_code')):
+                    log.info("🚀 Lanzando búsquedas de Amadeus antes de terminar el itinerario...")
+                    prices = price_lookup(origin_iata, booking_codes(partial_fields), deadline, price_lookups)
+
+            async with stage_slot(stages, 'itinerary'):
+                with STAGE_SECONDS.time(stage='itinerary'):
+                    itinerary = await generate_itinerary_with_ai(video_transcript, video_info, on_partial=on_partial,
+                                                                 deadline=deadline)
+
+            if cache_key:
+                await result_cache.set_itinerary_async(cache_key, itinerary)
+        progress('itinerary_ready', itinerary)
 
         # PASO 4: Generar links automáticos a buscadores de vuelos, hoteles y actividades
-        print(f"🔗 Generando links a buscadores de vuelos, hoteles y actividades...")
-        print(f"📍 Origen del vuelo: {get_city_from_iata(origin_iata)} ({origin_iata})")
-        booking_links = generate_booking_links(itinerary, origin_iata)
+        async with stage_slot(stages, 'prices'):
+            with STAGE_SECONDS.time(stage='prices'):
+                booking_links = await get_booking_links(cache_key, itinerary, origin_iata, prices, deadline,
+                                                        price_lookups)
         itinerary['booking_links'] = booking_links
+        itinerary['itinerary_id'] = cache_key  # Para refrescar los precios con /api/reprice
+        progress('prices_ready', booking_links)
+
+        result = 'ok'
+        return itinerary
 
+    except AnalysisError:
+        raise
+    except CircuitOpenError as e:
+        log.warning("🔌 %s: análisis rechazado sin llamar", e)
+        raise AnalysisError('El servicio de IA no está disponible ahora mismo. Inténtalo de nuevo en unos minutos.', 503)
+    except Exception as e:
+        if deadline is not None and deadline.expired():
+            raise deadline_error('itinerary', deadline)
+        log.error("❌ Error: %s", e)
+        raise AnalysisError(f'Error al procesar el video: {str(e)}', 500)
+
+    finally:
+        # Búsquedas lanzadas durante una generación que falló (o cuyo JSON se rechazó):
+        # sin itinerario no hay booking_links que las usen. Las de un lote son compartidas
+        if result == 'error' and prices is not None and price_lookups is None:
+            log.info("🛑 Cancelando las búsquedas de Amadeus lanzadas durante la generación")
+            prices.cancel()
         # Limpiar archivo temporal
-        if audio_path and os.path.exists(audio_path):
-            try:
-                os.remove(audio_path)
-                # Eliminar directorio temporal si está vacío
-                temp_dir = os.path.dirname(audio_path)
-                if os.path.exists(temp_dir) and not os.listdir(temp_dir):
-                    os.rmdir(temp_dir)
-            except:
-                pass
+        if audio_path:
+            await aio_loop.run_blocking(cleanup_audio, audio_path)
+        record_analysis(video_info, origin_iata, started, result)
+
+# Peticiones simultáneas del mismo video y origen comparten un único pipeline
+# (una descarga, una transcripción, un itinerario y unas búsquedas de Amadeus)
+analysis_flights = AsyncSingleFlight()
+
+def analysis_key(video_url, origin_iata, video_info):
+    """Clave de agrupación: identidad del video (o su URL si no hay id) + origen"""
+    return f"{video_cache_key(video_info) or video_url}|{origin_iata}"
+
+async def run_analysis_coalesced(progress, video_url, origin_iata, video_info, deadline=None, stages=None,
+                                 price_lookups=None):
+    """run_analysis con single-flight: las peticiones iguales en curso esperan al mismo resultado.
+
+    Los enlaces cortos se resuelven antes de agrupar, para que un enlace
+    corto y la URL completa del mismo video compartan el análisis.
+    """
+    video_info = await resolve_video_info(video_url, video_info)
+    return await analysis_flights.run(
+        analysis_key(video_url, origin_iata, video_info),
+        lambda emit: run_analysis(emit, video_url, origin_iata, video_info, deadline, stages, price_lookups),
+        progress
+    )
+
+async def run_analysis_job(progress, video_url, origin_iata, video_info):
+    """run_analysis_coalesced de un trabajo: su plazo es JOBS_DEADLINE desde que empieza a ejecutarse"""
+    return await run_analysis_coalesced(progress, video_url, origin_iata, video_info, Deadline(JOBS_DEADLINE))
+
+# Trabajos asíncronos: el análisis corre fuera del worker HTTP, como tarea del event loop
+# (JOBS_MAX_CONCURRENT a la vez sin un hilo cada una)
+job_manager = JobManager(
+    run_analysis_job,
+    aio_loop,
+    max_workers=int(os.environ.get("JOBS_MAX_CONCURRENT", 200)),
+    max_pending=int(os.environ.get("JOBS_MAX_PENDING", 500)),
+    ttl=int(os.environ.get("JOBS_TTL", 3600))
+)
 
+@app.route('/api/analyze', methods=['POST'])
+def analyze_video():
+    """Endpoint para analizar un video REAL y generar itinerario basado en su contenido"""
+    deadline = Deadline(ANALYSIS_DEADLINE)  # El plazo cuenta desde que llega la petición
+    try:
+        video_url, origin_iata, video_info = parse_analyze_request(request.get_json())
+        progress = lambda stage, data=None: None
+        itinerary = aio_loop.run(run_analysis_coalesced(progress, video_url, origin_iata, video_info, deadline))
         return jsonify(itinerary), 200
 
+    except AnalysisError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        log.error("❌ Error: %s", e)
+        return jsonify({'error': f'Error al procesar el video: {str(e)}'}), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_analyze_job():
+    """Crea un trabajo de análisis y devuelve su id sin esperar al resultado"""
+    try:
+        video_url, origin_iata, video_info = parse_analyze_request(request.get_json())
+        job = job_manager.submit(video_url=video_url, origin_iata=origin_iata, video_info=video_info)
+    except AnalysisError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except QueueFullError as e:
+        log.warning("⚠️  Cola de trabajos llena: %s", e)
+        return jsonify({'error': 'El servidor está ocupado, inténtalo de nuevo en unos segundos'}), 503
+
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.id}',
+        'events_url': f'/api/jobs/{job.id}/events'
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_analyze_job(job_id):
+    """Estado de un trabajo de análisis (y su resultado cuando termina)"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_analyze_job(job_id):
+    """Progreso de un trabajo como Server-Sent Events (una etapa por evento)"""
+    if job_manager.get(job_id) is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+
+    return Response(
+        stream_with_context(job_manager.iter_events(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# === ANÁLISIS POR LOTES ===
+# Cada video del lote es un run_analysis (con su single-flight, su circuito y su plazo);
+# cada etapa admite un máximo de videos a la vez, compartido por todos los lotes en curso
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 50))
+
+batch_stages = StageLimits([
+    ('download', int(os.environ.get("BATCH_DOWNLOAD_WORKERS", 4))),
+    ('transcribe', int(os.environ.get("BATCH_TRANSCRIBE_WORKERS", 4))),
+    ('itinerary', int(os.environ.get("BATCH_LLM_WORKERS", 4))),
+    ('prices', int(os.environ.get("BATCH_PRICES_WORKERS", 4)))
+])
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def iter_batch_analysis(video_urls, origin_iata):
+    """Analiza un lote y genera un evento SSE 'item' por URL según terminan.
+
+    Las URLs del mismo video (misma plataforma e id) se analizan una sola vez
+    y su resultado se emite para cada una. Al final se emite 'done' con el
+    resumen del lote. Si el cliente se desconecta se cancelan los análisis
+    que siguen en curso.
+    """
+    started = time.time()
+    results = queue.Queue()
+    groups = {}  # identidad del video → índices de las URLs
+    futures = []
+    price_lookups = SharedLookups(PriceLookup)
+    progress = lambda stage, data=None: None
+    succeeded = failed = 0
 
-        # Limpiar archivo temporal en caso de error
-        if audio_path and os.path.exists(audio_path):
+    try:
+        for index, video_url in enumerate(video_urls):
             try:
-                os.remove(audio_path)
-                temp_dir = os.path.dirname(audio_path)
-                if os.path.exists(temp_dir) and not os.listdir(temp_dir):
-                    os.rmdir(temp_dir)
-            except:
-                pass
+                video_url, _, video_info = parse_analyze_request({'video_url': video_url, 'origin_iata': origin_iata})
+            except AnalysisError as e:
+                failed += 1
+                yield sse_event('item', {'index': index, 'video_url': video_url, 'status': 'error',
+                                         'error': str(e), 'status_code': e.status_code})
+                continue
 
-        return jsonify({'error': f'Error al procesar el video: {str(e)}'}), 500
+            identity = video_cache_key(video_info) or video_url
+            if identity in groups:
+                groups[identity].append(index)
+                continue
+            groups[identity] = [index]
+
+            future = aio_loop.submit(run_analysis_coalesced(progress, video_url, origin_iata, video_info,
+                                                            stages=batch_stages, price_lookups=price_lookups))
+            future.add_done_callback(lambda future, identity=identity: results.put((identity, future)))
+            futures.append(future)
+
+        log.info("📦 Lote de %s URLs: %s videos distintos", len(video_urls), len(groups))
+
+        for _ in range(len(groups)):
+            identity, future = results.get()
+            try:
+                item = {'status': 'done', 'result': future.result()}
+            except AnalysisError as e:
+                item = {'status': 'error', 'error': str(e), 'status_code': e.status_code}
+            except Exception as e:
+                log.error("❌ Error: %s", e)
+                item = {'status': 'error', 'error': f'Error al procesar el video: {str(e)}', 'status_code': 500}
+
+            indexes = groups[identity]
+            for index in indexes:
+                if item['status'] == 'done':
+                    succeeded += 1
+                else:
+                    failed += 1
+                data = {'index': index, 'video_url': video_urls[index]}
+                data.update(item)
+                if index != indexes[0]:
+                    data['duplicate_of'] = indexes[0]
+                yield sse_event('item', data)
+
+        yield sse_event('done', {
+            'total': len(video_urls),
+            'unique': len(groups),
+            'succeeded': succeeded,
+            'failed': failed,
+            'price_lookups': len(price_lookups),
+            'elapsed': round(time.time() - started, 2)
+        })
+    finally:
+        # Cliente desconectado (GeneratorExit): nadie va a leer los resultados pendientes.
+        # Las búsquedas compartidas no se cancelan: sus llamadas tienen timeout y otro
+        # análisis agrupado con uno de estos videos puede estar esperándolas
+        for future in futures:
+            future.cancel()
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analiza varias URLs y devuelve cada resultado como evento SSE en cuanto está listo"""
+    data = request.get_json() or {}
+    video_urls = data.get('video_urls')
+    origin_iata = (data.get('origin_iata') or 'MAD').strip().upper()
+
+    if not isinstance(video_urls, list) or not video_urls:
+        return jsonify({'error': 'video_urls debe ser una lista de URLs'}), 400
+    if len(video_urls) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Máximo {BATCH_MAX_ITEMS} URLs por lote'}), 400
+    video_urls = [url if isinstance(url, str) else '' for url in video_urls]
+
+    return Response(
+        stream_with_context(iter_batch_analysis(video_urls, origin_iata)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# === RE-PRECIO: solo las búsquedas de Amadeus de un itinerario ya generado ===
+# Los precios caducan en horas; el itinerario no. Refrescar booking_links no
+# vuelve a descargar, transcribir ni llamar a Claude
+reprice_flights = AsyncSingleFlight()
+
+# Campos de un itinerario enviado por el cliente que usan booking_codes() y build_booking_links()
+ITINERARY_TEXT_FIELDS = ('destination', 'city', 'airport_code', 'city_code')
+
+def validate_client_itinerary(itinerary):
+    """AnalysisError 400 si el itinerario trae campos con un tipo que los links no admiten"""
+    for field in ITINERARY_TEXT_FIELDS:
+        if field in itinerary and not isinstance(itinerary[field], str):
+            raise AnalysisError(f'El campo {field} del itinerario debe ser texto', 400)
+
+    duration = itinerary.get('duration')
+    if 'duration' in itinerary and (isinstance(duration, bool) or not isinstance(duration, (str, int))):
+        raise AnalysisError('El campo duration del itinerario debe ser texto o un número de días', 400)
+
+    places = itinerary.get('places', [])
+    if not isinstance(places, list) or not all(
+            isinstance(place, dict) and isinstance(place.get('name', ''), str) for place in places):
+        raise AnalysisError('El campo places del itinerario debe ser una lista de lugares con nombre', 400)
+
+    if not (itinerary.get('airport_code') or itinerary.get('city_code')):
+        raise AnalysisError('El itinerario necesita airport_code o city_code', 400)
+
+def parse_reprice_request(data):
+    """Valida el cuerpo de /api/reprice → (itinerary_id o None, itinerary, origin_iata)"""
+    data = data or {}
+    origin_iata = data.get('origin_iata') or 'MAD'
+    itinerary_id = data.get('itinerary_id')
+    itinerary = data.get('itinerary')
+
+    if not isinstance(origin_iata, str):
+        raise AnalysisError('origin_iata debe ser un código IATA', 400)
+    origin_iata = origin_iata.strip().upper()
+
+    if itinerary_id:
+        if not isinstance(itinerary_id, str):
+            raise AnalysisError('itinerary_id debe ser texto', 400)
+        itinerary = result_cache.get_itinerary(itinerary_id)
+        if itinerary is None:
+            raise AnalysisError('Itinerario no encontrado o caducado; vuelve a analizar el video', 404)
+    elif isinstance(itinerary, dict):
+        validate_client_itinerary(itinerary)
+    else:
+        raise AnalysisError('Se requiere itinerary_id o itinerary', 400)
+
+    return itinerary_id, itinerary, origin_iata
+
+def reprice_lookup(origin_iata, codes, deadline):
+    """Resultados de un PriceLookup compartido por los re-precios en curso con el mismo origen y códigos"""
+    return reprice_flights.run(
+        f"{origin_iata}|{'|'.join(str(code) for code in codes)}",
+        lambda _: PriceLookup(origin_iata, *codes, deadline=deadline).wait()
+    )
+
+async def reprice(itinerary_id, itinerary, origin_iata, deadline=None):
+    """booking_links nuevos (sin mirar la caché de resultados) y guardados si hay itinerary_id.
+
+    Solo se comparten las búsquedas de Amadeus: los links (actividades,
+    ciudad...) se construyen con el itinerario de cada petición. Si el plazo
+    (por defecto REPRICE_DEADLINE) se agota, links a buscadores con
+    prices_pending=True, que no se guardan.
+    """
+    deadline = deadline or Deadline(REPRICE_DEADLINE)
+    codes = booking_codes(itinerary)
+    log.info("💸 Re-precio de %s desde %s", itinerary_id or itinerary.get('destination'), origin_iata)
+
+    with STAGE_SECONDS.time(stage='reprice'):
+        try:
+            price_results = await asyncio.wait_for(reprice_lookup(origin_iata, codes, deadline), budget_for(deadline))
+        except asyncio.TimeoutError:
+            price_results = None
+        booking_links = finish_booking_links(itinerary, origin_iata, codes, price_results, deadline)
+    if itinerary_id and not booking_links['prices_pending']:
+        await result_cache.set_booking_links_async(itinerary_id, origin_iata, booking_links)
+    return booking_links
+
+@app.route('/api/reprice', methods=['POST'])
+def reprice_itinerary():
+    """Vuelve a buscar vuelos y hoteles de un itinerario (por itinerary_id o enviado entero)"""
+    deadline = Deadline(REPRICE_DEADLINE)  # El plazo cuenta desde que llega la petición
+    try:
+        itinerary_id, itinerary, origin_iata = parse_reprice_request(request.get_json())
+        booking_links = aio_loop.run(reprice(itinerary_id, itinerary, origin_iata, deadline))
+        return jsonify({
+            'itinerary_id': itinerary_id,
+            'origin_iata': origin_iata,
+            'booking_links': booking_links,
+            'priced_at': datetime.now().isoformat(timespec='seconds')
+        }), 200
+
+    except AnalysisError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+    except Exception as e:
+        log.error("❌ Error en el re-precio: %s", e)
+        return jsonify({'error': f'Error al actualizar los precios: {str(e)}'}), 500
+
+# === MÉTRICAS CALCULADAS AL LEER (contadores que ya llevan las cachés, colas...) ===
+def cache_lookup_counts():
+    counts = {}
+    caches = {
+        'results': result_cache,
+        'transcripts': transcript_cache,
+        'amadeus_reference': amadeus_reference_cache,
+        'amadeus_offers': amadeus_offers_cache
+    }
+    for name, cache in caches.items():
+        stats = cache.stats()
+        counts[(name, 'memory_hit')] = stats['memory_hits']
+        counts[(name, 'disk_hit')] = stats['disk_hits']
+        counts[(name, 'miss')] = stats['misses']
+    geoip_stats = geolocator.cache.stats()
+    counts[('geoip', 'memory_hit')] = geoip_stats['hits']
+    counts[('geoip', 'miss')] = geoip_stats['misses']
+    return counts
+
+REGISTRY.collect('instatrip_cache_lookups_total', 'Consultas a las cachés por resultado',
+                 ['cache', 'result'], cache_lookup_counts, kind='counter')
+REGISTRY.collect('instatrip_jobs', 'Trabajos de análisis por estado', ['status'], job_manager.stats)
+REGISTRY.collect('instatrip_batch_stage_pending', 'Videos de lotes en cola o en curso por etapa', ['stage'],
+                 lambda: {stage: data['pending'] for stage, data in batch_stages.stats().items()})
+REGISTRY.collect('instatrip_amadeus_rate_limit_queued', 'Peticiones a Amadeus esperando turno', [],
+                 lambda: {(): amadeus_limiter.stats()['queued']})
+REGISTRY.collect('instatrip_amadeus_rate_limit_requests_total', 'Turnos del limitador de Amadeus por resultado',
+                 ['result'], lambda: {'granted': amadeus_limiter.granted, 'rejected': amadeus_limiter.rejected},
+                 kind='counter')
+REGISTRY.collect('instatrip_analysis_coalesced_total', 'Peticiones de análisis por pipeline propio o agrupadas con una en curso',
+                 ['result'], lambda: {'started': analysis_flights.started, 'coalesced': analysis_flights.coalesced},
+                 kind='counter')
+REGISTRY.collect('instatrip_circuit_breaker_open', 'Circuito del upstream abierto o semiabierto (1) o cerrado (0)',
+                 ['upstream'], lambda: {name: int(data['state'] != 'closed') for name, data in breakers_stats().items()})
+REGISTRY.collect('instatrip_circuit_breaker_rejected_total', 'Llamadas rechazadas al instante por un circuito abierto',
+                 ['upstream'], lambda: {name: data['rejected'] for name, data in breakers_stats().items()},
+                 kind='counter')
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Endpoint para verificar que el servidor está funcionando"""
-    return jsonify({'status': 'ok', 'message': 'Backend is running'}), 200
+    return jsonify({
+        'status': 'ok',
+        'message': 'Backend is running',
+        'cache': {
+            'results': result_cache.stats(),
+            'transcripts': transcript_cache.stats(),
+            'amadeus_reference': amadeus_reference_cache.stats(),
+            'amadeus_offers': amadeus_offers_cache.stats()
+        },
+        'video_urls': url_resolver.stats(),
+        'jobs': job_manager.stats(),
+        'coalescing': analysis_flights.stats(),
+        'async': aio_loop.stats(),
+        'batch': batch_stages.stats(),
+        'http': sessions_stats(),
+        'amadeus_token': amadeus_tokens.stats(),
+        'amadeus_rate_limit': amadeus_limiter.stats(),
+        'circuit_breakers': breakers_stats(),
+        'llm_usage': llm_usage.stats(),
+        'geoip': geolocator.stats()
+    }), 200
 
 if __name__ == '__main__':
     # Verificar que existen las API keys
     if not os.environ.get("ANTHROPIC_API_KEY"):
-        print("⚠️  WARNING: ANTHROPIC_API_KEY no está configurada")
-        print("⚠️  Configúrala con: export ANTHROPIC_API_KEY='tu-api-key'")
+        log.warning("⚠️  WARNING: ANTHROPIC_API_KEY no está configurada")
+        log.warning("⚠️  Configúrala con: export ANTHROPIC_API_KEY='tu-api-key'")
 
     if not os.environ.get("OPENAI_API_KEY"):
-        print("⚠️  WARNING: OPENAI_API_KEY no está configurada")
-        print("⚠️  Configúrala con: export OPENAI_API_KEY='tu-api-key'")
+        log.warning("⚠️  WARNING: OPENAI_API_KEY no está configurada")
+        log.warning("⚠️  Configúrala con: export OPENAI_API_KEY='tu-api-key'")
 
-    print("🚀 InstaTrip Backend iniciando en http://localhost:5000")
-    print("💰 Usando Claude Haiku (económico) + Whisper para transcripción")
+    log.info("🚀 InstaTrip Backend iniciando en http://localhost:5000")
+    log.info("💰 Usando Claude Haiku (económico) + Whisper para transcripción")
     app.run(debug=True, port=5000)
@@ -0,0 +1,57 @@
+"""Etapas con concurrencia acotada para analizar lotes de videos.
+
+Cada etapa del análisis (descarga, transcripción, LLM, precios) admite un
+máximo de videos a la vez, compartido por todos los lotes: un video pasa a
+la etapa siguiente en cuanto termina la anterior y, como los análisis son
+corrutinas del event loop, espera su turno sin ocupar un hilo. Así se
+limitan por separado las descargas, las llamadas a Whisper y las llamadas
+al LLM, y las etapas de videos distintos se solapan.
+"""
+import asyncio
+import contextlib
+import threading
+
+
+class StageLimits:
+    """Máximo de videos a la vez por etapa, [(nombre, max_workers)]; se usa con `async with slot(nombre)`"""
+
+    def __init__(self, stages):
+        self._workers = {name: max_workers for name, max_workers in stages}
+        self._slots = {name: asyncio.Semaphore(max_workers) for name, max_workers in stages}
+        self._pending = {name: 0 for name, _ in stages}  # En cola o en curso; solo se modifica desde el loop
+
+    @contextlib.asynccontextmanager
+    async def slot(self, name):
+        self._pending[name] += 1
+        try:
+            async with self._slots[name]:
+                yield
+        finally:
+            self._pending[name] -= 1
+
+    def stats(self):
+        return {
+            name: {'workers': self._workers[name], 'pending': self._pending[name]}
+            for name in self._pending
+        }
+
+
+class SharedLookups:
+    """Un objeto por clave creado una sola vez (p. ej. búsquedas por destino)"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, *key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                item = self.factory(*key)
+                self._items[key] = item
+            return item
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
@@ -0,0 +1 @@
+"""Benchmarks y pruebas de carga del backend con servicios externos falsos (ver bench/run.py)"""
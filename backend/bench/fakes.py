@@ -0,0 +1,283 @@
+"""Servicios externos falsos para los benchmarks (un único servidor HTTP local).
+
+Rutas (bajo http://127.0.0.1:<puerto>):
+- /amadeus/...    token OAuth, flight-offers, hotels/by-city y hotel-offers
+                  con las respuestas grabadas de payloads/
+- /anthropic/...  /v1/messages en streaming (SSE) con el itinerario de
+                  payloads/itinerary.json troceado
+- /openai/...     /v1/audio/transcriptions con payloads/transcript.txt
+- /ip-api/json/<ip>  geolocalización remota
+- /@bench/video/<id>  un WAV generado en local que yt-dlp descarga con su
+                  extractor genérico; el backend acepta las rutas de este
+                  servidor como URLs de TikTok si su VideoURLResolver
+                  recibe video_host en test_hosts (bench/run.py)
+
+Cada servicio tiene un retardo configurable para simular su latencia real.
+"""
+import copy
+import io
+import json
+import math
+import struct
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+PAYLOADS_DIR = Path(__file__).resolve().parent / 'payloads'
+
+
+def load_payload(name):
+    with open(PAYLOADS_DIR / name, encoding='utf-8') as f:
+        return f.read() if name.endswith('.txt') else json.load(f)
+
+
+def make_wav(seconds, rate=8000, frequency=440):
+    """WAV mono de 16 bits con un tono de `seconds` segundos"""
+    frames = bytearray()
+    for n in range(int(seconds * rate)):
+        frames += struct.pack('<h', int(3000 * math.sin(2 * math.pi * frequency * n / rate)))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+class FakeUpstreams:
+    """Servidor con todos los servicios falsos; los retardos se leen en cada petición"""
+
+    def __init__(self, amadeus_delay=0.3, llm_ttft=0.5, llm_delay=3.0, whisper_delay=1.5,
+                 geo_delay=0.05, media_delay=0.2, media_seconds=20, hotels=12):
+        self.amadeus_delay = amadeus_delay
+        self.llm_ttft = llm_ttft
+        self.llm_delay = llm_delay
+        self.whisper_delay = whisper_delay
+        self.geo_delay = geo_delay
+        self.media_delay = media_delay
+        self.media_seconds = media_seconds
+
+        self.flight_offers = load_payload('flight_offers.json')
+        self.hotels_by_city = load_payload('hotels_by_city.json')
+        self.hotel_offers = load_payload('hotel_offers.json')
+        self.itinerary_text = json.dumps(load_payload('itinerary.json'), ensure_ascii=False)
+        self.transcript = load_payload('transcript.txt').strip()
+
+        # Lista de hoteles ampliada a `hotels` IDs repitiendo los grabados
+        templates = self.hotels_by_city['data']
+        self.hotel_list = []
+        for i in range(hotels):
+            hotel = copy.deepcopy(templates[i % len(templates)])
+            if i >= len(templates):
+                hotel['hotelId'] = f"{hotel['hotelId'][:5]}{i:03d}"
+            self.hotel_list.append(hotel)
+        self._offer_templates = {o['hotel']['hotelId']: o for o in self.hotel_offers['data']}
+
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._wav = make_wav(media_seconds)
+        self.server = None
+        self._thread = None
+
+    # --- Ciclo de vida ---
+
+    def start(self, host='127.0.0.1', port=0):
+        upstreams = self
+
+        class Handler(_Handler):
+            fakes = upstreams
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-upstreams', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def env(self):
+        """Variables de entorno que apuntan el backend (y los SDK de IA) a este servidor"""
+        base = self.base_url
+        return {
+            'AMADEUS_BASE_URL': f'{base}/amadeus',
+            'AMADEUS_API_KEY': 'bench',
+            'AMADEUS_API_SECRET': 'bench',
+            'ANTHROPIC_BASE_URL': f'{base}/anthropic',
+            'ANTHROPIC_API_KEY': 'bench',
+            'OPENAI_BASE_URL': f'{base}/openai/v1',
+            'OPENAI_API_KEY': 'bench',
+            'GEOIP_REMOTE_URL': f'{base}/ip-api/json/{{ip}}'
+        }
+
+    @property
+    def video_host(self):
+        """host:puerto de los videos falsos, para los test_hosts del VideoURLResolver"""
+        return self.base_url.split('://', 1)[1]
+
+    def video_url(self, video_id):
+        return f'{self.base_url}/@bench/video/{video_id}'
+
+    def count(self, route):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def media(self, video_id):
+        """El WAV base con las primeras muestras cambiadas: cada video tiene su propio
+        hash de audio y no comparte la caché de transcripciones con los demás"""
+        data = bytearray(self._wav)
+        data[44:52] = video_id.encode('ascii', 'ignore')[-8:].rjust(8, b'0')
+        return bytes(data)
+
+    def offers_for(self, hotel_ids, checkin, checkout):
+        """Ofertas grabadas reasignadas a los IDs pedidos y a las fechas de la búsqueda"""
+        templates = list(self._offer_templates.values())
+        data = []
+        for hotel_id in hotel_ids:
+            template = self._offer_templates.get(hotel_id)
+            if template is None:
+                index = int(''.join(ch for ch in hotel_id if ch.isdigit()) or 0)
+                template = templates[index % len(templates)]
+            offer = copy.deepcopy(template)
+            offer['hotel']['hotelId'] = hotel_id
+            for item in offer['offers']:
+                item['checkInDate'] = checkin
+                item['checkOutDate'] = checkout
+            data.append(offer)
+        return {'data': data}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fakes = None
+
+    def log_message(self, format, *args):
+        pass  # Sin una línea por petición en la salida del benchmark
+
+    # --- Utilidades ---
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body, content_type='application/json'):
+        if not isinstance(body, (bytes, bytearray)):
+            body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # --- Rutas ---
+
+    def do_HEAD(self):
+        self._route('HEAD')
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def _route(self, method):
+        url = urlparse(self.path)
+        path = url.path
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        fakes = self.fakes
+        body = self._read_body() if method == 'POST' else b''
+
+        if path == '/amadeus/v1/security/oauth2/token':
+            fakes.count('amadeus_token')
+            return self._send(200, {'type': 'amadeusOAuth2Token', 'access_token': 'bench-token', 'expires_in': 1799})
+
+        if path.startswith('/amadeus/'):
+            time.sleep(fakes.amadeus_delay)
+            if path == '/amadeus/v2/shopping/flight-offers':
+                fakes.count('amadeus_flights')
+                return self._send(200, fakes.flight_offers)
+            if path == '/amadeus/v1/reference-data/locations/hotels/by-city':
+                fakes.count('amadeus_hotels_by_city')
+                return self._send(200, {'data': fakes.hotel_list, 'meta': {'count': len(fakes.hotel_list)}})
+            if path == '/amadeus/v3/shopping/hotel-offers':
+                fakes.count('amadeus_hotel_offers')
+                hotel_ids = params.get('hotelIds', '').split(',')
+                return self._send(200, fakes.offers_for(hotel_ids, params.get('checkInDate'), params.get('checkOutDate')))
+            return self._send(404, {'errors': [{'status': 404, 'title': 'Not found'}]})
+
+        if path.startswith('/anthropic/') and path.endswith('/messages'):
+            fakes.count('anthropic_messages')
+            return self._stream_message(json.loads(body or b'{}'))
+
+        if path.startswith('/openai/') and path.endswith('/audio/transcriptions'):
+            fakes.count('openai_transcriptions')
+            time.sleep(fakes.whisper_delay)
+            return self._send(200, {'text': fakes.transcript})
+
+        if path.startswith('/ip-api/json/'):
+            fakes.count('ip_api')
+            time.sleep(fakes.geo_delay)
+            return self._send(200, {'status': 'success', 'country': 'Spain', 'countryCode': 'ES', 'city': 'Valencia'})
+
+        if path.startswith('/@bench/video/'):
+            fakes.count('media')
+            time.sleep(fakes.media_delay)
+            data = fakes.media(path.rsplit('/', 1)[-1])
+            if method == 'HEAD':
+                self.send_response(200)
+                self.send_header('Content-Type', 'audio/wav')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                return
+            return self._send(200, data, content_type='audio/wav')
+
+        self._send(404, {'error': 'not found'})
+
+    def _stream_message(self, request):
+        """Respuesta de Messages API en streaming: el itinerario grabado en trozos"""
+        fakes = self.fakes
+        text = fakes.itinerary_text
+        chunks = [text[i:i + 40] for i in range(0, len(text), 40)]
+        per_chunk = max(0.0, fakes.llm_delay - fakes.llm_ttft) / max(1, len(chunks))
+        prompt_chars = sum(len(block.get('text', '')) for block in request.get('system', []) or [])
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name, data):
+            self.wfile.write(f'event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+
+        time.sleep(fakes.llm_ttft)
+        event('message_start', {'type': 'message_start', 'message': {
+            'id': 'msg_bench', 'type': 'message', 'role': 'assistant', 'content': [],
+            'model': request.get('model', 'claude-3-5-haiku-20241022'), 'stop_reason': None, 'stop_sequence': None,
+            'usage': {'input_tokens': 400, 'output_tokens': 1,
+                      'cache_creation_input_tokens': 0, 'cache_read_input_tokens': prompt_chars // 4}
+        }})
+        event('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for chunk in chunks:
+            event('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                          'delta': {'type': 'text_delta', 'text': chunk}})
+            if per_chunk:
+                time.sleep(per_chunk)
+        event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        event('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                'usage': {'output_tokens': len(text) // 4}})
+        event('message_stop', {'type': 'message_stop'})
@@ -0,0 +1,320 @@
+"""Benchmark y prueba de carga de /api/analyze y /api/detect-location sin servicios reales.
+
+Levanta los servicios falsos de bench/fakes.py (Amadeus, Anthropic, OpenAI,
+ip-api y un fichero de audio local para yt-dlp), arranca el backend en este
+mismo proceso apuntando a ellos y lanza peticiones con la concurrencia
+indicada. Muestra p50/p95/p99 y peticiones por segundo de cada endpoint.
+
+Uso (desde backend/):
+    python -m bench.run                                  # ambos escenarios
+    python -m bench.run --scenario analyze -n 40 -c 8 --llm-delay 2
+    python -m bench.run --json resultados.json           # guardar resultados
+    python -m bench.run --baseline base.json             # falla si empeora
+
+Contra un backend ya arrancado (configurado con las variables que imprime
+--print-env, p. ej. en su .env): python -m bench.run --target http://localhost:5000
+Ese backend no acepta las URLs de video de los falsos (no son de TikTok), así
+que con --target solo tiene sentido el escenario location.
+"""
+import argparse
+import bisect
+import ipaddress
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fakes import FakeUpstreams
+
+CITIES = [('ES', 'Madrid'), ('ES', 'Barcelona'), ('ES', 'Valencia'), ('ES', 'Sevilla'),
+          ('FR', 'Paris'), ('IT', 'Rome'), ('GB', 'London'), ('DE', 'Berlin')]
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def build_geoip_db(path, ranges=2000, seed=7):
+    """CSV "inicio,fin,país,ciudad" con rangos /24 públicos aleatorios → [(inicio, fin)]"""
+    rng = random.Random(seed)
+    starts = set()
+    while len(starts) < ranges:
+        ip = ipaddress.IPv4Address(rng.randrange(1 << 24, 223 << 24) & 0xFFFFFF00)
+        if ip.is_global:
+            starts.add(int(ip))
+
+    blocks = []
+    with open(path, 'w', encoding='utf-8') as f:
+        for start in sorted(starts):
+            country, city = rng.choice(CITIES)
+            f.write(f'{ipaddress.IPv4Address(start)},{ipaddress.IPv4Address(start + 255)},{country},{city}\n')
+            blocks.append((start, start + 255))
+    return blocks
+
+
+def pick_ip(rng, blocks, local_ratio):
+    """IP pública: dentro de la base local con probabilidad local_ratio, si no, fuera de ella"""
+    if rng.random() < local_ratio:
+        start, end = rng.choice(blocks)
+        return str(ipaddress.IPv4Address(rng.randint(start, end)))
+    while True:
+        ip = ipaddress.IPv4Address(rng.randrange(1 << 24, 223 << 24))
+        idx = bisect.bisect_right(blocks, (int(ip), float('inf'))) - 1
+        if ip.is_global and not (idx >= 0 and blocks[idx][0] <= int(ip) <= blocks[idx][1]):
+            return str(ip)
+
+
+class LoadResult:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, status):
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status == 200:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def summary(self):
+        values = sorted(self.latencies)
+        total = len(values) + self.errors
+        return {
+            'requests': total,
+            'errors': self.errors,
+            'statuses': {str(k): v for k, v in sorted(self.statuses.items(), key=lambda kv: str(kv[0]))},
+            'rps': round(total / self.elapsed, 2) if self.elapsed else 0.0,
+            'mean': round(sum(values) / len(values), 4) if values else 0.0,
+            'p50': round(percentile(values, 50), 4),
+            'p95': round(percentile(values, 95), 4),
+            'p99': round(percentile(values, 99), 4),
+            'max': round(values[-1], 4) if values else 0.0
+        }
+
+
+def run_load(name, make_request, total, concurrency, warmup=0):
+    """Lanza total peticiones (más warmup sin medir) con `concurrency` hilos"""
+    result = LoadResult(name)
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def one(i, measure=True):
+        started = time.perf_counter()
+        try:
+            status = make_request(session(), i)
+        except requests.RequestException:
+            status = 'error'
+        if measure:
+            result.record(time.perf_counter() - started, status)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: one(-1 - i, measure=False), range(warmup)))
+        started = time.perf_counter()
+        list(pool.map(one, range(total)))
+        result.elapsed = time.perf_counter() - started
+    return result
+
+
+def start_backend(env, video_host):
+    """Importa app.py con el entorno del benchmark y lo sirve en un hilo → URL base.
+
+    video_host (host:puerto de los servicios falsos) se acepta como TikTok.
+    """
+    os.environ.update(env)
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if backend_dir not in sys.path:
+        sys.path.insert(0, backend_dir)
+
+    import app as backend
+    from video_urls import VideoURLResolver
+    from werkzeug.serving import make_server
+
+    resolver = backend.url_resolver
+    backend.url_resolver = VideoURLResolver(resolver.cache, resolver.session, ttl=resolver.ttl,
+                                            timeout=resolver.timeout, test_hosts=[video_host])
+
+    if os.environ.get('LOG_LEVEL') != 'INFO':
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)  # Sin una línea por petición
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-backend', daemon=True).start()
+
+    # Esperar a que la base de geolocalización termine de cargarse
+    if backend.geolocator._loader:
+        backend.geolocator._loader.join(timeout=30)
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def print_table(results):
+    header = f"{'endpoint':<20}{'req':>6}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, s in results.items():
+        print(f"{name:<20}{s['requests']:>6}{s['errors']:>6}{s['rps']:>9.2f}"
+              f"{s['p50']:>9.3f}{s['p95']:>9.3f}{s['p99']:>9.3f}{s['max']:>9.3f}")
+
+
+def check_regressions(results, baseline, tolerance):
+    """Lista de regresiones frente a un JSON anterior (p95/p99 más altos o menos req/s)"""
+    problems = []
+    for name, current in results.items():
+        base = baseline.get('results', baseline).get(name)
+        if not base:
+            continue
+        for key in ('p95', 'p99'):
+            if base.get(key) and current[key] > base[key] * (1 + tolerance):
+                problems.append(f"{name} {key}: {current[key]:.3f}s frente a {base[key]:.3f}s")
+        if base.get('rps') and current['rps'] < base['rps'] * (1 - tolerance):
+            problems.append(f"{name} req/s: {current['rps']:.2f} frente a {base['rps']:.2f}")
+        if current['errors'] > base.get('errors', 0):
+            problems.append(f"{name} errores: {current['errors']} frente a {base.get('errors', 0)}")
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark de InstaTrip con servicios externos falsos')
+    parser.add_argument('--scenario', choices=('analyze', 'location', 'all'), default='all')
+    parser.add_argument('-n', '--requests', type=int, default=20, help='peticiones a /api/analyze')
+    parser.add_argument('-c', '--concurrency', type=int, default=4)
+    parser.add_argument('--location-requests', type=int, default=2000)
+    parser.add_argument('--location-concurrency', type=int, default=16)
+    parser.add_argument('--local-ratio', type=float, default=0.9,
+                        help='fracción de IPs que están en la base local (el resto va al servicio remoto)')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--distinct-videos', type=int, default=0,
+                        help='videos distintos (0 = todos distintos; menos = se repiten y entran las cachés)')
+    parser.add_argument('--origin', default='MAD')
+    # Latencias simuladas (segundos)
+    parser.add_argument('--amadeus-delay', type=float, default=0.3)
+    parser.add_argument('--llm-ttft', type=float, default=0.5)
+    parser.add_argument('--llm-delay', type=float, default=3.0)
+    parser.add_argument('--whisper-delay', type=float, default=1.5)
+    parser.add_argument('--geo-delay', type=float, default=0.05)
+    parser.add_argument('--media-delay', type=float, default=0.2)
+    parser.add_argument('--media-seconds', type=float, default=20)
+    parser.add_argument('--hotels', type=int, default=60, help='hoteles en la lista por ciudad')
+    # Destino
+    parser.add_argument('--target', help='URL de un backend ya arrancado (si no, se arranca en este proceso)')
+    parser.add_argument('--fakes-port', type=int, default=0, help='puerto de los servicios falsos (0 = libre)')
+    parser.add_argument('--print-env', action='store_true', help='imprime las variables para apuntar un backend a los falsos')
+    parser.add_argument('--metadata-fast-path', action='store_true', help='no desactivar la vía rápida por metadatos')
+    parser.add_argument('--verbose', action='store_true', help='logs del backend a nivel INFO')
+    # Resultados
+    parser.add_argument('--json', help='guarda los resultados en este fichero')
+    parser.add_argument('--baseline', help='JSON de una ejecución anterior para detectar regresiones')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='empeoramiento permitido frente a --baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    fakes = FakeUpstreams(
+        amadeus_delay=args.amadeus_delay, llm_ttft=args.llm_ttft, llm_delay=args.llm_delay,
+        whisper_delay=args.whisper_delay, geo_delay=args.geo_delay, media_delay=args.media_delay,
+        media_seconds=args.media_seconds, hotels=args.hotels
+    ).start(port=args.fakes_port)
+    print(f"🧪 Servicios falsos en {fakes.base_url}")
+
+    if args.print_env:
+        for key, value in fakes.env().items():
+            print(f"{key}={value}")
+
+    workdir = tempfile.mkdtemp(prefix='instatrip-bench-')
+    geoip_path = os.path.join(workdir, 'ip-city.csv')
+    blocks = build_geoip_db(geoip_path)
+
+    if args.target:
+        base_url = args.target.rstrip('/')
+        if args.print_env:
+            print(f"GEOIP_DB_PATH={geoip_path}")
+            input("Arranca el backend con estas variables y pulsa Enter...")
+    else:
+        env = dict(fakes.env())
+        env.update({
+            'CACHE_DIR': os.path.join(workdir, 'cache'),
+            'GEOIP_DB_PATH': geoip_path,
+            'METADATA_FAST_PATH': '1' if args.metadata_fast_path else '0',
+            'WHISPER_CHUNKED': os.environ.get('WHISPER_CHUNKED', '0'),
+            'LOG_LEVEL': 'INFO' if args.verbose else os.environ.get('BENCH_LOG_LEVEL', 'WARNING')
+        })
+        base_url = start_backend(env, fakes.video_host)
+        print(f"🚀 Backend en {base_url} (caché en {env['CACHE_DIR']})")
+
+    results = {}
+    rng = random.Random(11)
+
+    if args.scenario in ('analyze', 'all'):
+        def analyze(session, i):
+            video_id = i if not args.distinct_videos else i % args.distinct_videos
+            response = session.post(f'{base_url}/api/analyze', timeout=300, json={
+                'video_url': fakes.video_url(f'{video_id + 7000000000}'),
+                'origin_iata': args.origin
+            })
+            return response.status_code
+
+        print(f"▶️  /api/analyze: {args.requests} peticiones, concurrencia {args.concurrency}")
+        results['analyze'] = run_load('analyze', analyze, args.requests, args.concurrency, args.warmup).summary()
+
+    if args.scenario in ('location', 'all'):
+        def locate(session, i):
+            ip = pick_ip(rng, blocks, args.local_ratio)
+            response = session.get(f'{base_url}/api/detect-location', timeout=30,
+                                   headers={'X-Forwarded-For': ip})
+            return response.status_code
+
+        print(f"▶️  /api/detect-location: {args.location_requests} peticiones, concurrencia {args.location_concurrency}")
+        results['detect-location'] = run_load('detect-location', locate, args.location_requests,
+                                              args.location_concurrency, args.warmup).summary()
+
+    print()
+    print_table(results)
+    print(f"\nPeticiones a los servicios falsos: {json.dumps(fakes.requests, sort_keys=True)}")
+
+    output = {
+        'results': results,
+        'upstream_requests': fakes.requests,
+        'config': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')},
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2, ensure_ascii=False)
+        print(f"💾 Resultados guardados en {args.json}")
+
+    fakes.stop()
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = check_regressions(results, json.load(f), args.tolerance)
+        if problems:
+            print(f"\n❌ Regresiones (tolerancia {args.tolerance:.0%}):")
+            for problem in problems:
+                print(f"   - {problem}")
+            return 1
+        print(f"\n✅ Sin regresiones frente a {args.baseline} (tolerancia {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
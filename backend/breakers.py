@@ -0,0 +1,172 @@
+"""Circuit breakers por servicio externo (Amadeus, geolocalización, IA).
+
+Cuando un upstream se degrada, cada petición esperaba su timeout completo
+antes de usar el plan B. Un CircuitBreaker cuenta los resultados recientes
+de las llamadas y, si la tasa de fallos de la ventana supera el umbral, se
+abre: durante open_seconds las llamadas fallan al instante con
+CircuitOpenError y el llamador pasa directamente a su alternativa (links a
+buscadores, base de geolocalización local, análisis sin transcripción...).
+
+Pasado ese tiempo el circuito queda semiabierto y deja pasar una única
+llamada de prueba: si va bien se cierra y si falla vuelve a abrirse. Una
+prueba que nunca informa (p. ej. cancelada) se da por perdida tras
+probe_timeout segundos y se permite otra.
+
+Uso: allow() antes de la llamada y record(ok) con el resultado. Las
+llamadas que no dicen nada del upstream (canceladas, o cortadas por el
+plazo de la propia petición) simplemente no se registran.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger('instatrip.breakers')
+
+CIRCUIT_FAILURE_RATE = float(os.environ.get("CIRCUIT_FAILURE_RATE", 0.5))
+CIRCUIT_MIN_CALLS = int(os.environ.get("CIRCUIT_MIN_CALLS", 5))
+CIRCUIT_WINDOW = float(os.environ.get("CIRCUIT_WINDOW", 60))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", 30))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """El circuito del upstream está abierto: no se intenta la llamada"""
+
+
+def failed_status(status_code):
+    """True si el código de estado indica un upstream con problemas (5xx o 429)"""
+    return status_code >= 500 or status_code == 429
+
+
+class CircuitBreaker:
+    """Circuito de un upstream con ventana deslizante de resultados y sondeo semiabierto"""
+
+    def __init__(self, name, failure_rate=CIRCUIT_FAILURE_RATE, min_calls=CIRCUIT_MIN_CALLS,
+                 window=CIRCUIT_WINDOW, open_seconds=CIRCUIT_OPEN_SECONDS, probe_timeout=None):
+        self.name = name
+        self.failure_rate = failure_rate  # Proporción de fallos de la ventana que abre el circuito
+        self.min_calls = min_calls        # Llamadas mínimas en la ventana para evaluar la tasa
+        self.window = window              # Segundos de resultados que se tienen en cuenta
+        self.open_seconds = open_seconds  # Tiempo abierto antes de probar de nuevo
+        self.probe_timeout = probe_timeout if probe_timeout is not None else open_seconds
+        self.state = CLOSED
+        self._results = deque()  # (instante, ok)
+        self._opened_at = 0
+        self._probe_until = 0
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        """True si se puede llamar al upstream ahora"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if now - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                log.info("🔌 Circuito de %s semiabierto: se prueba una llamada", self.name)
+            # Semiabierto: una sola llamada de prueba en curso
+            if now < self._probe_until:
+                self.rejected += 1
+                return False
+            self._probe_until = now + self.probe_timeout
+            return True
+
+    def is_open(self):
+        """True si el circuito rechaza las llamadas ahora mismo.
+
+        Para comprobarlo antes de hacer trabajo previo (cola del limitador,
+        descarga del video...): no consume la prueba del estado semiabierto,
+        pero sí cuenta como rechazo, porque el llamador ya no intentará la llamada.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return True
+            return False
+
+    def record(self, ok):
+        """Resultado de una llamada permitida por allow()"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                if ok:
+                    self._close()
+                else:
+                    self._open(now, 'falló la llamada de prueba')
+                return
+            if self.state == OPEN:
+                return  # Llamada lanzada antes de abrirse; ya no cuenta
+
+            self._results.append((now, ok))
+            self._trim(now)
+            calls = len(self._results)
+            failures = sum(1 for _, result in self._results if not result)
+            if not ok and calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open(now, f'{failures}/{calls} fallos en {self.window:.0f}s')
+
+    def _open(self, now, reason):
+        # Se llama con self._lock adquirido
+        self.state = OPEN
+        self._opened_at = now
+        self._probe_until = 0
+        self._results.clear()
+        self.opened += 1
+        log.warning("🔌 Circuito de %s abierto durante %.0fs (%s)", self.name, self.open_seconds, reason)
+
+    def _close(self):
+        # Se llama con self._lock adquirido
+        self.state = CLOSED
+        self._probe_until = 0
+        self._results.clear()
+        log.info("🔌 Circuito de %s cerrado: el servicio responde de nuevo", self.name)
+
+    def _trim(self, now):
+        while self._results and now - self._results[0][0] > self.window:
+            self._results.popleft()
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            calls = len(self._results)
+            failures = sum(1 for _, ok in self._results if not ok)
+            data = {
+                'state': self.state,
+                'calls': calls,
+                'failure_rate': round(failures / calls, 3) if calls else 0.0,
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+            if self.state == OPEN:
+                data['retry_in'] = round(max(0, self.open_seconds - (now - self._opened_at)), 1)
+            return data
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """CircuitBreaker compartido del upstream name (se crea la primera vez)"""
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            _breakers[name] = breaker
+        return breaker
+
+
+def breakers_stats():
+    with _lock:
+        breakers = list(_breakers.items())
+    return {name: breaker.stats() for name, breaker in breakers}
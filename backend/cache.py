@@ -0,0 +1,326 @@
+"""Caché en dos niveles: LRU en memoria delante de un almacén SQLite en disco.
+
+El nivel 1 (LRU) vive en cada proceso y responde en microsegundos.
+El nivel 2 (SQLite) es compartido por todos los workers del servidor,
+así que un resultado calculado por un worker sirve a los demás.
+Los valores se guardan serializados en JSON para que cada lectura
+devuelva una copia independiente que el llamador puede modificar.
+
+Desde el event loop se usan las variantes *_async: el nivel 1 se consulta
+en el propio loop y el SQLite va al pool de tareas breves del loop (el
+executor por defecto; las descargas y el audio tienen otro), porque una
+lectura o escritura en disco (hasta 5s esperando el bloqueo de otro
+worker) pararía todos los análisis en curso.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger('instatrip.cache')
+
+CACHE_DIR = os.environ.get("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
+class LRUCache:
+    """Caché LRU thread-safe con caducidad por entrada"""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and time.time() >= expires_at:
+                del self._data[key]
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0.0
+            }
+
+
+class SQLiteStore:
+    """Almacén clave-valor con TTL sobre SQLite, compartido entre procesos"""
+
+    def __init__(self, path, table='kv', max_entries=None):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.commit()
+
+    def _conn(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Devuelve (valor, expires_at) o None si no existe o ha caducado"""
+        try:
+            row = self._conn().execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.warning("⚠️  Error leyendo caché SQLite: %s", e)
+            return None
+
+        if row is None:
+            return None
+
+        value, expires_at = row
+        if expires_at is not None and time.time() >= expires_at:
+            self.delete(key)
+            return None
+
+        return value, expires_at
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        try:
+            conn = self._conn()
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("⚠️  Error escribiendo caché SQLite: %s", e)
+
+    def delete(self, key):
+        try:
+            conn = self._conn()
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("⚠️  Error borrando caché SQLite: %s", e)
+
+    def evict_overflow(self):
+        """Borra las filas más antiguas si se supera max_entries"""
+        if not self.max_entries:
+            return
+        try:
+            conn = self._conn()
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE rowid IN ("
+                f"SELECT rowid FROM {self.table} ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("⚠️  Error recortando caché SQLite: %s", e)
+
+    def purge_expired(self):
+        try:
+            conn = self._conn()
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?",
+                (time.time(),)
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("⚠️  Error purgando caché SQLite: %s", e)
+
+
+class TwoTierCache:
+    """LRU en memoria (nivel 1) delante de un SQLiteStore (nivel 2)"""
+
+    def __init__(self, path, table='kv', maxsize=512, max_disk_entries=None):
+        self.memory = LRUCache(maxsize)
+        self.disk = SQLiteStore(path, table, max_entries=max_disk_entries)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    def get(self, key):
+        raw = self.memory.get(key)
+        if raw is None:
+            raw = self._load(key)
+        return self._decode(raw)
+
+    async def get_async(self, key):
+        """get() desde el event loop: el nivel 2 se lee en el pool de hilos del loop"""
+        raw = self.memory.get(key)
+        if raw is None:
+            raw = await asyncio.get_running_loop().run_in_executor(None, self._load, key)
+        return self._decode(raw)
+
+    def _load(self, key):
+        stored = self.disk.get(key)
+        if stored is None:
+            return None
+        raw, expires_at = stored
+        # Promocionar al nivel 1 con el TTL que le quede
+        ttl = expires_at - time.time() if expires_at is not None else None
+        self.memory.set(key, raw, ttl)
+        self.disk_hits += 1
+        return raw
+
+    def _decode(self, raw):
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        raw = json.dumps(value, ensure_ascii=False)
+        self.memory.set(key, raw, ttl)
+        self._store(key, raw, ttl)
+
+    async def set_async(self, key, value, ttl=None):
+        """set() desde el event loop: el nivel 2 se escribe en el pool de hilos del loop"""
+        raw = json.dumps(value, ensure_ascii=False)
+        self.memory.set(key, raw, ttl)
+        await asyncio.get_running_loop().run_in_executor(None, self._store, key, raw, ttl)
+
+    def _store(self, key, raw, ttl):
+        self.disk.set(key, raw, ttl)
+
+        # Limpiar filas caducadas y sobrantes de vez en cuando
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.disk.purge_expired()
+            self.disk.evict_overflow()
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def stats(self):
+        memory = self.memory.stats()
+        total = self.hits + self.misses
+        return {
+            'size': memory['size'],
+            'maxsize': memory['maxsize'],
+            'hits': self.hits,
+            'memory_hits': memory['hits'],
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0
+        }
+
+
+class ResultCache:
+    """Caché de resultados de /api/analyze.
+
+    El itinerario depende solo del video, así que se guarda por identidad del
+    video y se reutiliza para cualquier origen. Los booking_links dependen
+    también del aeropuerto de origen y de precios que cambian, así que se
+    guardan aparte con un TTL mucho más corto.
+    """
+
+    def __init__(self, path, itinerary_ttl, prices_ttl, maxsize=512):
+        self.itinerary_ttl = itinerary_ttl
+        self.prices_ttl = prices_ttl
+        self.store = TwoTierCache(path, table='results', maxsize=maxsize)
+
+    def get_itinerary(self, video_key):
+        return self.store.get(f"itinerary:{video_key}")
+
+    async def get_itinerary_async(self, video_key):
+        return await self.store.get_async(f"itinerary:{video_key}")
+
+    async def set_itinerary_async(self, video_key, itinerary):
+        await self.store.set_async(f"itinerary:{video_key}", itinerary, self.itinerary_ttl)
+
+    async def get_booking_links_async(self, video_key, origin_iata):
+        return await self.store.get_async(f"booking_links:{video_key}:{origin_iata}")
+
+    async def set_booking_links_async(self, video_key, origin_iata, booking_links):
+        await self.store.set_async(f"booking_links:{video_key}:{origin_iata}", booking_links, self.prices_ttl)
+
+    def stats(self):
+        return self.store.stats()
+
+
+class TranscriptCache:
+    """Caché de transcripciones indexada por el hash del audio descargado.
+
+    Dos URLs distintas del mismo video (o un repost con el mismo audio)
+    producen los mismos bytes y por tanto reutilizan la transcripción
+    sin volver a pagar Whisper.
+    """
+
+    def __init__(self, path, ttl=None, maxsize=256, max_disk_entries=5000):
+        self.ttl = ttl
+        self.store = TwoTierCache(path, table='transcripts', maxsize=maxsize, max_disk_entries=max_disk_entries)
+
+    async def get_async(self, audio_hash):
+        return await self.store.get_async(audio_hash)
+
+    async def set_async(self, audio_hash, transcript):
+        await self.store.set_async(audio_hash, transcript, self.ttl)
+
+    def stats(self):
+        return self.store.stats()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hash SHA-256 del contenido de un fichero, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def video_cache_key(video_info):
+    """Clave canónica de un video: plataforma + id (None si no se pudo extraer el id)"""
+    if not video_info.get('platform') or not video_info.get('video_id'):
+        return None
+    return f"{video_info['platform']}:{video_info['video_id']}"
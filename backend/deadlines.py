@@ -0,0 +1,66 @@
+"""Presupuesto de tiempo de extremo a extremo para cada análisis.
+
+Cada petición recibe un plazo (Deadline) al llegar y se lo pasa a todas las
+etapas: yt-dlp, Whisper, Claude y Amadeus usan como timeout lo que queda de
+ese plazo (como mucho su timeout habitual) en vez de los valores por defecto
+de cada cliente. Así un servicio lento no alarga la petición sin límite: al
+agotarse el plazo cada etapa corta y el pipeline decide si puede devolver un
+resultado parcial (p. ej. el itinerario sin precios) o debe fallar.
+
+Las funciones timeout_for() y budget_for() aceptan deadline=None para que
+las llamadas que no pertenecen a una petición concreta (p. ej. las búsquedas
+de Amadeus compartidas por los videos de un lote) usen sus timeouts fijos.
+"""
+import time
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el plazo de la petición antes de empezar una operación"""
+
+
+class Deadline:
+    """Instante límite de una petición, medido con el reloj monótono"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Segundos que quedan (0 si ya venció)"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def elapsed(self):
+        return self.seconds - (self.expires_at - time.monotonic())
+
+    def timeout(self, cap=None):
+        """Timeout para una operación: lo que queda del plazo, como mucho cap.
+
+        Lanza DeadlineExceeded si ya no queda tiempo, para no empezar una
+        llamada que no puede terminar a tiempo.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Plazo de {self.seconds}s agotado")
+        return remaining if cap is None else min(cap, remaining)
+
+    def within(self, seconds):
+        """Un plazo que vence dentro de seconds segundos o con este, lo que llegue antes"""
+        sub = Deadline(seconds)
+        sub.expires_at = min(sub.expires_at, self.expires_at)
+        return sub
+
+
+def timeout_for(deadline, cap=None):
+    """Timeout de una llamada: cap sin plazo, o lo que quede de él (DeadlineExceeded si venció)"""
+    return cap if deadline is None else deadline.timeout(cap)
+
+
+def budget_for(deadline, cap=None):
+    """Tiempo de espera de una etapa: como timeout_for, pero 0 en vez de excepción si venció"""
+    if deadline is None:
+        return cap
+    remaining = deadline.remaining()
+    return remaining if cap is None else min(cap, remaining)
@@ -0,0 +1,221 @@
+"""Geolocalización de IPs sin llamadas externas.
+
+Carga una base de rangos de IP (CSV de DB-IP Lite, IP2Location Lite o el
+formato simple "ip_inicio,ip_fin,país,ciudad", opcionalmente .gz) en una
+estructura compacta: los inicios y finales de cada rango se guardan como
+registros big-endian de ancho fijo (4 bytes IPv4, 16 bytes IPv6) en un
+bytearray ordenado, y la búsqueda es binaria. Los ficheros publicados ya
+vienen ordenados por ip_inicio; si no, la tabla se ordena al terminar la carga. Las ubicaciones repetidas se
+deduplican en una tabla aparte. Una LRU guarda las IPs consultadas hace poco.
+"""
+import csv
+import gzip
+import ipaddress
+import logging
+import os
+import threading
+from array import array
+
+from cache import LRUCache
+
+log = logging.getLogger('instatrip.geoip')
+
+
+class _RangeTable:
+    """Rangos ordenados de una familia de IPs (IPv4 o IPv6)"""
+
+    def __init__(self, width):
+        self.width = width
+        self.starts = bytearray()
+        self.ends = bytearray()
+        self.locations = array('I')
+        self.ordered = True  # False si algún rango llegó antes que uno anterior
+
+    def __len__(self):
+        return len(self.locations)
+
+    def append(self, start, end, location):
+        width = self.width
+        start_bytes = start.to_bytes(width, 'big')
+        end_bytes = end.to_bytes(width, 'big')
+
+        if self.locations and start_bytes <= self.starts[-width:]:
+            self.ordered = False
+
+        # Fusionar con el rango anterior si es contiguo y de la misma ubicación
+        if self.ordered and self.locations and self.locations[-1] == location:
+            prev_end = int.from_bytes(self.ends[-width:], 'big')
+            if prev_end + 1 == start:
+                self.ends[-width:] = end_bytes
+                return
+
+        self.starts += start_bytes
+        self.ends += end_bytes
+        self.locations.append(location)
+
+    def sort(self):
+        """Ordena los rangos por inicio si llegaron desordenados (la búsqueda binaria lo necesita)"""
+        if self.ordered:
+            return
+        width = self.width
+        ranges = sorted(
+            (bytes(self.starts[i * width:(i + 1) * width]), bytes(self.ends[i * width:(i + 1) * width]), location)
+            for i, location in enumerate(self.locations)
+        )
+        self.starts = bytearray()
+        self.ends = bytearray()
+        self.locations = array('I')
+        self.ordered = True
+        for start, end, location in ranges:
+            self.append(int.from_bytes(start, 'big'), int.from_bytes(end, 'big'), location)
+
+    def find(self, ip):
+        """Índice de ubicación del rango que contiene ip, o None"""
+        width = self.width
+        key = ip.to_bytes(width, 'big')
+        starts = self.starts
+
+        # Último rango cuyo inicio es <= ip
+        lo, hi = 0, len(self.locations)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if starts[mid * width:(mid + 1) * width] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        idx = lo - 1
+
+        if idx < 0 or self.ends[idx * width:(idx + 1) * width] < key:
+            return None
+        return self.locations[idx]
+
+
+class IPRangeDatabase:
+    """Base de rangos de IP → (país, ciudad) con búsqueda binaria"""
+
+    def __init__(self):
+        self.v4 = _RangeTable(4)
+        self.v6 = _RangeTable(16)
+        self.location_table = []
+
+    def __len__(self):
+        return len(self.v4) + len(self.v6)
+
+    @staticmethod
+    def _parse_ip(value):
+        value = value.strip()
+        if value.isdigit():
+            number = int(value)
+            return number, number <= 0xFFFFFFFF
+        ip = ipaddress.ip_address(value)
+        return int(ip), ip.version == 4
+
+    @classmethod
+    def load(cls, path):
+        """Carga un CSV (o .csv.gz) de rangos; se ordena por ip_inicio si hace falta"""
+        db = cls()
+        location_ids = {}
+        opener = gzip.open if path.endswith('.gz') else open
+
+        with opener(path, 'rt', encoding='utf-8', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 4:
+                    continue
+                try:
+                    start, is_v4 = cls._parse_ip(row[0])
+                    end, _ = cls._parse_ip(row[1])
+                except ValueError:
+                    continue  # Cabecera u otra línea no válida
+
+                # DB-IP / IP2Location: país en la columna 3 y ciudad en la 5
+                if len(row) >= 6:
+                    location = (row[3], row[5])
+                else:
+                    location = (row[2], row[3])
+
+                location_id = location_ids.get(location)
+                if location_id is None:
+                    location_id = len(db.location_table)
+                    location_ids[location] = location_id
+                    db.location_table.append(location)
+
+                (db.v4 if is_v4 else db.v6).append(start, end, location_id)
+
+        for table in (db.v4, db.v6):
+            if not table.ordered:
+                log.warning("⚠️  %s no está ordenado por ip_inicio: se ordena en memoria", path)
+                table.sort()
+        return db
+
+    def lookup(self, ip_str):
+        """Devuelve (país, ciudad) de una IP o None si no está en la base"""
+        try:
+            ip = ipaddress.ip_address(ip_str.strip())
+        except ValueError:
+            return None
+
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        table = self.v4 if ip.version == 4 else self.v6
+
+        location_id = table.find(int(ip))
+        if location_id is None:
+            return None
+        return self.location_table[location_id]
+
+
+class GeoLocator:
+    """Base local de IPs (cargada en segundo plano) + LRU de IPs recientes.
+
+    Mientras la base se carga, o si no existe, las consultas devuelven None
+    y el llamador decide si usar un servicio remoto.
+    """
+
+    def __init__(self, db_path, cache_size=4096):
+        self.db_path = db_path
+        self.db = None
+        self.cache = LRUCache(cache_size)
+        self._loader = None
+
+        if db_path and os.path.exists(db_path):
+            self._loader = threading.Thread(target=self._load, name='geoip-loader', daemon=True)
+            self._loader.start()
+        else:
+            log.info("ℹ️  Base de geolocalización local no encontrada (%s), se usará el servicio remoto", db_path)
+
+    def _load(self):
+        try:
+            db = IPRangeDatabase.load(self.db_path)
+            self.db = db
+            log.info("🌍 Base de geolocalización cargada: %s rangos, %s ubicaciones", len(db), len(db.location_table))
+        except Exception as e:
+            log.warning("⚠️  No se pudo cargar la base de geolocalización: %s", e)
+
+    @property
+    def ready(self):
+        return self.db is not None
+
+    def lookup(self, ip_str):
+        """(país, ciudad) desde la LRU o la base local; None si no se conoce"""
+        cached = self.cache.get(ip_str)
+        if cached is not None:
+            return cached
+
+        if self.db is None:
+            return None
+
+        location = self.db.lookup(ip_str)
+        if location is not None:
+            self.cache.set(ip_str, location)
+        return location
+
+    def remember(self, ip_str, location, ttl=24 * 3600):
+        """Guarda en la LRU una ubicación obtenida por otra vía (servicio remoto)"""
+        self.cache.set(ip_str, location, ttl)
+
+    def stats(self):
+        return {
+            'loaded': self.ready,
+            'ranges': len(self.db) if self.db else 0,
+            'cache': self.cache.stats()
+        }
@@ -0,0 +1,98 @@
+"""Selección de ofertas de hotel de Amadeus.
+
+Las respuestas de hotel-offers llegan por trozos de IDs; cada trozo se
+procesa en cuanto llega. De cada hotel se toma la oferta más barata con un
+mínimo en una pasada y se mantiene un heap acotado con los k hoteles más
+baratos, así que da igual si se consultan 10 hoteles o cientos.
+"""
+import heapq
+import itertools
+from datetime import datetime
+
+
+def nights_between(checkin, checkout):
+    """Noches entre dos fechas 'YYYY-MM-DD' (se calcula una vez por búsqueda)"""
+    checkin_date = datetime.strptime(checkin, '%Y-%m-%d')
+    checkout_date = datetime.strptime(checkout, '%Y-%m-%d')
+    return (checkout_date - checkin_date).days
+
+
+def chunked(items, size):
+    """Trozos consecutivos de como mucho size elementos"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def offer_price(offer):
+    try:
+        return float(offer['price']['total'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def cheapest_offer(offers):
+    """(precio, oferta) más barata de un hotel, o None si ninguna tiene precio"""
+    best = None
+    for offer in offers:
+        price = offer_price(offer)
+        if price is not None and (best is None or price < best[0]):
+            best = (price, offer)
+    return best
+
+
+class HotelSelector:
+    """Los k hoteles más baratos por noche con rating >= min_rating"""
+
+    def __init__(self, k, nights, min_rating=4):
+        self.k = k
+        self.nights = nights
+        self.min_rating = min_rating
+        self.seen = 0
+        self._heap = []  # max-heap por precio (negado): la raíz es el peor de los k
+        self._seq = itertools.count()
+
+    def add(self, hotels_data):
+        """Procesa la lista 'data' de una respuesta de hotel-offers"""
+        for hotel in hotels_data:
+            if not hotel.get('offers'):
+                continue
+            self.seen += 1
+
+            hotel_info = hotel.get('hotel', {})
+            rating = hotel_info.get('rating', 0)
+
+            # FILTRAR: Solo hoteles con rating >= 4 estrellas (equivalente a 8/10)
+            try:
+                rating = int(rating) if rating else 0
+            except (TypeError, ValueError):
+                rating = 0
+            if rating and rating < self.min_rating:
+                continue
+
+            best = cheapest_offer(hotel['offers'])
+            if best is None:
+                continue
+            price_total, offer = best
+            price_per_night = price_total / self.nights if self.nights > 0 else price_total
+
+            entry = (-price_per_night, -next(self._seq), hotel_info, rating, price_total, offer)
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, entry)
+            elif price_per_night < -self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def top(self):
+        """Hoteles elegidos, del más barato al más caro, en el formato de la API"""
+        results = []
+        for neg_price, _, hotel_info, rating, price_total, offer in sorted(self._heap, reverse=True):
+            results.append({
+                'name': hotel_info.get('name', 'Hotel'),
+                'price_per_night': round(-neg_price, 2),
+                'price_total': round(price_total, 2),
+                'currency': offer['price'].get('currency', 'EUR'),
+                'rating': rating,
+                'nights': self.nights,
+                'city': hotel_info.get('address', {}).get('cityName', ''),
+                'description': offer.get('room', {}).get('description', {}).get('text', 'Habitación estándar')
+            })
+        return results
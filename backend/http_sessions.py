@@ -0,0 +1,263 @@
+"""Sesiones HTTP compartidas por upstream (Amadeus, geolocalización).
+
+Cada upstream tiene su propia requests.Session con un pool de conexiones
+keep-alive, de modo que las peticiones reutilizan la conexión TCP+TLS en
+lugar de negociar una nueva cada vez. Los 429 y 5xx de las peticiones
+idempotentes (GET, HEAD) se reintentan con backoff exponencial y jitter;
+un POST (p. ej. el token OAuth) nunca se repite. Las estadísticas de
+reutilización permiten ver cuántos handshakes se ahorran.
+
+El pipeline asíncrono usa AsyncUpstreamClient: un httpx.AsyncClient por
+upstream con el mismo pool keep-alive y la misma política de reintentos.
+
+Con deadline (un deadlines.Deadline) los reintentos no pueden pasarse del
+plazo: el timeout de cada intento se recalcula con lo que queda y no se
+reintenta si la espera no cabe en él.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 4))  # Hosts distintos con pool propio
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 2))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.3))
+HTTP_ASYNC_POOL_SIZE = int(os.environ.get("HTTP_ASYNC_POOL_SIZE", 100))
+MAX_BACKOFF = 5.0
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_METHODS = frozenset(['GET', 'HEAD'])  # Solo métodos idempotentes
+
+
+class JitteredRetry(Retry):
+    """Retry de urllib3 con backoff exponencial y 'full jitter'.
+
+    Evita que muchas peticiones que fallan a la vez reintenten todas en el
+    mismo instante contra un upstream que ya está saturado.
+    """
+
+    def get_backoff_time(self):
+        return jittered_backoff(len(self.history), self.backoff_factor)
+
+
+def jittered_backoff(attempts, backoff_factor):
+    """Espera antes del reintento número `attempts` (0 = primer intento, sin espera)"""
+    if attempts == 0:
+        return 0
+    backoff = min(MAX_BACKOFF, backoff_factor * (2 ** (attempts - 1)))
+    return random.uniform(0, backoff)
+
+
+def retry_wait(attempts, backoff_factor, deadline):
+    """Espera antes del reintento `attempts`, o None si con deadline ya no cabe otro intento"""
+    wait = jittered_backoff(attempts, backoff_factor)
+    if deadline is not None and deadline.remaining() <= wait:
+        return None
+    return wait
+
+
+class TrackingAdapter(HTTPAdapter):
+    """HTTPAdapter que recuerda los pools de conexiones que ha usado (para stats())"""
+
+    def __init__(self, *args, **kwargs):
+        self.used_pools = weakref.WeakSet()
+        super().__init__(*args, **kwargs)
+
+    def get_connection(self, *args, **kwargs):
+        pool = super().get_connection(*args, **kwargs)
+        self.used_pools.add(pool)
+        return pool
+
+    def get_connection_with_tls_context(self, *args, **kwargs):
+        # requests >= 2.32 usa este método en lugar de get_connection
+        pool = super().get_connection_with_tls_context(*args, **kwargs)
+        self.used_pools.add(pool)
+        return pool
+
+
+class UpstreamSession:
+    """requests.Session con pool keep-alive, reintentos y estadísticas de conexiones"""
+
+    def __init__(self, name, pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_BACKOFF,
+                 pool_connections=HTTP_POOL_CONNECTIONS):
+        self.name = name
+        self.session = requests.Session()
+
+        retry = JitteredRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,  # Un timeout de lectura no se reintenta: ya consumió el presupuesto
+            status=max_retries,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=RETRY_METHODS,
+            backoff_factor=backoff,
+            raise_on_status=False,  # Devolver la última respuesta y que el llamador decida
+        )
+        self.adapter = TrackingAdapter(pool_connections=pool_connections, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        # Peticiones con plazo: un intento por llamada (los reintentos van en request()),
+        # sobre los mismos pools de conexiones que la sesión normal
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.single_adapter = TrackingAdapter(max_retries=0)
+        self.single_adapter.poolmanager = self.adapter.poolmanager
+        self.single_session = requests.Session()
+        self.single_session.mount('https://', self.single_adapter)
+        self.single_session.mount('http://', self.single_adapter)
+
+    def request(self, method, url, deadline=None, **kwargs):
+        """Petición con los reintentos de la sesión; con deadline, recortados a su plazo.
+
+        Con deadline el timeout de cada intento es lo que quede del plazo
+        (como mucho kwargs['timeout']) y se reintenta solo si la espera cabe.
+        Si el plazo ya venció antes de empezar lanza DeadlineExceeded.
+        """
+        if deadline is None:
+            return self.session.request(method, url, **kwargs)
+
+        cap = kwargs.pop('timeout', None)
+        attempts = 0
+        while True:
+            kwargs['timeout'] = deadline.timeout(cap)
+            retryable = method in RETRY_METHODS and attempts < self.max_retries
+            try:
+                response = self.single_session.request(method, url, **kwargs)
+            except requests.ConnectionError:
+                wait = retry_wait(attempts + 1, self.backoff, deadline) if retryable else None
+                if wait is None:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or not retryable:
+                    return response
+                wait = retry_wait(attempts + 1, self.backoff, deadline)
+                if wait is None:
+                    return response  # La última respuesta, y que el llamador decida
+                response.close()
+            attempts += 1
+            time.sleep(wait)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def stats(self):
+        """Peticiones enviadas frente a conexiones abiertas (cada una es un handshake)"""
+        requests_sent = 0
+        connections = 0
+        for pool in set(self.adapter.used_pools) | set(self.single_adapter.used_pools):
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+
+        reused = max(0, requests_sent - connections)
+        return {
+            'requests': requests_sent,
+            'connections': connections,
+            'reused': reused,
+            'reuse_rate': round(reused / requests_sent, 3) if requests_sent else 0.0
+        }
+
+
+class AsyncUpstreamClient:
+    """httpx.AsyncClient con pool keep-alive y los mismos reintentos que UpstreamSession.
+
+    Los fallos de conexión (la petición no llegó a enviarse) y los 429 y
+    5xx de GET y HEAD se reintentan aquí con backoff y jitter. Un timeout de
+    lectura no se reintenta. Con deadline, como UpstreamSession.request().
+    Se usa siempre desde el mismo event loop (aio.EventLoopThread).
+    """
+
+    def __init__(self, name, pool_size=HTTP_ASYNC_POOL_SIZE, max_retries=HTTP_MAX_RETRIES, backoff=HTTP_BACKOFF):
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(retries=0),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+        self.requests = 0
+        self.retries = 0
+
+    async def request(self, method, url, deadline=None, **kwargs):
+        cap = kwargs.get('timeout')
+        attempts = 0
+        while True:
+            if deadline is not None:
+                kwargs['timeout'] = deadline.timeout(cap)
+            self.requests += 1
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                wait = retry_wait(attempts + 1, self.backoff, deadline) if attempts < self.max_retries else None
+                if wait is None:
+                    raise
+            else:
+                if (response.status_code not in RETRY_STATUS_CODES or attempts >= self.max_retries
+                        or method not in RETRY_METHODS):
+                    # Devolver la última respuesta y que el llamador decida
+                    return response
+                wait = retry_wait(attempts + 1, self.backoff, deadline)
+                if wait is None:
+                    return response
+                await response.aclose()
+            attempts += 1
+            self.retries += 1
+            await asyncio.sleep(wait)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def stats(self):
+        return {'requests': self.requests, 'retries': self.retries}
+
+
+_sessions = {}
+_async_clients = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name):
+    """Devuelve la sesión compartida de un upstream, creándola la primera vez"""
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = UpstreamSession(name)
+            _sessions[name] = session
+        return session
+
+
+def get_async_client(name):
+    """Cliente asíncrono compartido de un upstream, creándolo la primera vez"""
+    with _sessions_lock:
+        client = _async_clients.get(name)
+        if client is None:
+            client = AsyncUpstreamClient(name)
+            _async_clients[name] = client
+        return client
+
+
+def sessions_stats():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        async_clients = list(_async_clients.values())
+    stats = {s.name: s.stats() for s in sessions}
+    for client in async_clients:
+        stats[f'{client.name} (async)'] = client.stats()
+    return stats
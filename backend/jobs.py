@@ -0,0 +1,174 @@
+"""Trabajos asíncronos para el pipeline de análisis.
+
+Un POST crea el trabajo y devuelve su id al instante; el runner (una
+corrutina) corre como tarea del event loop compartido (aio.EventLoopThread)
+y cada etapa completada se registra como evento. Los clientes consultan el
+estado o se suscriben a los eventos (SSE) sin mantener ocupado un worker de
+Flask durante todo el análisis.
+"""
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+
+class QueueFullError(Exception):
+    """No se aceptan más trabajos: la cola está llena"""
+
+
+class Job:
+    """Estado de un trabajo y su historial de eventos de progreso"""
+
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.status = 'queued'  # queued → running → done | error
+        self.stage = None
+        self.events = []
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'error')
+
+    def stages_completed(self):
+        """Etapas completadas en orden, sin los eventos parciales (*_partial)"""
+        stages = []
+        for event in self.events:
+            stage = event['stage']
+            if stage in ('done', 'error') or stage.endswith('_partial') or stage in stages:
+                continue
+            stages.append(stage)
+        return stages
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages_completed': self.stages_completed(),
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == 'done':
+            data['result'] = self.result
+        elif self.status == 'error':
+            data['error'] = self.error
+            data['status_code'] = self.status_code
+        return data
+
+
+class JobManager:
+    """Cola de trabajos como tareas de un event loop, acotados y con eventos de progreso"""
+
+    def __init__(self, runner, loop, max_workers=4, max_pending=100, ttl=3600):
+        # runner(progress, **params) es una corrutina que ejecuta el pipeline y
+        # devuelve el resultado; progress(stage, data) se llama al terminar cada
+        # etapa. max_workers limita los trabajos simultáneos en el loop
+        self.runner = runner
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.loop = loop
+        self._slots = asyncio.Semaphore(max_workers)
+        self._jobs = {}
+        self._cond = threading.Condition()
+
+    def submit(self, **params):
+        with self._cond:
+            self._purge_expired()
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise QueueFullError(f"Hay {pending} trabajos pendientes")
+
+            job = Job(uuid.uuid4().hex, params)
+            self._jobs[job.id] = job
+
+        self.loop.submit(self._run(job))
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def _emit(self, job, stage, data=None, status=None):
+        with self._cond:
+            job.stage = stage
+            job.events.append({'stage': stage, 'data': data, 'at': time.time()})
+            # El estado final se cambia junto con su evento para que un lector
+            # SSE nunca vea el trabajo terminado sin el evento 'done'/'error'
+            if status:
+                job.status = status
+                job.finished_at = time.time()
+            self._cond.notify_all()
+
+    async def _run(self, job):
+        async with self._slots:
+            with self._cond:
+                job.status = 'running'
+
+            try:
+                result = await self.runner(lambda stage, data=None: self._emit(job, stage, data), **job.params)
+            except Exception as e:
+                self._fail(job, e)
+                return
+
+            self._complete(job, result)
+
+    def _fail(self, job, error):
+        job.error = str(error)
+        job.status_code = getattr(error, 'status_code', 500)
+        self._emit(job, 'error', {'error': job.error, 'status_code': job.status_code}, status='error')
+
+    def _complete(self, job, result):
+        job.result = result
+        self._emit(job, 'done', result, status='done')
+
+    def iter_events(self, job_id, keepalive=15):
+        """Generador de eventos en formato Server-Sent Events.
+
+        Reenvía el historial ya emitido y después espera nuevos eventos
+        hasta que el trabajo termina. Envía un comentario de keepalive
+        periódicamente para que los proxies no corten la conexión.
+        """
+        sent = 0
+        while True:
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                if sent >= len(job.events) and not job.finished:
+                    self._cond.wait(timeout=keepalive)
+                pending = job.events[sent:]
+                finished = job.finished
+
+            if not pending:
+                if finished:
+                    return
+                yield ": keepalive\n\n"
+                continue
+
+            for event in pending:
+                sent += 1
+                yield f"event: {event['stage']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+    def _purge_expired(self):
+        # Se llama con self._cond adquirido
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._cond:
+            counts = {'queued': 0, 'running': 0, 'done': 0, 'error': 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
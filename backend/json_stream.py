@@ -0,0 +1,136 @@
+"""Parser JSON incremental para respuestas en streaming del LLM.
+
+Recibe el texto a trozos según llega y avisa en cuanto un campo de primer
+nivel del objeto raíz está completo (destination, airport_code...). Para
+los campos que son listas (days, places) avisa de cada elemento por
+separado, sin esperar a que se cierre la lista. Ignora cualquier texto
+antes de la primera llave (p. ej. un bloque ```json).
+
+Es un parser de "mejor esfuerzo": si un trozo no es JSON válido se ignora
+y el llamador sigue teniendo el texto completo para el parseo final.
+"""
+import json
+
+
+class IncrementalJSONParser:
+    """Emite on_field(key, value) y on_item(key, index, value) a medida que se completan"""
+
+    def __init__(self, on_field=None, on_item=None, item_fields=('days', 'places')):
+        self.on_field = on_field
+        self.on_item = on_item
+        self.item_fields = set(item_fields)
+        self.buffer = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._started = False
+        self._done = False
+        # Estado en el nivel del objeto raíz (profundidad 1)
+        self._key = None
+        self._value_start = None
+        # Estado dentro de una lista que se emite elemento a elemento (profundidad 2)
+        self._item_list = False
+        self._item_start = None
+        self._item_index = 0
+
+    def feed(self, text):
+        self.buffer += text
+        buf = self.buffer
+        i = self._pos
+        n = len(buf)
+
+        while i < n and not self._done:
+            ch = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._end_string(i)
+                i += 1
+                continue
+
+            if not self._started:
+                if ch == '{':
+                    self._started = True
+                    self._depth = 1
+                i += 1
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+                self._begin_value(i)
+            elif ch in '{[':
+                self._begin_value(i)
+                self._depth += 1
+                if self._depth == 2 and ch == '[' and self._key in self.item_fields:
+                    self._item_list = True
+                    self._item_index = 0
+                    self._item_start = None
+            elif ch in '}]':
+                if self._depth == 2 and self._item_list:
+                    self._end_item(i)
+                    self._item_list = False
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end_value(i)
+                    self._done = True
+            elif ch == ',':
+                if self._depth == 1:
+                    self._end_value(i)
+                elif self._depth == 2 and self._item_list:
+                    self._end_item(i)
+            elif ch == ':':
+                pass
+            elif not ch.isspace():
+                # Inicio de número, true/false/null
+                self._begin_value(i)
+            i += 1
+
+        self._pos = i
+
+    def _begin_value(self, i):
+        if self._depth == 1 and self._key is not None and self._value_start is None:
+            self._value_start = i
+        elif self._depth == 2 and self._item_list and self._item_start is None:
+            self._item_start = i
+
+    def _end_string(self, i):
+        # Una cadena en profundidad 1 sin clave pendiente es el nombre de la clave
+        if self._depth == 1 and self._key is None:
+            try:
+                self._key = json.loads(self.buffer[self._string_start:i + 1])
+            except ValueError:
+                self._key = None
+
+    def _end_value(self, i):
+        if self._key is not None and self._value_start is not None:
+            raw = self.buffer[self._value_start:i]
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                value = None
+            else:
+                if self.on_field:
+                    self.on_field(self._key, value)
+        self._key = None
+        self._value_start = None
+
+    def _end_item(self, i):
+        if self._item_start is not None:
+            raw = self.buffer[self._item_start:i]
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                pass
+            else:
+                if self.on_item:
+                    self.on_item(self._key, self._item_index, value)
+            self._item_index += 1
+        self._item_start = None
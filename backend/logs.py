@@ -0,0 +1,58 @@
+"""Configuración de logging del backend.
+
+Todos los módulos usan loggers bajo "instatrip" (instatrip.app,
+instatrip.cache...). El nivel se controla con LOG_LEVEL y el formato con
+LOG_FORMAT: "text" (legible en consola) o "json" (una línea por evento,
+con los campos pasados en extra=). Los mensajes usan argumentos al estilo
+%s, así que por debajo del nivel activo no se formatea nada.
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+# Atributos estándar de LogRecord: todo lo demás viene de extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Una línea JSON por registro con los campos de extra= al primer nivel"""
+
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    """Configura el logger raíz "instatrip" (una sola vez aunque se llame varias).
+
+    Sin argumentos lee LOG_LEVEL y LOG_FORMAT del entorno (después de load_dotenv).
+    """
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "text")).lower()
+    logger = logging.getLogger('instatrip')
+    logger.setLevel(getattr(logging, level, logging.INFO))
+    if logger.handlers:
+        return logger
+
+    handler = logging.StreamHandler(sys.stdout)
+    if fmt == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(name)s: %(message)s', '%H:%M:%S'))
+    logger.addHandler(handler)
+    logger.propagate = False
+    return logger
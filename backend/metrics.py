@@ -0,0 +1,169 @@
+"""Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Contadores e histogramas con etiquetas, thread-safe, más "colectores":
+funciones que se evalúan al servir /api/metrics y devuelven valores que
+ya se cuentan en otro sitio (aciertos de las cachés, trabajos en cola...)
+para no duplicar contadores en el camino caliente.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Segundos: desde lecturas de caché hasta descargas y generaciones largas
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}, recibió {tuple(labels)}")
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Valor que solo crece (peticiones, bytes, tokens)"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(key)} {_format_value(v)}' for key, v in items]
+
+
+class Histogram(_Metric):
+    """Distribución de valores (latencias) en buckets acumulativos"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # etiquetas → [conteo por bucket..., suma, total]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = [0] * (len(self.buckets) + 1) + [0.0, 0]
+                self._values[key] = data
+            data[idx] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Mide la duración del bloque (también si lanza una excepción)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((key, list(data)) for key, data in self._values.items())
+
+        lines = self.header()
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), data):
+                cumulative += count
+                bucket_labels = key + (('le', _format_value(bound) if bound != float('inf') else '+Inf'),)
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(data[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {data[-1]}')
+        return lines
+
+
+class _Collected(_Metric):
+    """Métrica calculada al servir: fn() → {tupla de valores de etiquetas: valor}"""
+
+    def __init__(self, name, help_text, labelnames, fn, kind):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self):
+        lines = self.header()
+        for values, value in sorted(self.fn().items()):
+            if not isinstance(values, tuple):
+                values = (values,)
+            lines.append(f'{self.name}{_format_labels(tuple(zip(self.labelnames, values)))} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def collect(self, name, help_text, labelnames, fn, kind='gauge'):
+        """Registra una métrica cuyos valores da fn() en cada lectura"""
+        return self._add(_Collected(name, help_text, labelnames, fn, kind))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                continue  # Un colector roto no debe tumbar el endpoint
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
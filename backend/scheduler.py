@@ -0,0 +1,118 @@
+"""Limitador de peticiones por segundo con prioridades (token bucket).
+
+Amadeus limita las peticiones por segundo (10 TPS en el entorno de test).
+Todas las llamadas pasan por un único bucket compartido; cuando hay cola,
+el token siguiente se lo lleva la petición de mayor prioridad (número más
+bajo), así las búsquedas que ve el usuario adelantan a los barridos de
+fechas en segundo plano. Una espera se puede cancelar con un Event.
+Los hilos usan acquire() y las corrutinas del pipeline asíncrono
+acquire_async(); ambos comparten el mismo bucket y la misma cola.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+
+class RateLimitTimeout(Exception):
+    """No se obtuvo turno en el limitador a tiempo (o la espera se canceló)"""
+
+
+class RateLimiter:
+    """Token bucket thread-safe: rate tokens por segundo, hasta burst acumulados"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiters = []  # heap de (prioridad, orden de llegada)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.granted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_acquire(self, entry, started, deadline, cancel):
+        """Un intento con el lock adquirido → True (token), False (rechazo) o segundos a esperar"""
+        if cancel is not None and cancel.is_set():
+            self.rejected += 1
+            return False
+
+        self._refill()
+        if self._waiters[0] == entry and self._tokens >= 1:
+            self._tokens -= 1
+            heapq.heappop(self._waiters)
+            self.granted += 1
+            self.wait_total += time.monotonic() - started
+            return True
+
+        # Hasta el próximo token; poco a poco para notar cancelaciones
+        wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.01
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.rejected += 1
+                return False
+            wait = min(wait, remaining)
+        return min(wait, 0.1)
+
+    def _leave(self, entry):
+        # Se llama con self._cond adquirido
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+        self._cond.notify_all()
+
+    def acquire(self, priority=0, timeout=None, cancel=None):
+        """Espera un token; devuelve False si vence timeout o se activa cancel"""
+        entry = (priority, next(self._seq))
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    outcome = self._try_acquire(entry, started, deadline, cancel)
+                    if outcome is True or outcome is False:
+                        return outcome
+                    self._cond.wait(outcome)
+            finally:
+                self._leave(entry)
+
+    async def acquire_async(self, priority=0, timeout=None, cancel=None):
+        """Como acquire() pero sin bloquear el event loop (cancel puede ser un asyncio.Event)"""
+        entry = (priority, next(self._seq))
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+        try:
+            while True:
+                with self._cond:
+                    outcome = self._try_acquire(entry, started, deadline, cancel)
+                if outcome is True or outcome is False:
+                    return outcome
+                await asyncio.sleep(outcome)
+        finally:
+            # También si la tarea se cancela mientras espera
+            with self._cond:
+                self._leave(entry)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rate': self.rate,
+                'queued': len(self._waiters),
+                'granted': self.granted,
+                'rejected': self.rejected,
+                'avg_wait': round(self.wait_total / self.granted, 4) if self.granted else 0.0
+            }
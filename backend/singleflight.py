@@ -0,0 +1,135 @@
+"""Agrupación de peticiones idénticas simultáneas (single-flight).
+
+Cuando un video se hace viral, muchos usuarios piden el mismo análisis a
+la vez. Con SingleFlight solo se ejecuta un pipeline por clave (video +
+origen): las peticiones que llegan mientras está en curso esperan a ese
+mismo resultado, o reciben el mismo error, en lugar de volver a descargar,
+transcribir y consultar Amadeus. Los eventos de progreso se reparten a
+todas las peticiones agrupadas; quien llega tarde recibe primero los que
+ya se emitieron.
+
+SingleFlight es para hilos y AsyncSingleFlight para corrutinas del event
+loop (aio.EventLoopThread).
+"""
+import asyncio
+import copy
+import threading
+from concurrent.futures import Future
+
+
+class _Flight:
+    """Una ejecución en curso: su resultado y los eventos de progreso emitidos"""
+
+    def __init__(self):
+        self.events = []
+        self.subscribers = []
+        self.waiters = 1
+        self.future = Future()  # Hilos; en AsyncSingleFlight se usa task
+        self.task = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, progress):
+        # Bajo el lock para que nadie reciba un evento nuevo antes que los antiguos
+        with self._lock:
+            for stage, data in self.events:
+                progress(stage, data)
+            self.subscribers.append(progress)
+
+    def emit(self, stage, data=None):
+        with self._lock:
+            self.events.append((stage, data))
+            for progress in self.subscribers:
+                progress(stage, data)
+
+
+class _BaseSingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.coalesced = 0
+
+    def _join(self, key):
+        """(flight, True si esta llamada la inicia)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.coalesced += 1
+                return flight, False
+            flight = _Flight()
+            self._flights[key] = flight
+            self.started += 1
+            return flight, True
+
+    def _leave(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'waiters': sum(f.waiters for f in self._flights.values()),
+                'started': self.started,
+                'coalesced': self.coalesced
+            }
+
+
+class SingleFlight(_BaseSingleFlight):
+    """Single-flight para hilos: run(key, fn, progress) ejecuta fn(progress) una vez por clave"""
+
+    def run(self, key, fn, progress=None):
+        flight, leader = self._join(key)
+        if progress is not None:
+            flight.subscribe(progress)
+
+        if leader:
+            try:
+                flight.future.set_result(fn(flight.emit))
+            except Exception as e:
+                flight.future.set_exception(e)
+            finally:
+                self._leave(key, flight)
+            return flight.future.result()
+
+        # Cada petición agrupada recibe su propia copia del resultado
+        return copy.deepcopy(flight.future.result())
+
+
+class AsyncSingleFlight(_BaseSingleFlight):
+    """Single-flight para corrutinas: await run(key, factory, progress) con factory(progress) → corrutina.
+
+    La ejecución es una tarea propia: si una de las peticiones se cancela
+    (p. ej. el cliente se desconecta), las demás siguen esperando el resultado.
+    Cuando se cancelan todas, nadie lo necesita ya y se cancela la ejecución.
+    """
+
+    async def run(self, key, factory, progress=None):
+        flight, leader = self._join(key)
+        if progress is not None:
+            flight.subscribe(progress)
+
+        if leader:
+            # Se crea antes de cualquier await: quien se una después ya ve la tarea
+            flight.task = asyncio.ensure_future(factory(flight.emit))
+            flight.task.add_done_callback(lambda task: self._finished(key, flight, task))
+
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            with self._lock:
+                flight.waiters -= 1
+                abandoned = flight.waiters == 0
+                if abandoned and self._flights.get(key) is flight:
+                    del self._flights[key]  # Quien llegue ahora empieza una ejecución nueva
+            if abandoned:
+                flight.task.cancel()
+            raise
+        return result if leader else copy.deepcopy(result)
+
+    def _finished(self, key, flight, task):
+        self._leave(key, flight)
+        if not task.cancelled():
+            task.exception()  # Marcada como leída aunque todas las peticiones se hayan ido
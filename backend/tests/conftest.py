@@ -0,0 +1,16 @@
+"""Los módulos del backend se importan como en app.py (desde backend/).
+
+Ejecutar con: python -m pytest -q backend/tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def video_test_host():
+    """host:puerto de un servidor local de pruebas que se acepta como TikTok (test_hosts)"""
+    return '127.0.0.1:8765'
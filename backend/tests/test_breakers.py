@@ -0,0 +1,122 @@
+import types
+
+import pytest
+
+import breakers
+from breakers import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj monótono manual para breakers: clock.now += segundos"""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(breakers, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.min_calls):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == OPEN
+
+
+def test_opens_when_failure_rate_reaches_threshold(clock):
+    breaker = CircuitBreaker('amadeus', failure_rate=0.5, min_calls=4, window=60, open_seconds=30)
+    for ok in (True, False, True):
+        breaker.allow()
+        breaker.record(ok)
+    assert breaker.state == CLOSED  # 3 llamadas: aún no se evalúa la tasa
+
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_old_failures_leave_the_window(clock):
+    breaker = CircuitBreaker('amadeus', failure_rate=0.5, min_calls=2, window=10)
+    breaker.record(False)
+    clock.now += 11
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == OPEN  # 1/2 dentro de la ventana
+
+    breaker = CircuitBreaker('amadeus', failure_rate=0.6, min_calls=2, window=10)
+    breaker.record(False)
+    clock.now += 11
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == CLOSED  # el primer fallo ya no cuenta
+
+
+def test_open_half_open_closed(clock):
+    breaker = CircuitBreaker('anthropic', min_calls=2, open_seconds=30)
+    open_breaker(breaker)
+    clock.now += 29
+    assert not breaker.allow()
+
+    clock.now += 1
+    assert breaker.allow()  # La llamada de prueba
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # Solo una a la vez
+
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    assert breaker.stats()['calls'] == 0
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker('anthropic', min_calls=2, open_seconds=30)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.stats()['opened'] == 2
+    assert not breaker.allow()
+
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_lost_probe_is_replaced_after_probe_timeout(clock):
+    breaker = CircuitBreaker('amadeus', min_calls=2, open_seconds=30, probe_timeout=5)
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()  # Prueba que nunca llama a record() (p. ej. cancelada)
+
+    clock.now += 4.9
+    assert not breaker.allow()
+    clock.now += 0.1
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+
+
+def test_is_open_does_not_take_the_probe(clock):
+    breaker = CircuitBreaker('anthropic', min_calls=2, open_seconds=30)
+    open_breaker(breaker)
+    assert breaker.is_open()
+
+    clock.now += 30
+    assert not breaker.is_open()
+    assert breaker.allow()  # La prueba sigue disponible para la llamada real
+
+
+def test_calls_started_before_opening_do_not_count(clock):
+    breaker = CircuitBreaker('amadeus', min_calls=2, open_seconds=30)
+    open_breaker(breaker)
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert breaker.stats()['calls'] == 0
+
+
+def test_failed_status():
+    assert breakers.failed_status(500)
+    assert breakers.failed_status(503)
+    assert breakers.failed_status(429)
+    assert not breakers.failed_status(404)
+    assert not breakers.failed_status(200)
@@ -0,0 +1,117 @@
+import asyncio
+import types
+
+import pytest
+
+import cache
+from cache import ResultCache, SQLiteStore, TranscriptCache, TwoTierCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj manual para cache.time: clock.now avanza solo cuando el test lo cambia"""
+    fake = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, 'time', types.SimpleNamespace(time=lambda: fake.now))
+    return fake
+
+
+def disk_keys(store):
+    rows = store._conn().execute(f"SELECT key FROM {store.table} ORDER BY rowid").fetchall()
+    return [key for (key,) in rows]
+
+
+def test_disk_hit_is_promoted_with_remaining_ttl(tmp_path, clock):
+    path = str(tmp_path / 'kv.db')
+    TwoTierCache(path).set('k', {'v': 1}, ttl=100)
+
+    # Otro worker: mismo SQLite, LRU vacía
+    other = TwoTierCache(path)
+    clock.now += 60
+    assert other.get('k') == {'v': 1}
+    assert other.stats()['disk_hits'] == 1
+    assert other.memory._data['k'][1] == pytest.approx(1100.0)
+
+    # La copia en memoria caduca a la vez que la del disco, no 100s después de promocionarla
+    clock.now += 39
+    assert other.get('k') == {'v': 1}
+    assert other.stats()['disk_hits'] == 1
+    clock.now += 1
+    assert other.get('k') is None
+    assert disk_keys(other.disk) == []
+
+
+def test_entries_without_ttl_do_not_expire(tmp_path, clock):
+    tiers = TwoTierCache(str(tmp_path / 'kv.db'))
+    tiers.set('k', 'v')
+    clock.now += 10 ** 9
+    assert tiers.get('k') == 'v'
+
+
+def test_expired_entry_is_a_miss(tmp_path, clock):
+    tiers = TwoTierCache(str(tmp_path / 'kv.db'))
+    tiers.set('k', 'v', ttl=10)
+    clock.now += 10
+    assert tiers.get('k') is None
+    stats = tiers.stats()
+    assert (stats['hits'], stats['misses']) == (0, 1)
+
+
+def test_reads_return_independent_copies(tmp_path):
+    tiers = TwoTierCache(str(tmp_path / 'kv.db'))
+    tiers.set('k', {'days': [1, 2]})
+    tiers.get('k')['days'].append(3)
+    assert tiers.get('k') == {'days': [1, 2]}
+
+
+def test_evict_overflow_keeps_newest_rows(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'kv.db'), max_entries=3)
+    for i in range(5):
+        store.set(f'k{i}', str(i))
+    store.evict_overflow()
+    assert disk_keys(store) == ['k2', 'k3', 'k4']
+
+
+def test_writes_periodically_trim_the_disk(tmp_path, clock):
+    tiers = TwoTierCache(str(tmp_path / 'kv.db'), maxsize=1000, max_disk_entries=50)
+    tiers.set('expired', 'x', ttl=1)
+    clock.now += 2
+    for i in range(99):
+        tiers.set(f'k{i}', i)
+
+    keys = disk_keys(tiers.disk)
+    assert 'expired' not in keys
+    assert keys == [f'k{i}' for i in range(49, 99)]
+
+
+def test_result_cache_separates_itinerary_and_prices(tmp_path, clock):
+    results = ResultCache(str(tmp_path / 'results.db'), itinerary_ttl=3600, prices_ttl=60)
+
+    async def scenario():
+        await results.set_itinerary_async('tiktok:1', {'city': 'Roma'})
+        await results.set_booking_links_async('tiktok:1', 'MAD', {'flights': ['MAD-FCO']})
+        assert await results.get_itinerary_async('tiktok:1') == {'city': 'Roma'}
+        assert await results.get_booking_links_async('tiktok:1', 'MAD') == {'flights': ['MAD-FCO']}
+        # Los precios dependen del origen; el itinerario no
+        assert await results.get_booking_links_async('tiktok:1', 'BCN') is None
+
+        clock.now += 60
+        assert await results.get_booking_links_async('tiktok:1', 'MAD') is None
+        assert await results.get_itinerary_async('tiktok:1') == {'city': 'Roma'}
+
+    asyncio.run(scenario())
+    assert results.get_itinerary('tiktok:1') == {'city': 'Roma'}
+    assert results.get_itinerary('tiktok:2') is None
+
+
+def test_transcript_cache_is_shared_through_disk(tmp_path):
+    path = str(tmp_path / 'transcripts.db')
+
+    async def scenario():
+        await TranscriptCache(path).set_async('whisper-1:es:abc', 'hola desde Lisboa')
+        other = TranscriptCache(path)
+        assert await other.get_async('whisper-1:es:abc') == 'hola desde Lisboa'
+        assert await other.get_async('whisper-1:es:def') is None
+        return other.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats['disk_hits'], stats['hits'], stats['misses']) == (1, 1, 1)
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+# app crea sus clientes y cachés al importarse: claves falsas y caché temporal
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'test')
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='instatrip-test-'))
+
+import app  # noqa: E402
+
+
+def fake_message(text, **usage):
+    """Respuesta final de Claude con solo lo que lee finish_itinerary_call"""
+    usage.setdefault('input_tokens', 120)
+    usage.setdefault('output_tokens', 900)
+    return SimpleNamespace(content=[SimpleNamespace(text=text)], usage=SimpleNamespace(**usage))
+
+
+def test_system_prompt_reaches_cache_minimum():
+    # ~4 caracteres por token es una cota por lo alto en español: el recuento real es mayor
+    assert len(app.ITINERARY_SYSTEM_PROMPT) / 4 >= app.PROMPT_CACHE_MIN_TOKENS
+
+
+def test_itinerary_request_caches_system_block():
+    request = app.itinerary_request('transcripción')
+    assert request['system'] == [{
+        'type': 'text',
+        'text': app.ITINERARY_SYSTEM_PROMPT,
+        'cache_control': {'type': 'ephemeral'},
+    }]
+    assert request['messages'] == [{'role': 'user', 'content': 'transcripción'}]
+
+
+def test_cache_read_tokens_recorded_in_usage(monkeypatch):
+    usage = app.LLMUsage()
+    monkeypatch.setattr(app, 'llm_usage', usage)
+    started = time.time()
+
+    itinerary = app.finish_itinerary_call(
+        fake_message('{"city": "Lisboa"}', cache_read_input_tokens=2600, cache_creation_input_tokens=0),
+        started, started)
+    app.finish_itinerary_call(
+        fake_message('```json\n{"city": "Roma"}\n```', cache_read_input_tokens=None), started, started)
+
+    assert itinerary == {'city': 'Lisboa'}
+    stats = usage.stats()
+    assert stats['calls'] == 2
+    assert stats['input_tokens'] == 240
+    assert stats['cache_read_input_tokens'] == 2600
+    assert stats['cache_creation_input_tokens'] == 0
+    assert stats['output_tokens'] == 1800
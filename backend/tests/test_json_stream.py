@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from json_stream import IncrementalJSONParser
+
+ITINERARY = {
+    'destination': 'Roma, Italia',
+    'airport_code': 'FCO',
+    'duration': '3 días',
+    'budget': {'min': 300, 'max': 600, 'notes': ['vuelos {ida} y vuelta', 'sin "extras"']},
+    'days': [
+        {'day': 1, 'activities': [{'name': 'Coliseo', 'tags': ['historia', 'arte']}]},
+        {'day': 2, 'activities': [], 'tip': 'Lleva agua: \\ "30°C" \n y gorra'},
+        {'day': 3, 'activities': [{'name': 'Trastevere }]', 'nested': {'a': [1, [2, 3]]}}]},
+    ],
+    'places': ['Fontana di Trevi', 'Vaticano [museos]'],
+    'rating': 4.5,
+    'visa': False,
+    'notes': None,
+}
+
+
+def parse(chunks):
+    """Alimenta el parser con los trozos y devuelve los eventos emitidos"""
+    events = []
+    parser = IncrementalJSONParser(
+        on_field=lambda key, value: events.append(('field', key, value)),
+        on_item=lambda key, index, value: events.append(('item', key, index, value))
+    )
+    for chunk in chunks:
+        parser.feed(chunk)
+    return events
+
+
+def expected_events(data):
+    events = []
+    for key, value in data.items():
+        if key in ('days', 'places'):
+            events.extend(('item', key, index, item) for index, item in enumerate(value))
+        events.append(('field', key, value))
+    return events
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_whole_document(indent):
+    text = json.dumps(ITINERARY, ensure_ascii=False, indent=indent)
+    assert parse([text]) == expected_events(ITINERARY)
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(ITINERARY, ensure_ascii=False)
+    assert parse(list(text)) == expected_events(ITINERARY)
+
+
+def test_every_split_point():
+    text = json.dumps(ITINERARY)  # Con escapes \uXXXX que también se pueden partir
+    expected = expected_events(ITINERARY)
+    for i in range(1, len(text)):
+        assert parse([text[:i], text[i:]]) == expected, text[:i]
+
+
+def test_items_are_emitted_before_the_list_closes():
+    events = parse(['{"destination": "Roma", "days": [{"day": 1, "a": [1, 2]}, ', '{"day": 2'])
+    assert events == [
+        ('field', 'destination', 'Roma'),
+        ('item', 'days', 0, {'day': 1, 'a': [1, 2]}),
+    ]
+
+
+def test_escaped_quotes_and_backslashes_in_keys_and_values():
+    text = r'{"we\"ird\\": "a\\", "b": "}\"{", "c": 1}'
+    assert parse([text]) == [('field', 'we"ird\\', 'a\\'), ('field', 'b', '}"{'), ('field', 'c', 1)]
+
+
+def test_text_before_the_object_is_ignored():
+    text = 'Aquí tienes el itinerario:\n```json\n{"city": "Roma", "places": ["Foro"]}\n```'
+    assert parse([text]) == [
+        ('field', 'city', 'Roma'),
+        ('item', 'places', 0, 'Foro'),
+        ('field', 'places', ['Foro']),
+    ]
+
+
+def test_nothing_after_the_root_object():
+    events = parse(['{"a": 1}', ' {"b": 2}'])
+    assert events == [('field', 'a', 1)]
+
+
+def test_invalid_item_is_skipped_and_the_rest_continue():
+    events = parse(['{"days": [{"day": 1}, {"day": tru}, {"day": 3}], "city": "Roma"}'])
+    assert ('item', 'days', 0, {'day': 1}) in events
+    assert ('item', 'days', 2, {'day': 3}) in events
+    assert not any(event[:3] == ('item', 'days', 1) for event in events)
+    assert events[-1] == ('field', 'city', 'Roma')
+
+
+def test_empty_item_list():
+    assert parse(['{"days": [], "city": "Roma"}']) == [('field', 'days', []), ('field', 'city', 'Roma')]
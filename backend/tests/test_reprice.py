@@ -0,0 +1,47 @@
+import os
+import tempfile
+
+import pytest
+
+# app crea sus clientes y cachés al importarse: claves falsas y caché temporal
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'test')
+os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='instatrip-test-'))
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('body, message', [
+    ({'itinerary': {'airport_code': 123}}, 'airport_code'),
+    ({'itinerary': {'airport_code': 'FCO', 'city': ['Roma']}}, 'city'),
+    ({'itinerary': {'city_code': 'ROM', 'destination': None}}, 'destination'),
+    ({'itinerary': {'airport_code': 'FCO', 'duration': {'days': 3}}}, 'duration'),
+    ({'itinerary': {'airport_code': 'FCO', 'duration': True}}, 'duration'),
+    ({'itinerary': {'airport_code': 'FCO', 'places': 'Coliseo'}}, 'places'),
+    ({'itinerary': {'airport_code': 'FCO', 'places': [{'name': 5}]}}, 'places'),
+    ({'itinerary': {'airport_code': 'FCO'}, 'origin_iata': 28}, 'origin_iata'),
+    ({'itinerary_id': ['tiktok:1']}, 'itinerary_id'),
+    ({'itinerary': {'destination': 'Roma'}}, 'airport_code o city_code'),
+    ({'itinerary': 'Roma'}, 'itinerary_id o itinerary'),
+])
+def test_invalid_itinerary_is_a_400(client, body, message):
+    response = client.post('/api/reprice', json=body)
+    assert response.status_code == 400
+    assert message in response.get_json()['error']
+
+
+def test_duration_as_number():
+    itinerary = {'airport_code': 'FCO', 'city': 'Roma', 'duration': 3}
+    _, parsed, origin = app.parse_reprice_request({'itinerary': itinerary, 'origin_iata': ' lis '})
+    assert origin == 'LIS'
+    assert app.booking_codes(parsed)[2] == 3
+
+
+def test_unknown_itinerary_id_is_a_404(client):
+    response = client.post('/api/reprice', json={'itinerary_id': 'tiktok:0'})
+    assert response.status_code == 404
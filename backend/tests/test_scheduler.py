@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+
+from scheduler import RateLimiter
+
+
+def test_burst_then_rate():
+    limiter = RateLimiter(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(4):
+        assert limiter.acquire(timeout=1)
+    # 2 del burst al instante y 2 más a 20/s
+    assert 0.08 <= time.monotonic() - started < 0.5
+    assert limiter.stats()['granted'] == 4
+
+
+def test_higher_priority_goes_first():
+    limiter = RateLimiter(rate=10)
+    assert limiter.acquire()  # Vacía el bucket: los siguientes hacen cola
+    order = []
+
+    async def request(priority):
+        assert await limiter.acquire_async(priority=priority, timeout=2)
+        order.append(priority)
+
+    async def main():
+        # Todas entran en la cola antes de que llegue el siguiente token
+        await asyncio.gather(*(request(priority) for priority in (5, 1, 3, 0)))
+
+    asyncio.run(main())
+    assert order == [0, 1, 3, 5]
+
+
+def test_same_priority_keeps_arrival_order():
+    limiter = RateLimiter(rate=20)
+    assert limiter.acquire()
+    order = []
+
+    async def request(name):
+        assert await limiter.acquire_async(priority=1, timeout=2)
+        order.append(name)
+
+    async def main():
+        await asyncio.gather(*(request(name) for name in 'abc'))
+
+    asyncio.run(main())
+    assert order == ['a', 'b', 'c']
+
+
+def test_priority_between_threads():
+    limiter = RateLimiter(rate=10)
+    assert limiter.acquire()
+    order = []
+
+    def request(priority):
+        assert limiter.acquire(priority=priority, timeout=2)
+        order.append(priority)
+
+    threads = []
+    for priority in (2, 1, 0):
+        thread = threading.Thread(target=request, args=(priority,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2]
+
+
+def test_timeout_rejects_and_leaves_the_queue():
+    limiter = RateLimiter(rate=1)
+    assert limiter.acquire()
+    started = time.monotonic()
+    assert not limiter.acquire(timeout=0.05)
+    assert time.monotonic() - started < 0.5
+    stats = limiter.stats()
+    assert stats['rejected'] == 1
+    assert stats['queued'] == 0
+
+
+def test_cancel_event_rejects():
+    limiter = RateLimiter(rate=1)
+    assert limiter.acquire()
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    assert not limiter.acquire(timeout=2, cancel=cancel)
+    assert limiter.stats()['queued'] == 0
+
+
+def test_rejected_waiter_does_not_block_lower_priorities():
+    limiter = RateLimiter(rate=20)
+    assert limiter.acquire()
+
+    async def main():
+        urgent = asyncio.ensure_future(limiter.acquire_async(priority=0, timeout=0.01))
+        background = asyncio.ensure_future(limiter.acquire_async(priority=9, timeout=1))
+        return await urgent, await background
+
+    assert asyncio.run(main()) == (False, True)
+
+
+def test_cancelled_task_leaves_the_queue():
+    limiter = RateLimiter(rate=1)
+    assert limiter.acquire()
+
+    async def main():
+        task = asyncio.ensure_future(limiter.acquire_async(timeout=5))
+        await asyncio.sleep(0.02)
+        assert limiter.stats()['queued'] == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(main())
+    assert limiter.stats()['queued'] == 0
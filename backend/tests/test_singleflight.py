@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+
+def wait_for_waiters(flights, waiters, timeout=2):
+    """Espera hasta que haya `waiters` peticiones agrupadas en curso"""
+    limit = time.monotonic() + timeout
+    while flights.stats()['waiters'] < waiters:
+        assert time.monotonic() < limit, flights.stats()
+        time.sleep(0.005)
+
+
+def test_leader_failure_reaches_every_waiter():
+    flights = SingleFlight()
+    calls = []
+
+    def fail(emit):
+        calls.append(1)
+        wait_for_waiters(flights, 4)
+        raise ValueError('descarga fallida')
+
+    def run(_):
+        try:
+            flights.run('video|MAD', fail)
+        except ValueError as e:
+            return str(e)
+        return None
+
+    with ThreadPoolExecutor(4) as pool:
+        errors = list(pool.map(run, range(4)))
+
+    assert errors == ['descarga fallida'] * 4
+    assert len(calls) == 1
+    assert flights.stats() == {'in_flight': 0, 'waiters': 0, 'started': 1, 'coalesced': 3}
+
+
+def test_key_is_released_after_failure():
+    flights = SingleFlight()
+    with pytest.raises(ValueError):
+        flights.run('k', lambda emit: (_ for _ in ()).throw(ValueError('x')))
+    assert flights.run('k', lambda emit: 'ok') == 'ok'
+    assert flights.stats()['started'] == 2
+
+
+def test_late_waiter_gets_earlier_progress_and_a_copy():
+    flights = SingleFlight()
+    release = threading.Event()
+    result = {'days': []}
+
+    def analyze(emit):
+        emit('downloaded')
+        release.wait(2)
+        emit('transcribed', {'characters': 10})
+        return result
+
+    seen = []
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(flights.run, 'k', analyze)
+        wait_for_waiters(flights, 1)
+        follower = pool.submit(flights.run, 'k', analyze, lambda stage, data=None: seen.append(stage))
+        wait_for_waiters(flights, 2)
+        release.set()
+
+    assert seen == ['downloaded', 'transcribed']
+    assert leader.result() is result
+    assert follower.result() == result and follower.result() is not result
+
+
+def test_async_leader_failure_reaches_every_waiter():
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def fail(emit):
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError('itinerario inválido')
+
+    async def main():
+        return await asyncio.gather(*(flights.run('k', fail) for _ in range(5)), return_exceptions=True)
+
+    errors = asyncio.run(main())
+    assert [str(e) for e in errors] == ['itinerario inválido'] * 5
+    assert len(calls) == 1
+    assert flights.stats() == {'in_flight': 0, 'waiters': 0, 'started': 1, 'coalesced': 4}
+
+
+def test_async_cancelled_waiter_does_not_cancel_the_others():
+    flights = AsyncSingleFlight()
+
+    async def analyze(emit):
+        await asyncio.sleep(0.05)
+        return {'city': 'Roma'}
+
+    async def main():
+        first = asyncio.ensure_future(flights.run('k', analyze))
+        second = asyncio.ensure_future(flights.run('k', analyze))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first.cancelled()
+
+    result, cancelled = asyncio.run(main())
+    assert result == {'city': 'Roma'}
+    assert cancelled
+
+
+def test_async_flight_is_cancelled_when_every_waiter_leaves():
+    flights = AsyncSingleFlight()
+    cancelled = []
+
+    async def analyze(emit):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def main():
+        waiters = [asyncio.ensure_future(flights.run('k', analyze)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        # Quien llega después empieza una ejecución nueva
+        return await flights.run('k', lambda emit: asyncio.sleep(0, 'nuevo'))
+
+    assert asyncio.run(main()) == 'nuevo'
+    assert cancelled == [1]
+    assert flights.stats()['started'] == 2
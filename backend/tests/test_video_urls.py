@@ -0,0 +1,195 @@
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from video_urls import VideoURLResolver, parse_video_url, url_platform
+
+TIKTOK_KEY = 'tiktok:7312345678901234567'
+INSTAGRAM_KEY = 'instagram:C1a2B3c4D5e'
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.tiktok.com/@maria/video/7312345678901234567',
+    'https://www.tiktok.com/@maria/video/7312345678901234567?is_from_webapp=1&sender_device=pc',
+    'https://m.tiktok.com/@maria.viaja/video/7312345678901234567/',
+    'http://tiktok.com/@maria/video/7312345678901234567#comments',
+    'www.tiktok.com/@maria/video/7312345678901234567',
+    'https://WWW.TIKTOK.COM./@maria/video/7312345678901234567',
+    'https://m.tiktok.com/v/7312345678901234567.html',
+    'https://www.tiktok.com/embed/v2/7312345678901234567',
+    'https://www.tiktok.com/@maria/photo/7312345678901234567',
+])
+def test_tiktok_variants_share_the_key(url):
+    info = parse_video_url(url)
+    assert info['platform'] == 'tiktok'
+    assert info['key'] == TIKTOK_KEY
+    assert info['short_code'] is None
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.instagram.com/reel/C1a2B3c4D5e/',
+    'https://www.instagram.com/reels/C1a2B3c4D5e/?igsh=abc123',
+    'https://instagram.com/p/C1a2B3c4D5e',
+    'https://www.instagram.com/tv/C1a2B3c4D5e/',
+    'https://www.instagram.com/maria.viaja/reel/C1a2B3c4D5e/',
+    'https://instagr.am/p/C1a2B3c4D5e/',
+])
+def test_instagram_variants_share_the_key(url):
+    info = parse_video_url(url)
+    assert info['platform'] == 'instagram'
+    assert info['key'] == INSTAGRAM_KEY
+    assert info['canonical_url'] == 'https://www.instagram.com/p/C1a2B3c4D5e/'
+
+
+@pytest.mark.parametrize('url, platform, code', [
+    ('https://vm.tiktok.com/ZMabc123/', 'tiktok', 'ZMabc123'),
+    ('https://vt.tiktok.com/ZSxyz/', 'tiktok', 'ZSxyz'),
+    ('https://www.tiktok.com/t/ZTR9abc/', 'tiktok', 'ZTR9abc'),
+    ('https://www.instagram.com/share/reel/BAabc123/', 'instagram', 'BAabc123'),
+    ('https://www.instagram.com/share/BAabc123', 'instagram', 'BAabc123'),
+])
+def test_short_links(url, platform, code):
+    info = parse_video_url(url)
+    assert (info['platform'], info['short_code'], info['key']) == (platform, code, None)
+
+
+@pytest.mark.parametrize('url', [
+    # El host no es de la plataforma aunque la URL lo contenga
+    'https://evil.example/www.tiktok.com/@maria/video/7312345678901234567',
+    'https://www.tiktok.com.evil.example/@maria/video/7312345678901234567',
+    'https://nottiktok.com/@maria/video/7312345678901234567',
+    'https://evil.example/?u=https://www.tiktok.com/@maria/video/7312345678901234567',
+    'https://www.tiktok.com@evil.example/@maria/video/7312345678901234567',
+    'https://evil.example#@www.tiktok.com/@maria/video/7312345678901234567',
+    'https://instagram.com.evil.example/reel/C1a2B3c4D5e/',
+    'ftp://www.tiktok.com/@maria/video/7312345678901234567',
+    'javascript:alert(1)//www.tiktok.com/@maria/video/1',
+    'https://[::1/@maria/video/1',
+    '',
+])
+def test_spoofed_hosts_are_not_platforms(url):
+    info = parse_video_url(url)
+    assert info['platform'] is None
+    assert info['key'] is None
+
+
+@pytest.mark.parametrize('url', [
+    # La ruta tiene que empezar por el patrón, no solo contenerlo
+    'https://www.tiktok.com/search?q=/@maria/video/7312345678901234567',
+    'https://www.tiktok.com/foo/@maria/video/7312345678901234567',
+    'https://www.instagram.com/explore/tags/p/C1a2B3c4D5e/',
+])
+def test_video_patterns_are_anchored(url):
+    info = parse_video_url(url)
+    assert info['platform'] is not None
+    assert info['key'] is None
+
+
+def test_short_link_on_another_port_is_not_followed():
+    info = parse_video_url('https://vm.tiktok.com:8443/ZMabc123/')
+    assert info['short_code'] is None
+
+
+def test_url_platform_subdomains():
+    assert url_platform('https://vm.tiktok.com/x') == 'tiktok'
+    assert url_platform('https://www.instagram.com/') == 'instagram'
+    assert url_platform('https://tiktok.com.evil.example/') is None
+
+
+def test_test_hosts_are_only_accepted_when_injected(video_test_host):
+    url = f'http://{video_test_host}/@bench/video/7000000001'
+    assert parse_video_url(url)['platform'] is None
+
+    info = parse_video_url(url, test_hosts={video_test_host})
+    assert info['platform'] == 'tiktok'
+    assert info['key'] == 'tiktok:7000000001'
+    # Solo ese puerto: el mismo host en otro puerto no se acepta
+    assert url_platform('http://127.0.0.1:9999/@bench/video/1', {video_test_host}) is None
+
+
+class FakeCache:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+
+    def stats(self):
+        return {'entries': len(self.data)}
+
+
+class FakeSession:
+    """Responde a HEAD con las redirecciones de `routes` (URL → Location) y registra las peticiones"""
+
+    def __init__(self, routes, delay=0):
+        self.routes = routes
+        self.delay = delay
+        self.requests = []
+
+    def head(self, url, **kwargs):
+        self.requests.append(url)
+        time.sleep(self.delay)
+        location = self.routes.get(url)
+        return types.SimpleNamespace(status_code=301 if location else 200, is_redirect=bool(location),
+                                     headers={'Location': location} if location else {})
+
+
+def test_resolver_follows_short_link_once():
+    session = FakeSession({
+        'https://vm.tiktok.com/ZMabc/': 'https://www.tiktok.com/@maria/video/7312345678901234567?_r=1',
+    }, delay=0.05)
+    resolver = VideoURLResolver(FakeCache(), session)
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(resolver.resolve, ['https://vm.tiktok.com/ZMabc/'] * 8))
+    assert {info['key'] for info in results} == {TIKTOK_KEY}
+    assert results[0]['short_code'] == 'ZMabc'
+
+    # Las simultáneas comparten el HEAD y las siguientes salen de la caché
+    resolver.resolve('https://vm.tiktok.com/ZMabc/')
+    assert session.requests == ['https://vm.tiktok.com/ZMabc/']
+    assert resolver.stats()['resolved'] == 1
+
+
+def test_resolver_uses_an_intermediate_hop():
+    session = FakeSession({
+        'https://vm.tiktok.com/ZMabc/': '/@maria/video/7312345678901234567',
+    })
+    session.routes['https://vm.tiktok.com/@maria/video/7312345678901234567'] = 'https://www.tiktok.com/login'
+    info = VideoURLResolver(FakeCache(), session).resolve('https://vm.tiktok.com/ZMabc/')
+    assert info['key'] == TIKTOK_KEY
+    assert session.requests == ['https://vm.tiktok.com/ZMabc/']
+
+
+def test_resolver_does_not_follow_redirects_off_platform():
+    session = FakeSession({
+        'https://vm.tiktok.com/ZMabc/': 'http://169.254.169.254/latest/meta-data/',
+        'http://169.254.169.254/latest/meta-data/': 'https://www.tiktok.com/@maria/video/7312345678901234567',
+    })
+    resolver = VideoURLResolver(FakeCache(), session)
+    info = resolver.resolve('https://vm.tiktok.com/ZMabc/')
+    assert info['key'] is None
+    assert info['short_code'] == 'ZMabc'
+    assert session.requests == ['https://vm.tiktok.com/ZMabc/']
+    assert resolver.stats()['failed'] == 1
+
+
+def test_resolver_gives_up_after_max_redirects():
+    routes = {f'https://www.tiktok.com/t/hop{i}/': f'https://www.tiktok.com/t/hop{i + 1}/' for i in range(20)}
+    session = FakeSession(routes)
+    info = VideoURLResolver(FakeCache(), session).resolve('https://www.tiktok.com/t/hop0/')
+    assert info['key'] is None
+    assert len(session.requests) == 5
+
+
+def test_resolver_parses_with_its_test_hosts(video_test_host):
+    resolver = VideoURLResolver(FakeCache(), FakeSession({}), test_hosts=[video_test_host.upper()])
+    info = resolver.resolve(f'http://{video_test_host}/@bench/video/7000000002')
+    assert info['key'] == 'tiktok:7000000002'
+    assert VideoURLResolver(FakeCache(), FakeSession({})).parse(
+        f'http://{video_test_host}/@bench/video/7000000002')['platform'] is None
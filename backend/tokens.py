@@ -0,0 +1,114 @@
+"""Gestor de tokens OAuth con refresco único y anticipado.
+
+Solo un llamador a la vez pide un token nuevo; el resto espera a ese
+resultado en lugar de lanzar su propia petición. Un hilo en segundo plano
+renueva el token antes de que caduque, así que ninguna petición de usuario
+paga la latencia del endpoint de OAuth salvo la primera de todas.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger('instatrip.tokens')
+
+
+class TokenManager:
+    """Token compartido y thread-safe obtenido con fetch() → (token, expires_in)"""
+
+    def __init__(self, fetch, name='token', refresh_margin=300, failure_backoff=5, wait_timeout=15):
+        self.fetch = fetch
+        self.name = name
+        self.refresh_margin = refresh_margin    # Segundos antes de caducar en que se renueva
+        self.failure_backoff = failure_backoff  # Tras un fallo, no reintentar durante N segundos
+        self.wait_timeout = wait_timeout        # Espera máxima al refresco de otro hilo
+        self._token = None
+        self._expires_at = 0
+        self._refresh_at = 0
+        self._refreshing = False
+        self._failed_until = 0
+        self._cond = threading.Condition()
+        self._refresher = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def _valid(self, now):
+        return self._token is not None and now < self._expires_at
+
+    def get(self):
+        """Devuelve un token válido o None si no se pudo obtener"""
+        with self._cond:
+            deadline = time.time() + self.wait_timeout
+            while True:
+                now = time.time()
+                if self._valid(now):
+                    return self._token
+                if now < self._failed_until:
+                    return None
+                if not self._refreshing:
+                    # Este hilo hace el refresco; los demás esperarán su resultado
+                    self._refreshing = True
+                    break
+                remaining = deadline - now
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    return self._token if self._valid(time.time()) else None
+
+        return self._refresh()
+
+    def current(self):
+        """El token si sigue siendo válido, sin esperar ni refrescar (None si no)"""
+        with self._cond:
+            return self._token if self._valid(time.time()) else None
+
+    def _refresh(self):
+        # Se llama con self._refreshing = True; hace la petición fuera del lock
+        token = None
+        expires_in = 0
+        try:
+            token, expires_in = self.fetch()
+        except Exception as e:
+            log.error("Error obteniendo %s: %s", self.name, e)
+
+        with self._cond:
+            now = time.time()
+            if token:
+                self._token = token
+                # Margen de seguridad de 60s para no usar un token a punto de caducar
+                self._expires_at = now + max(expires_in - 60, expires_in / 2)
+                # Con tokens muy cortos, renovar a mitad de vida en vez de en bucle
+                self._refresh_at = now + max(expires_in - self.refresh_margin, expires_in / 2)
+                self.refreshes += 1
+                self._start_refresher()
+            else:
+                self.failures += 1
+                self._failed_until = now + self.failure_backoff
+            self._refreshing = False
+            self._cond.notify_all()
+            return self._token if self._valid(now) else None
+
+    def _start_refresher(self):
+        # Se llama con self._cond adquirido
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name=f'{self.name}-refresher', daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        """Renueva el token refresh_margin segundos antes de que caduque"""
+        while True:
+            with self._cond:
+                now = time.time()
+                refresh_at = max(self._refresh_at, self._failed_until)
+                if now < refresh_at or self._refreshing:
+                    self._cond.wait(max(refresh_at - now, 1))
+                    continue
+                self._refreshing = True
+
+            self._refresh()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'valid': self._valid(time.time()),
+                'expires_in': max(0, round(self._expires_at - time.time())),
+                'refreshes': self.refreshes,
+                'failures': self.failures
+            }
@@ -0,0 +1,242 @@
+"""Identidad canónica de los videos de TikTok e Instagram a partir de su URL.
+
+El mismo video llega con muchas formas de URL: hosts móviles (m.tiktok.com),
+enlaces cortos de compartir (vm.tiktok.com/<código>, tiktok.com/t/<código>,
+instagram.com/share/<código>), posts /p/ frente a /reel/ y parámetros de
+seguimiento (?is_from_webapp=1, ?igsh=...). Todas deben dar la misma clave
+(plataforma:id) para que las cachés y la agrupación de peticiones acierten.
+
+La URL se separa primero en host y ruta: el host tiene que ser exactamente
+el de la plataforma o un subdominio suyo (evil.example/www.tiktok.com/...
+no es TikTok) y los patrones precompilados de la ruta se anclan a su
+inicio. Los enlaces cortos se resuelven una sola vez siguiendo sus
+redirecciones con HEAD, solo entre hosts de las plataformas, y la
+correspondencia corto → canónico se guarda en una caché persistente.
+"""
+import logging
+import re
+from urllib.parse import urljoin, urlsplit
+
+from singleflight import SingleFlight
+
+log = logging.getLogger('instatrip.video_urls')
+
+PLATFORM_HOSTS = {
+    'tiktok': re.compile(r'^(?:[\w-]+\.)*tiktok\.com$'),
+    'instagram': re.compile(r'^(?:[\w-]+\.)*(?:instagram\.com|instagr\.am)$')
+}
+
+# Enlaces cortos: no llevan el id del video, hay que seguir la redirección.
+# (host exacto, ruta): solo estos hosts reciben un HEAD del servidor
+SHORT_LINK_PATTERNS = {
+    'tiktok': (
+        (re.compile(r'^(?:vm|vt)\.tiktok\.com$'), re.compile(r'^/(?P<code>[\w-]+)/?$')),
+        (re.compile(r'^(?:www\.|m\.)?tiktok\.com$'), re.compile(r'^/t/(?P<code>[\w-]+)/?$')),
+    ),
+    'instagram': (
+        (re.compile(r'^(?:www\.)?instagram\.com$'), re.compile(r'^/share/(?:(?:reels?|p)/)?(?P<code>[\w-]+)/?$')),
+    )
+}
+
+VIDEO_PATTERNS = {
+    'tiktok': (
+        re.compile(r'^/@(?P<username>[\w.-]+)/(?:video|photo)/(?P<video_id>\d+)(?:/|$)'),
+        re.compile(r'^/v/(?P<video_id>\d+)(?:\.html)?(?:/|$)'),
+        re.compile(r'^/(?:embed/v2|embed|share/video|player/v1)/(?P<video_id>\d+)(?:/|$)'),
+    ),
+    'instagram': (
+        # /reel/, /reels/, /p/ y /tv/ comparten el mismo shortcode; a veces con el usuario delante
+        re.compile(r'^/(?:(?P<username>[\w.]+)/)?(?:reels?|p|tv)/(?P<video_id>[\w-]+)(?:/|$)'),
+    )
+}
+
+# Saltos máximos al seguir un enlace corto
+MAX_REDIRECTS = 5
+
+# Algunos hosts responden distinto (o no redirigen) a clientes que no parecen un navegador
+RESOLVER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+                  '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1'
+}
+
+
+def split_url(url):
+    """(host, puerto, ruta) de una URL http(s), con el host en minúsculas; None si no es http(s)"""
+    url = url.strip()
+    if '://' not in url:
+        url = f'https://{url}'
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    if parts.scheme.lower() not in ('http', 'https') or not parts.hostname:
+        return None
+    return parts.hostname.rstrip('.'), port, parts.path or '/'
+
+
+def url_platform(url, test_hosts=()):
+    """Plataforma de la URL según su host ('tiktok', 'instagram' o None).
+
+    test_hosts (host:puerto en minúsculas) son hosts cuyas rutas se aceptan
+    como de TikTok: solo para pruebas y benchmarks, vacío en producción.
+    """
+    parts = split_url(url)
+    if parts is None:
+        return None
+    host, port, _ = parts
+    if test_hosts and (f'{host}:{port}' if port else host) in test_hosts:
+        return 'tiktok'
+    for platform, pattern in PLATFORM_HOSTS.items():
+        if pattern.match(host):
+            return platform
+    return None
+
+
+def canonical_url(platform, video_id, username=None):
+    if platform == 'tiktok':
+        if username:
+            return f'https://www.tiktok.com/@{username}/video/{video_id}'
+        return f'https://m.tiktok.com/v/{video_id}.html'
+    return f'https://www.instagram.com/p/{video_id}/'
+
+
+def parse_video_url(url, test_hosts=()):
+    """Información del video sin acceder a la red.
+
+    Devuelve un dict con platform, video_id, username, short_code (si es un
+    enlace corto sin resolver), canonical_url y key ("plataforma:id" o None).
+    test_hosts como en url_platform.
+    """
+    info = {
+        'platform': None,
+        'video_id': None,
+        'username': None,
+        'short_code': None,
+        'canonical_url': None,
+        'key': None
+    }
+    platform = url_platform(url, test_hosts)
+    if platform is None:
+        return info
+    info['platform'] = platform
+    host, port, path = split_url(url)
+
+    # Un enlace corto en otro puerto no se sigue: solo los de la plataforma tal cual
+    if port is None:
+        for host_pattern, path_pattern in SHORT_LINK_PATTERNS[platform]:
+            match = path_pattern.match(path) if host_pattern.match(host) else None
+            if match:
+                info['short_code'] = match.group('code')
+                return info
+
+    for pattern in VIDEO_PATTERNS[platform]:
+        match = pattern.match(path)
+        if match:
+            groups = match.groupdict()
+            info['video_id'] = groups['video_id']
+            info['username'] = groups.get('username')
+            info['canonical_url'] = canonical_url(platform, info['video_id'], info['username'])
+            info['key'] = f"{platform}:{info['video_id']}"
+            return info
+    return info
+
+
+class VideoURLResolver:
+    """parse_video_url más la resolución (cacheada) de los enlaces cortos"""
+
+    def __init__(self, cache, session, ttl=30 * 24 * 3600, timeout=5, test_hosts=()):
+        # cache: TwoTierCache con "plataforma:código corto" → URL canónica
+        # session: UpstreamSession con la que se siguen las redirecciones
+        # test_hosts: hosts (host:puerto) aceptados como TikTok, solo en pruebas
+        self.cache = cache
+        self.session = session
+        self.ttl = ttl
+        self.timeout = timeout
+        self.test_hosts = frozenset(host.lower() for host in test_hosts)
+        self._flights = SingleFlight()  # Un solo HEAD por enlace corto aunque lleguen muchos a la vez
+        self.resolved = 0
+        self.failed = 0
+
+    def parse(self, url):
+        """parse_video_url con los hosts de prueba de este resolver"""
+        return parse_video_url(url, self.test_hosts)
+
+    def resolve(self, url):
+        """Como parse_video_url, pero un enlace corto se sustituye por el video al que apunta.
+
+        Si no se puede resolver, se devuelve la información del enlace corto
+        (con video_id None) para que el análisis siga funcionando sin caché.
+        """
+        info = self.parse(url)
+        if not info['short_code']:
+            return info
+
+        short_key = f"{info['platform']}:{info['short_code']}"
+        target = self.cache.get(short_key)
+        if target is None:
+            target = self._flights.run(short_key, lambda _: self._follow(url, short_key))
+        if not target:
+            return info
+
+        resolved = self.parse(target)
+        if not resolved['video_id']:
+            return info
+        resolved['short_code'] = info['short_code']
+        return resolved
+
+    def _follow(self, url, short_key):
+        """Sigue las redirecciones del enlace corto → URL canónica (o None)"""
+        url = url.strip()
+        if '://' not in url:
+            url = f'https://{url}'
+
+        try:
+            hops = self._redirect_chain(url)
+        except Exception as e:
+            self.failed += 1
+            log.warning("⚠️  No se pudo resolver el enlace corto %s: %s", url, e)
+            return None
+
+        # La URL del video puede estar en un salto intermedio (p. ej. antes de una página de login)
+        for hop in hops:
+            parsed = self.parse(hop)
+            if parsed['video_id']:
+                self.resolved += 1
+                self.cache.set(short_key, parsed['canonical_url'], self.ttl)
+                log.info("🔗 Enlace corto %s → %s", url, parsed['canonical_url'])
+                return parsed['canonical_url']
+
+        self.failed += 1
+        log.warning("⚠️  El enlace corto %s no lleva a un video (%s)", url, hops[-1])
+        return None
+
+    def _redirect_chain(self, url):
+        """URLs por las que pasa el enlace corto, hasta la del video.
+
+        Las redirecciones se siguen a mano y solo hacia hosts de TikTok o
+        Instagram: el servidor nunca hace peticiones a otros hosts.
+        """
+        hops = [url]
+        for _ in range(MAX_REDIRECTS):
+            response = self.session.head(url, allow_redirects=False, timeout=self.timeout, headers=RESOLVER_HEADERS)
+            if response.status_code == 405:
+                # HEAD no permitido: GET sin descargar el cuerpo
+                response = self.session.get(url, allow_redirects=False, timeout=self.timeout,
+                                            headers=RESOLVER_HEADERS, stream=True)
+                response.close()
+            if not response.is_redirect:
+                break
+
+            url = urljoin(url, response.headers['Location'])
+            hops.append(url)
+            if not url_platform(url, self.test_hosts) or self.parse(url)['video_id']:
+                break
+        return hops
+
+    def stats(self):
+        return {
+            'resolved': self.resolved,
+            'failed': self.failed,
+            'cache': self.cache.stats()
+        }